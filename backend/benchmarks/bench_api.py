@@ -0,0 +1,70 @@
+"""
+bench_api.py
+
+HTTP-level benchmarks of the read and export endpoints, served by uvicorn
+in a background thread against a synthetic dataset. Clerk is bypassed by
+resolving the user from an X-Bench-User header.
+"""
+
+import requests
+
+from .harness import result, repeat, start_api_server
+from .synthetic import make_image, populate
+
+HOST, PORT = "127.0.0.1", 8765
+BASE_URL = f"http://{HOST}:{PORT}/api"
+
+READ_ENDPOINTS = ["media", "media/heatmap", "media/folders", "media/export/summary", "media/non-blank"]
+EXPORT_ENDPOINTS = ["media/export/csv", "media/export/zip"]
+
+
+def _start_server():
+    from src.routes import routes
+    from src.utils.utils import UserObj
+
+    routes.authenticate_and_get_user = lambda request: UserObj(id=request.headers["X-Bench-User"])
+    return start_api_server(HOST, PORT)
+
+
+def _seed_objects(count: int = 20):
+    """Small JPEGs in local storage so ZIP export reads real bytes."""
+    from src.services.storage import storage
+    keys = [f"bench/objects/frame_{i:03d}.jpg" for i in range(count)]
+    for i, key in enumerate(keys):
+        storage.put_bytes(key, make_image(i, size=(640, 480), animal=True), content_type="image/jpeg")
+    return [storage.url_for(key) for key in keys]
+
+
+def run(sizes, repeats: int = 5, zip_max: int = 2000):
+    from src.database import models
+
+    server, thread = _start_server()
+    session = requests.Session()
+    results = []
+    try:
+        file_urls = _seed_objects()
+        db = models.SessionLocal()
+        try:
+            users = {size: populate(db, 1, size, seed=size, file_urls=file_urls)[0] for size in sizes}
+        finally:
+            db.close()
+
+        for size, user_id in users.items():
+            headers = {"X-Bench-User": user_id}
+
+            def get(endpoint):
+                response = session.get(f"{BASE_URL}/{endpoint}", headers=headers)
+                response.raise_for_status()
+                return response.content
+
+            for endpoint in READ_ENDPOINTS + EXPORT_ENDPOINTS:
+                if endpoint == "media/export/zip" and size > zip_max:
+                    continue
+                get(endpoint)  # warm-up
+                latencies = repeat(lambda: get(endpoint), repeats)
+                # throughput in media rows served per second
+                results.append(result(f"api.{endpoint}[{size}]", size * repeats, sum(latencies), latencies))
+    finally:
+        server.should_exit = True
+        thread.join(timeout=10)
+    return results
@@ -0,0 +1,52 @@
+"""
+bench_db.py
+
+CRUD layer benchmarks: create_media_batch (ORM path used by /media/batch)
+against bulk_insert_media (executemany path used by offline ingest), and
+list serialization through ORM objects + jsonable_encoder against the
+column-only iter_media_rows + serialization.dumps path. Both paths are timed
+at every size, so the 100k runs are slow but show the full gap.
+"""
+
+import json
+import random
+import time
+
+from .harness import result
+from .synthetic import make_media_files
+
+
+def run(sizes):
+    from src.database import models
+    from src.database.db import create_media_batch, bulk_insert_media, iter_media_rows, get_media_by_user
+    from src.utils.serialization import dumps
+    from fastapi.encoders import jsonable_encoder
+
+    results = []
+    rng = random.Random(1)
+    db = models.SessionLocal()
+    try:
+        for size in sizes:
+            files = make_media_files(rng, size)
+
+            start = time.perf_counter()
+            create_media_batch(db, f"db_bench_orm_{size}", [dict(f) for f in files])
+            results.append(result(f"db.create_media_batch[{size}]", size, time.perf_counter() - start))
+            db.expunge_all()
+
+            start = time.perf_counter()
+            bulk_insert_media(db, f"db_bench_bulk_{size}", files)
+            results.append(result(f"db.bulk_insert_media[{size}]", size, time.perf_counter() - start))
+
+            user_id = f"db_bench_bulk_{size}"
+            start = time.perf_counter()
+            json.dumps(jsonable_encoder(get_media_by_user(db, user_id)))
+            results.append(result(f"db.list_orm_serialize[{size}]", size, time.perf_counter() - start))
+            db.expunge_all()
+
+            start = time.perf_counter()
+            dumps(list(iter_media_rows(db, user_id)))
+            results.append(result(f"db.list_rows_serialize[{size}]", size, time.perf_counter() - start))
+    finally:
+        db.close()
+    return results
@@ -0,0 +1,34 @@
+"""
+bench_ml.py
+
+Per-image timings of the ML pipeline stages on synthetic frames (CPU).
+"""
+
+from .harness import result, repeat
+from .synthetic import make_image
+
+
+def run(n_images: int):
+    from src.services.ml import ml_service
+    if ml_service is None:
+        raise RuntimeError("ML Service not initialized. Check model paths.")
+
+    frames = [make_image(seed, animal=seed % 3 == 0) for seed in range(n_images)]
+    decoded = [ml_service.decode_image(frame) for frame in frames]
+
+    # Warm-up so lazy initialisation is not billed to the first image
+    ml_service.process_media(decoded[0])
+
+    stages = {
+        "decode": lambda i: ml_service.decode_image(frames[i]),
+        "classify": lambda i: ml_service.classify_image(decoded[i]),
+        "detect": lambda i: ml_service.detect_objects(decoded[i]),
+        "pipeline": lambda i: ml_service.process_media(frames[i]),
+    }
+
+    results = []
+    for stage, fn in stages.items():
+        counter = iter(range(n_images))
+        latencies = repeat(lambda: fn(next(counter)), n_images)
+        results.append(result(f"ml.{stage}", n_images, sum(latencies), latencies))
+    return results
@@ -0,0 +1,86 @@
+"""
+bench_presign.py
+
+Offline benchmark for presigned URL generation.
+
+Presigning is a local HMAC computation, so no bucket has to exist: dummy
+credentials are enough. Point AWS_S3_ENDPOINT_URL at a MinIO or moto server
+to also exercise the multipart calls against a real S3 API.
+
+Usage (from backend/):
+    python -m benchmarks.bench_presign --count 10000
+"""
+
+import argparse
+import os
+import time
+
+os.environ.setdefault("AWS_S3_BUCKET", "trapsense-bench")
+os.environ.setdefault("ACCESS_KEY", "bench-access-key")
+os.environ.setdefault("SECRET_ACCESS_KEY", "bench-secret-key")
+
+from src.services import s3  # noqa: E402  (env must be set before import)
+
+
+def bench_per_call(keys):
+    """Old path: one fresh client per presigned URL."""
+    start = time.perf_counter()
+    for key in keys:
+        client = s3._create_s3_client()
+        client.generate_presigned_url(
+            'put_object', Params={'Bucket': s3.BUCKET_NAME, 'Key': key, 'ContentType': "image/jpeg"}, ExpiresIn=3600
+        )
+    return time.perf_counter() - start
+
+
+def bench_bulk(keys, max_workers):
+    start = time.perf_counter()
+    s3.generate_presigned_put_urls(((key, "image/jpeg") for key in keys), max_workers=max_workers)
+    return time.perf_counter() - start
+
+
+def bench_multipart(part_count):
+    """Needs a reachable S3 API (AWS_S3_ENDPOINT_URL) because the upload is really created."""
+    start = time.perf_counter()
+    upload_id, _ = s3.create_multipart_upload("bench/large.tif", part_count, content_type="image/tiff")
+    elapsed = time.perf_counter() - start
+    s3.abort_multipart_upload("bench/large.tif", upload_id)
+    return elapsed
+
+
+def run(count: int, per_call_count: int = 200, workers: int = 1):
+    """Suite entry point for benchmarks.run: records for the per-call and bulk paths."""
+    from .harness import result
+
+    keys = [f"bench-user/folder/img_{i:06d}.jpg" for i in range(count)]
+    sample = keys[:per_call_count]
+    return [
+        result("presign.per_call_client", len(sample), bench_per_call(sample)),
+        result("presign.bulk", count, bench_bulk(keys, workers)),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=10000)
+    parser.add_argument("--per-call-count", type=int, default=200,
+                        help="the per-call baseline is slow, so it is sampled and extrapolated")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--multipart-parts", type=int, default=0)
+    args = parser.parse_args()
+
+    keys = [f"bench-user/folder/img_{i:06d}.jpg" for i in range(args.count)]
+
+    per_call = bench_per_call(keys[:args.per_call_count]) / args.per_call_count
+    bulk = bench_bulk(keys, args.workers) / args.count
+
+    print(f"per-call client : {per_call * 1e6:9.1f} us/url  (~{per_call * args.count:.2f}s for {args.count})")
+    print(f"bulk presign    : {bulk * 1e6:9.1f} us/url  ({bulk * args.count:.2f}s for {args.count})")
+    print(f"speedup         : {per_call / bulk:9.1f}x")
+
+    if args.multipart_parts:
+        print(f"multipart init  : {bench_multipart(args.multipart_parts):.3f}s for {args.multipart_parts} parts")
+
+
+if __name__ == "__main__":
+    main()
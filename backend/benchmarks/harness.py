@@ -0,0 +1,75 @@
+"""
+harness.py
+
+Shared helpers for the benchmark suites: offline environment setup, timing
+and result records.
+"""
+
+import os
+import statistics
+import threading
+import time
+from typing import Callable, Dict, List
+
+
+def configure_offline_env(workdir: str):
+    """
+    Point the app at a throwaway SQLite DB and local storage under workdir.
+    Must run before anything under src/ is imported.
+    """
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ["DB_ECHO"] = "0"
+    os.environ["STORAGE_BACKEND"] = "local"
+    os.environ["STORAGE_LOCAL_ROOT"] = os.path.join(workdir, "storage")
+    os.environ.setdefault("STORAGE_SIGNING_SECRET", "bench-secret")
+    os.environ.setdefault("STORAGE_PUBLIC_URL", "http://127.0.0.1:8765/api/storage")
+    os.environ.setdefault("AWS_S3_BUCKET", "trapsense-bench")
+    os.environ.setdefault("ACCESS_KEY", "bench-access-key")
+    os.environ.setdefault("SECRET_ACCESS_KEY", "bench-secret-key")
+
+
+def result(name: str, items: int, seconds: float, latencies: List[float] = None) -> Dict:
+    """One benchmark record. throughput is items per second and is what regressions are judged on."""
+    record = {
+        "name": name,
+        "items": items,
+        "seconds": round(seconds, 6),
+        "throughput": round(items / seconds, 3) if seconds > 0 else None,
+    }
+    if latencies:
+        ordered = sorted(latencies)
+        record["p50_ms"] = round(statistics.median(ordered) * 1000, 3)
+        record["p95_ms"] = round(percentile(ordered, 0.95) * 1000, 3)
+        record["p99_ms"] = round(percentile(ordered, 0.99) * 1000, 3)
+    return record
+
+
+def percentile(ordered: List[float], q: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+def start_api_server(host: str, port: int):
+    """Serve src.app with uvicorn in a daemon thread; returns (server, thread) once it accepts requests."""
+    import uvicorn
+    from src.app import app
+
+    server = uvicorn.Server(uvicorn.Config(app, host=host, port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    deadline = time.time() + 30
+    while not server.started:
+        if time.time() > deadline:
+            raise RuntimeError("Benchmark server did not start")
+        time.sleep(0.05)
+    return server, thread
+
+
+def repeat(fn: Callable, repeats: int) -> List[float]:
+    """Call fn repeats times and return the individual wall-clock durations."""
+    durations = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        durations.append(time.perf_counter() - start)
+    return durations
@@ -0,0 +1,305 @@
+"""
+loadtest.py
+
+End-to-end load test of the upload -> inference -> export flow that runs on
+one offline box. Stand-ins for the external services:
+
+- auth: tokens from the local JWT issuer (src/utils/local_jwt.py); the API
+  trusts them through LOCAL_JWT_SECRET, so every request still goes through
+  authenticate_and_get_user
+- storage: local storage behind the /api/storage routes (default), or an
+  in-process moto S3 server with --storage moto (pip install "moto[server]")
+- models: StubMLService (--models stub, default) or the real weights on CPU
+  (--models cpu)
+
+Every simulated user runs in its own thread:
+    presign-batch -> PUT images -> POST /media/batch    (per batch)
+    -> poll GET /media until every image is classified
+    -> GET /media/export/summary
+    -> POST /media/export/jobs -> poll -> download the archive
+
+The report has p50/p95/p99 latency and throughput for every endpoint and the
+end-to-end image rate, in the same JSON layout as benchmarks.run.
+
+Usage (from backend/):
+    python -m benchmarks.loadtest --users 20 --images 100 --batch-size 25
+    python -m benchmarks.loadtest --models cpu --users 4 --images 50
+    python -m benchmarks.loadtest --base-url http://127.0.0.1:8000/api --jwt-secret $LOCAL_JWT_SECRET
+"""
+
+import argparse
+import json
+import os
+import platform
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import requests
+
+from .harness import configure_offline_env, result, start_api_server
+
+HOST, PORT = "127.0.0.1", 8765
+MOTO_PORT = 8766
+DEFAULT_JWT_SECRET = "loadtest-secret"
+
+
+def configure_load_env(workdir: str, models: str, storage: str):
+    """Offline env plus the auth / model / storage stand-ins. Must run before src/ is imported."""
+    configure_offline_env(workdir)
+    os.environ["STORAGE_PUBLIC_URL"] = f"http://{HOST}:{PORT}/api/storage"
+    os.environ.setdefault("LOCAL_JWT_SECRET", DEFAULT_JWT_SECRET)
+    os.environ["EMBEDDINGS_ENABLED"] = "0"
+    os.environ["EMBEDDING_DIR"] = os.path.join(workdir, "embeddings")
+    if models == "stub":
+        os.environ["ML_MODELS"] = "stub"
+    else:
+        os.environ["ML_MODELS"] = "yolo"
+        os.environ["ML_DEVICE"] = "cpu"
+    if storage == "moto":
+        os.environ["STORAGE_BACKEND"] = "s3"
+        os.environ["AWS_S3_ENDPOINT_URL"] = f"http://{HOST}:{MOTO_PORT}"
+
+
+def start_moto():
+    """In-process S3 API with the configured bucket created."""
+    import boto3
+    from moto.server import ThreadedMotoServer
+
+    server = ThreadedMotoServer(ip_address=HOST, port=MOTO_PORT)
+    server.start()
+    boto3.client(
+        "s3", endpoint_url=os.environ["AWS_S3_ENDPOINT_URL"], region_name=os.getenv("AWS_REGION", "ap-south-1"),
+        aws_access_key_id=os.environ["ACCESS_KEY"], aws_secret_access_key=os.environ["SECRET_ACCESS_KEY"],
+    ).create_bucket(
+        Bucket=os.environ["AWS_S3_BUCKET"],
+        CreateBucketConfiguration={"LocationConstraint": os.getenv("AWS_REGION", "ap-south-1")},
+    )
+    return server
+
+
+class Recorder:
+    """Thread-safe latency samples and status codes per endpoint"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(Counter)
+
+    def request(self, session: requests.Session, method: str, url: str, name: str, **kwargs) -> requests.Response:
+        start = time.perf_counter()
+        try:
+            response = session.request(method, url, timeout=120, **kwargs)
+            status = response.status_code
+        except requests.RequestException:
+            response, status = None, "error"
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.latencies[name].append(elapsed)
+            self.statuses[name][status] += 1
+        if response is None:
+            raise RuntimeError(f"{name}: connection failed")
+        return response
+
+    def report(self, wall_seconds: float):
+        records = []
+        for name in sorted(self.latencies):
+            latencies = self.latencies[name]
+            record = result(f"load.{name}", len(latencies), wall_seconds, latencies)
+            record["mean_ms"] = round(sum(latencies) / len(latencies) * 1000, 3)
+            record["statuses"] = {str(k): v for k, v in self.statuses[name].items()}
+            records.append(record)
+        return records
+
+
+class SimulatedUser:
+    def __init__(self, index: int, args, base_url: str, images, recorder: Recorder):
+        from src.utils.local_jwt import issue_token
+
+        self.user_id = f"load-user-{index:04d}"
+        self.index = index
+        self.args = args
+        self.base_url = base_url
+        self.images = images
+        self.recorder = recorder
+        self.session = requests.Session()
+        self.session.headers["Authorization"] = (
+            f"Bearer {issue_token(self.user_id, secret=args.jwt_secret, ttl=24 * 3600)}"
+        )
+        self.timings = {}
+
+    def call(self, method: str, path: str, name: str = None, expect=(200,), **kwargs) -> requests.Response:
+        """API call with admission backpressure honoured: 429 sleeps Retry-After and retries."""
+        while True:
+            response = self.recorder.request(self.session, method, f"{self.base_url}/{path}",
+                                             name or f"{method} /{path}", **kwargs)
+            if response.status_code == 429:
+                time.sleep(float(response.headers.get("Retry-After", "1")))
+                continue
+            if response.status_code not in expect:
+                raise RuntimeError(f"{method} /{path}: {response.status_code} {response.text[:200]}")
+            return response
+
+    def upload(self):
+        self.call("POST", "users", expect=(200, 400),
+                  json={"email": f"{self.user_id}@loadtest.local", "name": self.user_id})
+        count, batch_size = self.args.images, self.args.batch_size
+        for start in range(0, count, batch_size):
+            names = [
+                f"site_{self.index % 7:02d}/camera_{(start // batch_size) % 3}/IMG_{i:06d}.JPG"
+                for i in range(start, min(count, start + batch_size))
+            ]
+            files = self.call("POST", "media/presign-batch", json={"file_names": names}).json()["files"]
+            for i, f in enumerate(files):
+                # Storage PUTs go to the presigned URL itself (local route or moto), not the API
+                response = self.recorder.request(
+                    self.session, "PUT", f["upload_url"], "PUT presigned upload",
+                    data=self.images[(self.index + start + i) % len(self.images)],
+                    headers={"Content-Type": "image/jpeg", "Authorization": None},
+                )
+                if response.status_code not in (200, 201, 204):
+                    raise RuntimeError(f"Upload failed: {response.status_code} {response.text[:200]}")
+            self.call("POST", "media/batch", json={"files": [
+                {"file_url": f["file_url"], "folder_path": name.rsplit("/", 1)[0]} for f, name in zip(files, names)
+            ]})
+
+    def wait_processed(self):
+        etag, media = None, []
+        deadline = time.time() + self.args.timeout
+        while time.time() < deadline:
+            headers = {"If-None-Match": etag} if etag else {}
+            response = self.call("GET", "media", expect=(200, 304), headers=headers)
+            if response.status_code == 200:
+                etag, media = response.headers.get("ETag"), response.json()
+                if len(media) >= self.args.images and all(m.get("classification") for m in media):
+                    return
+            time.sleep(self.args.poll_interval)
+        raise RuntimeError(f"{self.user_id}: images not processed within {self.args.timeout}s")
+
+    def export(self):
+        job = self.call("POST", "media/export/jobs", expect=(200, 202, 404)).json()
+        if not job.get("job_id"):
+            return  # nothing non-blank to export
+        deadline = time.time() + self.args.timeout
+        while job["status"] in ("pending", "running"):
+            if time.time() > deadline:
+                raise RuntimeError(f"{self.user_id}: export not finished within {self.args.timeout}s")
+            time.sleep(self.args.poll_interval)
+            job = self.call("GET", f"media/export/jobs/{job['job_id']}", name="GET /media/export/jobs/{id}").json()
+        if job["status"] != "completed":
+            raise RuntimeError(f"{self.user_id}: export {job['status']}: {job.get('error')}")
+        response = self.recorder.request(self.session, "GET", job["download_url"], "GET export archive",
+                                         headers={"Authorization": None})
+        response.raise_for_status()
+
+    def run(self):
+        phases = (
+            ("upload", self.upload),
+            ("processing", self.wait_processed),
+            ("summary", lambda: self.call("GET", "media/export/summary")),
+            ("export", self.export),
+        )
+        for phase, fn in phases:
+            start = time.perf_counter()
+            fn()
+            self.timings[phase] = time.perf_counter() - start
+        return self.timings
+
+
+def run(args):
+    """Run the workload; returns the list of result records."""
+    from .synthetic import make_image
+
+    server = moto = None
+    if not args.base_url:
+        if args.storage == "moto":
+            moto = start_moto()
+        server, thread = start_api_server(HOST, PORT)
+    base_url = (args.base_url or f"http://{HOST}:{PORT}/api").rstrip("/")
+
+    width, height = (int(v) for v in args.image_size.split("x"))
+    # A third of the frames carry an "animal" so the detector and the export have work
+    images = [make_image(seed, size=(width, height), animal=seed % 3 == 0) for seed in range(args.distinct_images)]
+
+    recorder = Recorder()
+    users = [SimulatedUser(i, args, base_url, images, recorder) for i in range(args.users)]
+    started = time.perf_counter()
+    failures = []
+    try:
+        with ThreadPoolExecutor(max_workers=args.users, thread_name_prefix="load-user") as pool:
+            futures = [pool.submit(user.run) for user in users]
+            for user, future in zip(users, futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    failures.append(f"{user.user_id}: {e}")
+    finally:
+        wall = time.perf_counter() - started
+        if server is not None:
+            server.should_exit = True
+            thread.join(timeout=10)
+        if moto is not None:
+            moto.stop()
+
+    records = recorder.report(wall)
+    completed = [u.timings for u in users if "export" in u.timings]
+    images_done = len(completed) * args.images
+    records.append(result("load.pipeline_images", images_done, wall))
+    for phase in ("upload", "processing", "summary", "export"):
+        durations = [t[phase] for t in completed]
+        if durations:
+            records.append(result(f"load.phase.{phase}", len(durations), sum(durations), durations))
+    return records, failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=10, help="concurrent simulated users")
+    parser.add_argument("--images", type=int, default=50, help="images uploaded per user")
+    parser.add_argument("--batch-size", type=int, default=25, help="images per presign/batch request")
+    parser.add_argument("--image-size", default="1280x720")
+    parser.add_argument("--distinct-images", type=int, default=24, help="synthetic frames to cycle through")
+    parser.add_argument("--models", choices=("stub", "cpu"), default="stub")
+    parser.add_argument("--storage", choices=("local", "moto"), default="local")
+    parser.add_argument("--base-url", help="target an already running API instead of starting one")
+    parser.add_argument("--jwt-secret", default=os.getenv("LOCAL_JWT_SECRET", DEFAULT_JWT_SECRET))
+    parser.add_argument("--poll-interval", type=float, default=1.0)
+    parser.add_argument("--timeout", type=float, default=900, help="seconds per user for processing and export")
+    parser.add_argument("--output", default="loadtest_results.json")
+    args = parser.parse_args()
+
+    if not args.base_url:
+        workdir = tempfile.mkdtemp(prefix="trapsense-load-")
+        os.environ["LOCAL_JWT_SECRET"] = args.jwt_secret
+        configure_load_env(workdir, args.models, args.storage)
+
+    records, failures = run(args)
+
+    print(f"{'endpoint':<40} {'n':>6} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}  statuses")
+    for r in records:
+        print(f"{r['name']:<40} {r['items']:>6} {r['throughput'] or 0:>8.2f} {r.get('p50_ms', 0):>9.1f} "
+              f"{r.get('p95_ms', 0):>9.1f} {r.get('p99_ms', 0):>9.1f}  {r.get('statuses', '')}")
+    for failure in failures:
+        print(f"FAILED {failure}")
+
+    report = {
+        "created_at": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "config": {k: v for k, v in vars(args).items() if k != "jwt_secret"},
+        "failures": failures,
+        "results": records,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+    if failures:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+run.py
+
+Benchmark runner. Runs the selected suites offline on CPU, writes the results
+as JSON and compares throughput against a stored baseline.
+
+Usage (from backend/):
+    python -m benchmarks.run --suites db,api,presign --output bench_results.json
+    python -m benchmarks.run --suites ml,db,api --save-baseline benchmarks/baseline.json
+    python -m benchmarks.run --suites ml,db,api --baseline benchmarks/baseline.json
+
+Throughput depends on the machine, so no baseline is committed: save one on
+the machine that runs the comparison first. A missing --baseline file skips
+the comparison with a message instead of failing after the run.
+
+Exits with status 1 when any benchmark's throughput drops more than
+--tolerance below its baseline.
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+from datetime import datetime
+
+from .harness import configure_offline_env
+
+SUITES = ("ml", "db", "api", "presign")
+
+
+def compare(results, baseline, tolerance: float):
+    """Return a list of (name, baseline, current) for throughput regressions."""
+    previous = {r["name"]: r for r in baseline.get("results", [])}
+    regressions = []
+    for r in results:
+        base = previous.get(r["name"])
+        if not base or not base.get("throughput") or r["throughput"] is None:
+            continue
+        if r["throughput"] < base["throughput"] * (1 - tolerance):
+            regressions.append((r["name"], base["throughput"], r["throughput"]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--suites", default="db,api,presign", help=f"comma separated, from {', '.join(SUITES)}")
+    parser.add_argument("--db-sizes", default="1000,10000,100000")
+    parser.add_argument("--api-sizes", default="1000,10000")
+    parser.add_argument("--ml-images", type=int, default=20)
+    parser.add_argument("--presign-count", type=int, default=10000)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--baseline", help="compare against this results file")
+    parser.add_argument("--save-baseline", help="also write the results here as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed fractional throughput drop")
+    args = parser.parse_args()
+
+    suites = [s.strip() for s in args.suites.split(",") if s.strip()]
+    unknown = set(suites) - set(SUITES)
+    if unknown:
+        parser.error(f"unknown suites: {', '.join(sorted(unknown))}")
+
+    # Read before running, so --save-baseline to the same path compares against the old results
+    baseline = None
+    if args.baseline:
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        else:
+            print(f"Baseline {args.baseline} not found; skipping the comparison "
+                  f"(create one with --save-baseline {args.baseline})")
+
+    workdir = tempfile.mkdtemp(prefix="trapsense-bench-")
+    configure_offline_env(workdir)
+
+    results = []
+    for suite in suites:
+        print(f"== {suite}", flush=True)
+        if suite == "ml":
+            from . import bench_ml
+            suite_results = bench_ml.run(args.ml_images)
+        elif suite == "db":
+            from . import bench_db
+            suite_results = bench_db.run([int(n) for n in args.db_sizes.split(",")])
+        elif suite == "api":
+            from . import bench_api
+            suite_results = bench_api.run([int(n) for n in args.api_sizes.split(",")], repeats=args.repeats)
+        else:
+            from . import bench_presign
+            suite_results = bench_presign.run(args.presign_count)
+        for r in suite_results:
+            print(f"  {r['name']:<45} {r['throughput'] or 0:>12.1f} items/s  {r['seconds']:>9.3f}s")
+        results.extend(suite_results)
+
+    report = {
+        "created_at": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved to {args.save_baseline}")
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.tolerance)
+        for name, before, after in regressions:
+            print(f"REGRESSION {name}: {before:.1f} -> {after:.1f} items/s ({after / before - 1:+.1%})")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions beyond {args.tolerance:.0%} against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
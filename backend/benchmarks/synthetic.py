@@ -0,0 +1,114 @@
+"""
+synthetic.py
+
+Deterministic synthetic data for the benchmark suite: camera-trap-like JPEGs,
+realistic detection JSON and populated users/media tables.
+"""
+
+import io
+import random
+from datetime import datetime, timedelta
+from typing import List
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from src.utils.detections import Detections
+
+SPECIES = ["zebra", "wildebeest", "gazelle", "elephant", "lion", "giraffe", "buffalo", "hyena", "human", "vehicle"]
+BLANK_RATIO = 0.7
+
+
+def make_image(seed: int, size=(1920, 1080), animal: bool = False, quality: int = 85) -> bytes:
+    """Noisy savanna-like frame, optionally with a dark blob standing in for an animal."""
+    rng = np.random.default_rng(seed)
+    w, h = size
+    gradient = np.linspace(140, 90, h, dtype=np.float32)[:, None, None]
+    base = np.concatenate([gradient * 1.1, gradient, gradient * 0.6], axis=2)
+    noise = rng.normal(0, 12, size=(h, w, 3)).astype(np.float32)
+    frame = np.clip(np.broadcast_to(base, (h, w, 3)) + noise, 0, 255).astype(np.uint8)
+    image = Image.fromarray(frame, "RGB")
+    if animal:
+        draw = ImageDraw.Draw(image)
+        x, y = int(rng.integers(0, w - 400)), int(rng.integers(h // 3, h - 250))
+        draw.ellipse([x, y, x + int(rng.integers(150, 400)), y + int(rng.integers(100, 250))], fill=(45, 35, 30))
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+def make_detections(rng: random.Random, width: int = 1920, height: int = 1080) -> List[dict]:
+    """Detector output in the same shape MLService.detect_objects returns."""
+    detections = []
+    for _ in range(rng.choice([1, 1, 1, 2, 2, 3, 5, 8])):
+        class_id = rng.randrange(len(SPECIES))
+        x1, y1 = rng.uniform(0, width * 0.8), rng.uniform(0, height * 0.8)
+        detections.append({
+            "bbox": [x1, y1, x1 + rng.uniform(40, width * 0.2), y1 + rng.uniform(40, height * 0.2)],
+            "confidence": rng.uniform(0.25, 0.99),
+            "class_id": class_id,
+            "class_name": SPECIES[class_id],
+        })
+    return detections
+
+
+def make_media_files(rng: random.Random, count: int, file_urls: List[str] = None) -> List[dict]:
+    """Input rows for create_media_batch / bulk_insert_media."""
+    files = []
+    for i in range(count):
+        camera = f"site_{rng.randrange(20):02d}/camera_{rng.randrange(4)}"
+        file_name = f"IMG_{i:07d}.JPG"
+        files.append({
+            "file_url": file_urls[i % len(file_urls)] if file_urls else f"https://bench.invalid/{camera}/{file_name}",
+            "file_type": "image",
+            "folder_path": f"{camera}/{file_name}",
+        })
+    return files
+
+
+def make_results(rng: random.Random, media_ids: List[str], blank_ratio: float = BLANK_RATIO) -> List[dict]:
+    """Prediction rows for bulk_update_media_predictions (detections in the pipeline's array form)."""
+    results = []
+    for media_id in media_ids:
+        if rng.random() < blank_ratio:
+            results.append({"id": media_id, "classification": "blank", "confidence": rng.uniform(0.6, 1.0),
+                            "species": None, "predictions": None})
+        else:
+            detections = make_detections(rng)
+            results.append({
+                "id": media_id,
+                "classification": "non-blank",
+                "confidence": rng.uniform(0.5, 1.0),
+                "species": ",".join(sorted({d["class_name"] for d in detections})),
+                "predictions": Detections.from_dicts(detections),
+            })
+    return results
+
+
+def populate(db, n_users: int, media_per_user: int, seed: int = 0, file_urls: List[str] = None,
+             blank_ratio: float = BLANK_RATIO, batch_size: int = 5000) -> List[str]:
+    """
+    Create n_users users with media_per_user processed media each.
+
+    file_urls, when given, are cycled through so exports have real objects to read.
+    Returns the created user ids.
+    """
+    from src.database import models
+    from src.database.db import bulk_insert_media, bulk_update_media_predictions
+
+    rng = random.Random(seed)
+    user_ids = []
+    for u in range(n_users):
+        user_id = f"bench_user_{seed}_{u}"
+        db.merge(models.User(id=user_id, email=f"{user_id}@bench.invalid", name=f"Bench {u}",
+                             created_at=datetime.now() - timedelta(days=30)))
+        db.commit()
+        user_ids.append(user_id)
+
+        remaining = media_per_user
+        while remaining > 0:
+            count = min(batch_size, remaining)
+            ids = bulk_insert_media(db, user_id, make_media_files(rng, count, file_urls))
+            bulk_update_media_predictions(db, make_results(rng, ids, blank_ratio))
+            remaining -= count
+    return user_ids
@@ -0,0 +1,256 @@
+"""
+ingest.py
+
+Offline bulk ingest for camera trap memory cards, bypassing the HTTP API.
+
+Walks a directory, registers every image as a Media row in bulk, runs the ML
+pipeline across a process pool and writes predictions back in batches.
+Re-running the same command resumes: files already registered are not
+inserted again and only unprocessed rows are sent to the models.
+
+Without --upload, rows point at the originals in place (file:// URLs). Only
+this CLI reads those paths; the API refuses to fetch local files, so such
+rows cannot be exported or reprocessed through it.
+
+Usage (from backend/):
+    python ingest.py /mnt/sdcard --user-id user_123 --workers 4
+    python ingest.py /mnt/sdcard --user-id user_123 --upload   # also copy originals into storage
+"""
+
+import argparse
+import hashlib
+import logging
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from multiprocessing import get_context
+from pathlib import Path
+
+# SQL echo would print every bulk statement
+os.environ.setdefault("DB_ECHO", "0")
+
+from src.database import models  # noqa: E402
+from src.database.db import bulk_insert_media, bulk_update_media_predictions  # noqa: E402
+from src.services.embeddings import embedding_store  # noqa: E402
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+logger = logging.getLogger("ingest")
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".tif", ".tiff", ".webp"}
+
+
+# ------------------ Discovery ------------------
+
+def iter_images(root: Path):
+    """Yield image paths under root lazily (no full directory listing in memory)."""
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        try:
+            with os.scandir(directory) as entries:
+                for entry in sorted(entries, key=lambda e: e.name):
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(Path(entry.path))
+                    elif entry.is_file() and os.path.splitext(entry.name)[1].lower() in IMAGE_EXTENSIONS:
+                        yield Path(entry.path)
+        except PermissionError as e:
+            logger.warning(f"Skipping unreadable directory {directory}: {e}")
+
+
+def _batched(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def discover_tasks(db, root: Path, user_id: str, batch_size: int, upload: bool):
+    """
+    Register new files in bulk and yield (media_id, path, upload_key) for every
+    file that still needs inference, including ones left over from an earlier run.
+    """
+    from src.services.storage import storage
+
+    for paths in _batched(iter_images(root), batch_size):
+        entries = {}
+        for path in paths:
+            relative = path.relative_to(root).as_posix()
+            upload_key = f"{user_id}/{relative}" if upload else None
+            file_url = storage.url_for(upload_key) if upload else path.resolve().as_uri()
+            entries[file_url] = (path, relative, upload_key)
+
+        rows = (
+            db.query(models.Media.file_url, models.Media.id, models.Media.is_processed)
+            .filter(models.Media.user_id == user_id, models.Media.file_url.in_(list(entries)))
+            .all()
+        )
+        existing = {url: media_id for url, media_id, _ in rows}
+        processed = {media_id for _, media_id, is_processed in rows if is_processed}
+
+        new_urls = [url for url in entries if url not in existing]
+        new_ids = bulk_insert_media(db, user_id, [
+            {"file_url": url, "file_type": "image", "folder_path": entries[url][1]} for url in new_urls
+        ])
+        existing.update(zip(new_urls, new_ids))
+
+        for url, (path, _, upload_key) in entries.items():
+            media_id = existing[url]
+            if media_id not in processed:
+                yield media_id, str(path), upload_key
+
+
+# ------------------ Worker processes ------------------
+
+_ml_service = None
+
+
+def _init_worker(torch_threads: int):
+    global _ml_service
+    import torch
+    torch.set_num_threads(torch_threads)
+    from src.services.ml import ml_service
+    if ml_service is None:
+        raise RuntimeError("ML Service not initialized. Check model paths.")
+    _ml_service = ml_service
+
+
+def _infer_file(media_id: str, path: str, upload_key: str = None) -> dict:
+    """Run the ML pipeline on one file (executes in a worker process)."""
+    try:
+        with open(path, "rb") as f:
+            image_bytes = f.read()
+        if upload_key:
+            from src.services.storage import storage
+            storage.put_bytes(upload_key, image_bytes)
+        result = _ml_service.process_media(image_bytes)
+        return {
+            "id": media_id,
+            "classification": result["classification"],
+            "confidence": result["confidence"],
+            "species": result["species"],
+            "predictions": result["predictions"],
+            "content_hash": hashlib.sha256(image_bytes).hexdigest(),
+            "model_version": _ml_service.model_version,
+            "embedding": result.get("embedding"),
+            "embedding_space": _ml_service.weights_digest,
+        }
+    except Exception as e:
+        return {
+            "id": media_id,
+            "classification": "error",
+            "confidence": 0.0,
+            "species": None,
+            "predictions": {"error": str(e)},
+        }
+
+
+# ------------------ Main loop ------------------
+
+class Progress:
+    def __init__(self, every: float = 10.0):
+        self.start = time.perf_counter()
+        self.last_report = self.start
+        self.every = every
+        self.done = 0
+        self.errors = 0
+        self.blank = 0
+
+    def add(self, result: dict):
+        self.done += 1
+        self.errors += result["classification"] == "error"
+        self.blank += result["classification"] == "blank"
+
+    def report(self, force: bool = False):
+        now = time.perf_counter()
+        if not force and now - self.last_report < self.every:
+            return
+        self.last_report = now
+        elapsed = now - self.start
+        rate = self.done / elapsed if elapsed else 0.0
+        logger.info(
+            f"{self.done} images in {elapsed:.1f}s ({rate:.2f} img/s), "
+            f"{self.blank} blank, {self.errors} errors"
+        )
+
+
+def run(args) -> int:
+    root = Path(args.directory).resolve()
+    if not root.is_dir():
+        logger.error(f"Not a directory: {root}")
+        return 1
+
+    db = models.SessionLocal()
+    progress = Progress()
+    pending_results = []
+
+    def flush():
+        if pending_results:
+            bulk_update_media_predictions(db, pending_results)
+            pending_results.clear()
+
+    executor = ProcessPoolExecutor(
+        max_workers=args.workers,
+        mp_context=get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(args.torch_threads,),
+    )
+    in_flight = set()
+    max_in_flight = args.workers * 4
+
+    def collect(done):
+        for future in done:
+            result = future.result()
+            # Workers only compute embeddings; this process is the single writer of the index
+            embedding = result.pop("embedding", None)
+            space = result.pop("embedding_space", None)
+            if embedding is not None and embedding_store is not None:
+                embedding_store.add(args.user_id, result["id"], embedding, space)
+            pending_results.append(result)
+            progress.add(result)
+        if len(pending_results) >= args.batch_size:
+            flush()
+        progress.report()
+
+    try:
+        for media_id, path, upload_key in discover_tasks(db, root, args.user_id, args.batch_size, args.upload):
+            in_flight.add(executor.submit(_infer_file, media_id, path, upload_key))
+            if len(in_flight) >= max_in_flight:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                collect(done)
+        while in_flight:
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            collect(done)
+    except KeyboardInterrupt:
+        logger.warning("Interrupted; saving finished results. Re-run the same command to resume.")
+        executor.shutdown(wait=False, cancel_futures=True)
+        collect([f for f in in_flight if f.done() and not f.cancelled()])
+        return 130
+    finally:
+        flush()
+        executor.shutdown(wait=True, cancel_futures=True)
+        progress.report(force=True)
+        db.close()
+
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("directory", help="directory to ingest (e.g. a mounted SD card)")
+    parser.add_argument("--user-id", required=True, help="owner of the ingested media")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) - 1))
+    parser.add_argument("--torch-threads", type=int, default=1, help="torch threads per worker process")
+    parser.add_argument("--batch-size", type=int, default=500, help="rows per DB insert/update batch")
+    parser.add_argument("--upload", action="store_true",
+                        help="copy originals into the configured storage backend instead of referencing them in place")
+    args = parser.parse_args()
+    sys.exit(run(args))
+
+
+if __name__ == "__main__":
+    main()
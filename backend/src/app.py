@@ -1,6 +1,10 @@
 from fastapi import FastAPI, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from src.routes import routes
+from src.utils.metrics import registry
+from src.utils.profiling import ProfilingMiddleware
+from src.utils.tracing import TracingMiddleware
 
 
 app = FastAPI()
@@ -15,5 +19,17 @@ app.add_middleware(
 )
 
 
+# Opt-in sampling profiler (X-Profile: 1 with admin auth, or PROFILE_SAMPLE_RATE)
+app.add_middleware(ProfilingMiddleware)
+
+# Root span per request; trace context follows queued work into the worker
+app.add_middleware(TracingMiddleware)
+
 # Include your router - all endpoints are in routes.router
 app.include_router(routes.router, prefix="/api")
+
+
+# Prometheus scrape endpoint (pipeline stage histograms, queue depth, throughput)
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
@@ -6,13 +6,24 @@ This file contains functions to interact with the database:
 
 """
 
+from sqlalchemy import insert, update, func, or_, and_
 from sqlalchemy.orm import Session
 from datetime import datetime
+from collections import defaultdict
 from . import models
+from ..utils.detections import Detections, predictions_view
+import json
 import uuid
 import random
 
 
+def _prediction_columns(predictions) -> tuple:
+    """(detections blob, predictions JSON) for a pipeline result or a legacy dict/list."""
+    if isinstance(predictions, Detections):
+        return (predictions.to_bytes() if len(predictions) else None), None
+    return None, (json.dumps(predictions) if predictions else None)
+
+
 # ---------------- Users ----------------
 def get_user_by_id(db: Session, user_id: str):
     return db.query(models.User).filter(models.User.id == user_id).first()
@@ -26,6 +37,61 @@ def create_user(db: Session, user_id: str, email: str, name: str = None):
     return db_user
 
 
+# ---------------- Data versions ----------------
+def get_data_version(db: Session, user_id: str) -> int:
+    """Current data version for a user (0 if they have never written media)."""
+    version = db.query(models.DataVersion.version).filter(models.DataVersion.user_id == user_id).scalar()
+    return version or 0
+
+
+def bump_data_version(db: Session, user_ids) -> None:
+    """
+    Increment the data version of each user. Called by every media write before
+    its commit, so the bump lands in the same transaction as the change.
+
+    One INSERT ... ON CONFLICT DO UPDATE per call, so concurrent first writes of a
+    new user cannot both try to insert the row.
+    """
+    user_ids = sorted(set(user_ids))  # fixed order, so concurrent bumps lock rows alike
+    if not user_ids:
+        return
+    now = datetime.now()
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as upsert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as upsert
+    else:
+        for user_id in user_ids:
+            result = db.execute(
+                update(models.DataVersion)
+                .where(models.DataVersion.user_id == user_id)
+                .values(version=models.DataVersion.version + 1, updated_at=now)
+            )
+            if result.rowcount == 0:
+                db.add(models.DataVersion(user_id=user_id, version=1, updated_at=now))
+        return
+    statement = upsert(models.DataVersion).values(
+        [{"user_id": user_id, "version": 1, "updated_at": now} for user_id in user_ids]
+    )
+    db.execute(statement.on_conflict_do_update(
+        index_elements=[models.DataVersion.user_id],
+        set_={"version": models.DataVersion.version + 1, "updated_at": now},
+    ))
+
+
+def _owners_of(db: Session, media_ids: list, chunk_size: int = 500) -> set:
+    """Distinct user ids owning the given media (chunked to stay under SQL variable limits)."""
+    owners = set()
+    for i in range(0, len(media_ids), chunk_size):
+        chunk = media_ids[i:i + chunk_size]
+        owners.update(
+            user_id for (user_id,) in
+            db.query(models.Media.user_id).filter(models.Media.id.in_(chunk)).distinct()
+        )
+    return owners
+
+
 # ---------------- Media ----------------
 def create_media(
     db: Session,
@@ -35,8 +101,10 @@ def create_media(
     folder_path: str = None,
     latitude: float = None,
     longitude: float = None,
+    content_hash: str = None,
 ):
     media_id = str(uuid.uuid4())
+    location_source = "client" if latitude is not None and longitude is not None else "generated"
     # If coordinates not provided, generate a dummy coordinate in Serengeti for demo
     if latitude is None or longitude is None:
         lat, lon = _generate_serengeti_coord()
@@ -50,9 +118,12 @@ def create_media(
         folder_path=folder_path,
         latitude=latitude,
         longitude=longitude,
+        location_source=location_source,
+        content_hash=content_hash,
         is_processed=False,
     )
     db.add(db_media)
+    bump_data_version(db, [user_id])
     db.commit()
     db.refresh(db_media)
     return db_media
@@ -64,11 +135,13 @@ def create_media_batch(db: Session, user_id: str, files: list):
     Inserts all media records in a single DB transaction.
     """
     media_objects = []
+    uploaded_at = datetime.now()  # one timestamp per batch, so deferred rows release in sample_rank order
     for f in files:
         media_id = str(uuid.uuid4())
         # Fill missing latitude/longitude with dummy Serengeti coords for demo
         lat = f.get("latitude")
         lon = f.get("longitude")
+        location_source = "client" if lat is not None and lon is not None else "generated"
         if lat is None or lon is None:
             gen_lat, gen_lon = _generate_serengeti_coord()
             lat = lat if lat is not None else gen_lat
@@ -82,11 +155,18 @@ def create_media_batch(db: Session, user_id: str, files: list):
             folder_path=f.get("folder_path"),  # NEW: Store folder path
             latitude=lat,
             longitude=lon,
+            location_source=location_source,
+            queue_state=f.get("queue_state"),
+            batch_id=f.get("batch_id"),
+            sample_stratum=f.get("sample_stratum"),
+            sample_rank=f.get("sample_rank"),
+            uploaded_at=uploaded_at,
             is_processed=False,
         )
         media_objects.append(media)
 
     db.add_all(media_objects)
+    bump_data_version(db, [user_id])
     db.commit()
     for media in media_objects:
         db.refresh(media)
@@ -94,6 +174,313 @@ def create_media_batch(db: Session, user_id: str, files: list):
     return media_objects
 
 
+def bulk_insert_media(db: Session, user_id: str, files: list) -> list:
+    """
+    Fast path for very large inserts (offline ingest, benchmarks).
+    Same input as create_media_batch but uses a single executemany INSERT and
+    does not hydrate ORM objects. Returns the new media ids in input order.
+    """
+    now = datetime.now()
+    rows = []
+    for f in files:
+        lat = f.get("latitude")
+        lon = f.get("longitude")
+        location_source = "client" if lat is not None and lon is not None else "generated"
+        if lat is None or lon is None:
+            gen_lat, gen_lon = _generate_serengeti_coord()
+            lat = lat if lat is not None else gen_lat
+            lon = lon if lon is not None else gen_lon
+        rows.append({
+            "id": str(uuid.uuid4()),
+            "user_id": user_id,
+            "file_url": f.get("file_url"),
+            "file_type": f.get("file_type", "image"),
+            "folder_path": f.get("folder_path"),
+            "latitude": lat,
+            "longitude": lon,
+            "location_source": location_source,
+            "uploaded_at": now,
+            "is_processed": False,
+        })
+    if rows:
+        db.execute(insert(models.Media), rows)
+        bump_data_version(db, [user_id])
+        db.commit()
+    return [r["id"] for r in rows]
+
+
+def bulk_update_media_predictions(db: Session, results: list) -> int:
+    """
+    results: list of dicts with keys ['id', 'classification', 'confidence', 'species', 'predictions']
+    and optionally 'content_hash' and 'model_version'. Writes all predictions in a single transaction.
+    """
+    mappings = []
+    for r in results:
+        row = {
+            "id": r["id"],
+            "classification": r["classification"],
+            "confidence": r["confidence"],
+            "species": r.get("species"),
+            "is_processed": True,
+        }
+        row["detections"], row["predictions"] = _prediction_columns(r.get("predictions"))
+        if r.get("content_hash"):
+            row["content_hash"] = r["content_hash"]
+        if "model_version" in r:
+            row["model_version"] = r["model_version"]
+        mappings.append(row)
+    db.bulk_update_mappings(models.Media, mappings)
+    bump_data_version(db, _owners_of(db, [m["id"] for m in mappings]))
+    db.commit()
+    return len(mappings)
+
+
+def get_media_missing_metadata(db: Session, since: datetime, before: datetime, limit: int = 500) -> list:
+    """Media uploaded in [since, before) whose EXIF header has not been read yet, oldest first."""
+    rows = (
+        db.query(models.Media.id, models.Media.file_url)
+        .filter(or_(models.Media.metadata_extracted.is_(False), models.Media.metadata_extracted.is_(None)),
+                models.Media.uploaded_at >= since, models.Media.uploaded_at < before)
+        .order_by(models.Media.uploaded_at)
+        .limit(limit)
+    )
+    return [{"id": media_id, "file_url": file_url} for media_id, file_url in rows]
+
+
+def update_media_metadata_batch(db: Session, metadata: list):
+    """
+    metadata: list of dicts with keys ['id', 'latitude', 'longitude', 'captured_at', 'camera_serial']
+    Bulk-applies EXIF metadata in a single transaction. EXIF GPS only replaces
+    generated demo coordinates, never coordinates supplied by the client.
+    Entries with an 'error' (header fetch failed) are skipped, so their rows keep
+    metadata_extracted False and are retried.
+    """
+    metadata = [m for m in metadata if not m.get("error")]
+    ids = [m["id"] for m in metadata]
+    if not ids:
+        return 0
+    sources = dict(
+        db.query(models.Media.id, models.Media.location_source).filter(models.Media.id.in_(ids)).all()
+    )
+
+    mappings = []
+    for m in metadata:
+        if m["id"] not in sources:
+            continue
+        row = {
+            "id": m["id"],
+            "captured_at": m.get("captured_at"),
+            "camera_serial": m.get("camera_serial"),
+            "metadata_extracted": True,
+        }
+        if m.get("latitude") is not None and m.get("longitude") is not None and sources[m["id"]] != "client":
+            row["latitude"] = m["latitude"]
+            row["longitude"] = m["longitude"]
+            row["location_source"] = "exif"
+        mappings.append(row)
+
+    db.bulk_update_mappings(models.Media, mappings)
+    bump_data_version(db, _owners_of(db, [m["id"] for m in mappings]))
+    db.commit()
+    return len(mappings)
+
+
+def count_deferred_media(db: Session, user_id: str) -> int:
+    """Media of one user held back by admission control."""
+    return db.query(models.Media).filter(
+        models.Media.user_id == user_id, models.Media.queue_state == "deferred"
+    ).count()
+
+
+def deferred_backlog(db: Session) -> dict:
+    """{user_id: deferred media count} for every user with a deferred backlog."""
+    return dict(
+        db.query(models.Media.user_id, func.count(models.Media.id))
+        .filter(models.Media.queue_state == "deferred")
+        .group_by(models.Media.user_id)
+        .all()
+    )
+
+
+def next_deferred_media(db: Session, limits: dict) -> list:
+    """
+    limits: {user_id: max rows}. Returns up to that many of each user's oldest deferred
+    media as (media_id, user_id) pairs, leaving them deferred until release_deferred_media.
+    """
+    rows = []
+    for user_id, limit in limits.items():
+        rows.extend(
+            (media_id, user_id) for (media_id,) in
+            db.query(models.Media.id)
+            .filter(models.Media.user_id == user_id, models.Media.queue_state == "deferred")
+            .order_by(models.Media.uploaded_at, models.Media.sample_rank)
+            .limit(limit)
+        )
+    return rows
+
+
+def release_deferred_media(db: Session, media_ids: list) -> None:
+    """Clear the deferred state of media that are now queued for inference."""
+    for i in range(0, len(media_ids), 500):
+        db.execute(update(models.Media)
+                   .where(models.Media.id.in_(media_ids[i:i + 500]), models.Media.queue_state == "deferred")
+                   .values(queue_state=None))
+    db.commit()
+
+
+def incomplete_batch_counts(db: Session, user_id: str) -> dict:
+    """
+    Per-stratum counts of the user's stratified batches that still have unprocessed rows.
+
+    Returns:
+        {(batch_id, stratum): {"remaining", "labelled", "blank", "species": {name: images}}};
+        "labelled" counts processed blank / non-blank rows (failed rows are left out)
+    """
+    batch_ids = [batch_id for (batch_id,) in
+                 db.query(models.Media.batch_id)
+                 .filter(models.Media.user_id == user_id,
+                         models.Media.batch_id.isnot(None),
+                         models.Media.is_processed == False)
+                 .distinct()]
+    if not batch_ids:
+        return {}
+
+    strata = defaultdict(lambda: {"remaining": 0, "labelled": 0, "blank": 0, "species": defaultdict(int)})
+    in_batches = (models.Media.user_id == user_id, models.Media.batch_id.in_(batch_ids))
+    for batch_id, stratum, processed, classification, count in (
+        db.query(models.Media.batch_id, models.Media.sample_stratum, models.Media.is_processed,
+                 models.Media.classification, func.count())
+        .filter(*in_batches)
+        .group_by(models.Media.batch_id, models.Media.sample_stratum,
+                  models.Media.is_processed, models.Media.classification)
+    ):
+        counts = strata[(batch_id, stratum)]
+        if not processed:
+            counts["remaining"] += count
+        elif classification in ("blank", "non-blank"):
+            counts["labelled"] += count
+            if classification == "blank":
+                counts["blank"] += count
+
+    for batch_id, stratum, species, count in (
+        db.query(models.Media.batch_id, models.Media.sample_stratum, models.Media.species, func.count())
+        .filter(*in_batches, models.Media.is_processed == True,
+                models.Media.classification == "non-blank", models.Media.species.isnot(None))
+        .group_by(models.Media.batch_id, models.Media.sample_stratum, models.Media.species)
+    ):
+        for name in {s.strip() for s in species.split(",") if s.strip()}:
+            strata[(batch_id, stratum)]["species"][name] += count
+    return dict(strata)
+
+
+# model_version of predictions entered by hand; never overwritten by reprocessing
+MANUAL_MODEL_VERSION = "manual"
+
+
+def _stale_media_query(db: Session, target_version: str, user_id: str = None):
+    query = db.query(models.Media).filter(
+        models.Media.is_processed == True,
+        or_(
+            models.Media.model_version.is_(None),
+            models.Media.model_version.notin_([target_version, MANUAL_MODEL_VERSION]),
+        ),
+        # Pruned blanks only have renditions left; rerunning the models on those would be meaningless
+        or_(models.Media.storage_tier.is_(None), models.Media.storage_tier != "pruned"),
+    )
+    if user_id:
+        query = query.filter(models.Media.user_id == user_id)
+    return query
+
+
+def count_stale_media(db: Session, target_version: str, user_id: str = None) -> int:
+    """Processed media whose predictions were not produced by target_version (manual edits excluded)."""
+    return _stale_media_query(db, target_version, user_id).count()
+
+
+def next_stale_media(db: Session, target_version: str, after_id: str = None, user_id: str = None,
+                     limit: int = 500) -> list:
+    """
+    Next page of stale media as (id, user_id, has_thumbnail), walking the primary key
+    from after_id (keyset pagination, so each page is an index range scan and a
+    checkpointed id is enough to resume).
+    """
+    query = _stale_media_query(db, target_version, user_id)
+    if after_id is not None:
+        query = query.filter(models.Media.id > after_id)
+    rows = (
+        query.with_entities(models.Media.id, models.Media.user_id, models.Media.thumbnail_url)
+        .order_by(models.Media.id)
+        .limit(limit)
+        .all()
+    )
+    return [(media_id, owner, thumbnail is not None) for media_id, owner, thumbnail in rows]
+
+
+def next_blank_retention_candidates(db: Session, older_than: datetime, min_confidence: float,
+                                    after_id: str = None, limit: int = 500) -> list:
+    """
+    Next page of blank media still in the hot tier, uploaded before older_than and either
+    classified with at least min_confidence or marked blank by hand. Keyset paginated by id.
+    Frames only the background prefilter called blank (PREFILTER_MODE=skip) never qualify:
+    their confidence is the prefilter's, not the classifier's.
+
+    Returns:
+        list of dicts with id, user_id, file_url, thumbnail_url, preview_url, content_hash
+    """
+    columns = ("id", "user_id", "file_url", "thumbnail_url", "preview_url", "content_hash")
+    query = db.query(*[getattr(models.Media, c) for c in columns]).filter(
+        models.Media.is_processed == True,
+        models.Media.classification == "blank",
+        models.Media.storage_tier.is_(None),
+        models.Media.uploaded_at < older_than,
+        or_(
+            models.Media.model_version == MANUAL_MODEL_VERSION,
+            and_(
+                models.Media.confidence >= min_confidence,
+                # NULL stage on a blank candidate (rows from before prediction_stage) is excluded too
+                or_(models.Media.prefilter_decision.is_(None),
+                    models.Media.prefilter_decision != "blank_candidate",
+                    models.Media.prediction_stage != "prefilter"),
+            ),
+        ),
+    )
+    if after_id is not None:
+        query = query.filter(models.Media.id > after_id)
+    return [dict(zip(columns, row)) for row in query.order_by(models.Media.id).limit(limit)]
+
+
+def apply_storage_tiering(db: Session, updates: list) -> set:
+    """
+    updates: list of dicts with 'id', 'file_url', 'storage_tier' and optionally
+    'thumbnail_url', 'preview_url', 'content_hash'. Written in one transaction.
+
+    Each row is only updated if it is still a blank in the hot tier, so a frame
+    relabelled (or reprocessed) since it was selected is left alone.
+
+    Returns:
+        ids of the rows actually updated
+    """
+    if not updates:
+        return set()
+    now = datetime.now()
+    applied = set()
+    for values in updates:
+        result = db.execute(
+            update(models.Media)
+            .where(models.Media.id == values["id"],
+                   models.Media.classification == "blank",
+                   models.Media.storage_tier.is_(None))
+            .values(**{k: v for k, v in values.items() if k != "id"}, tiered_at=now)
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount:
+            applied.add(values["id"])
+    if applied:
+        bump_data_version(db, _owners_of(db, list(applied)))
+    db.commit()
+    return applied
+
+
 def get_all_media(db: Session):
     """Return all media records (useful for heatmap endpoints)."""
     return db.query(models.Media).all()
@@ -114,6 +501,30 @@ def get_media_by_user(db: Session, user_id: str):
     return db.query(models.Media).filter(models.Media.user_id == user_id).all()
 
 
+# Columns served by the media list endpoints (same fields as routes.MediaResponse)
+MEDIA_LIST_COLUMNS = (
+    "id", "user_id", "file_url", "file_type", "thumbnail_url", "preview_url", "folder_path",
+    "latitude", "longitude", "uploaded_at", "classification", "confidence", "species",
+    "captured_at", "camera_serial", "queue_state", "model_version", "storage_tier",
+)
+MEDIA_ALL_COLUMNS = tuple(c.name for c in models.Media.__table__.columns)
+
+
+def iter_media_rows(db: Session, user_id: str, columns=MEDIA_LIST_COLUMNS, criteria=(), order_by=None,
+                    batch_size: int = 2000):
+    """
+    Yield a user's media as plain dicts of the requested columns.
+
+    Selects columns only, so no ORM objects are hydrated or tracked by the
+    session, and fetches in batches so large result sets stream.
+    """
+    query = db.query(*[getattr(models.Media, c) for c in columns]).filter(models.Media.user_id == user_id, *criteria)
+    if order_by is not None:
+        query = query.order_by(order_by)
+    for row in query.yield_per(batch_size):
+        yield dict(zip(columns, row))
+
+
 def get_media_by_id(db: Session, media_id: str):
     return db.query(models.Media).filter(models.Media.id == media_id).first()
 
@@ -124,19 +535,40 @@ def update_media_predictions(
     classification: str,
     confidence: float,
     species: str = None,
-    predictions: dict = None
+    predictions: dict = None,
+    prefilter_score: float = None,
+    prefilter_decision: str = None,
+    thumbnail_url: str = None,
+    preview_url: str = None,
+    content_hash: str = None,
+    model_version: str = None,
+    prediction_stage: str = None,
 ):
     """
     Update a media record with YOLO predictions + metadata.
+    predictions is either pipeline output (Detections, stored as a compact blob)
+    or a dict/list stored as JSON (manual edits, error details).
+    prediction_stage is the cascade stage that decided (None for manual edits and errors).
     """
-    import json
     media = db.query(models.Media).filter(models.Media.id == media_id).first()
     if media:
         media.classification = classification
         media.confidence = confidence
         media.species = species
-        media.predictions = json.dumps(predictions) if predictions else None
+        media.detections, media.predictions = _prediction_columns(predictions)
+        if prefilter_decision is not None:
+            media.prefilter_score = prefilter_score
+            media.prefilter_decision = prefilter_decision
+        if thumbnail_url:
+            media.thumbnail_url = thumbnail_url
+        if preview_url:
+            media.preview_url = preview_url
+        if content_hash and not media.content_hash:
+            media.content_hash = content_hash
+        media.model_version = model_version
+        media.prediction_stage = prediction_stage
         media.is_processed = True
+        bump_data_version(db, [media.user_id])
         db.commit()
         db.refresh(media)
     return media
@@ -150,21 +582,11 @@ def get_predictions_by_media(db: Session, media_id: str):
     if not media:
         return None
     
-    import json
-    
-    # Parse predictions if it's a string
-    predictions_data = media.predictions
-    if isinstance(predictions_data, str):
-        try:
-            predictions_data = json.loads(predictions_data)
-        except:
-            predictions_data = None
-    
     return {
         "media_id": media.id,
         "classification": media.classification,
         "confidence": media.confidence,
         "species": media.species,
-        "predictions": predictions_data
+        "predictions": predictions_view(media.detections, media.predictions)
     }
 
@@ -1,10 +1,21 @@
-from sqlalchemy import Column, String, DateTime, create_engine, ForeignKey, Float, Boolean, Text
+from sqlalchemy import Column, String, DateTime, create_engine, ForeignKey, Float, Boolean, Text, Integer, LargeBinary, Index
+from sqlalchemy import inspect, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from datetime import datetime
+import logging
+import os
 
-# SQLite DB setup
-engine = create_engine("sqlite:///./test.db", connect_args={"check_same_thread": False}, echo=True)
+logger = logging.getLogger(__name__)
+
+# SQLite DB setup (DATABASE_URL overrides, e.g. for PostgreSQL in production)
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./test.db")
+DB_ECHO = os.getenv("DB_ECHO", "1") == "1"
+engine = create_engine(
+    DATABASE_URL,
+    connect_args={"check_same_thread": False} if DATABASE_URL.startswith("sqlite") else {},
+    echo=DB_ECHO,
+)
 Base = declarative_base()
 
 
@@ -24,6 +35,9 @@ class Media(Base):
     user_id = Column(String, ForeignKey("users.id"))    # Who uploaded
     file_url = Column(String, nullable=False)           # S3 path
     file_type = Column(String)                          # "image" or "video"
+    thumbnail_url = Column(String, nullable=True)       # small WebP rendition
+    preview_url = Column(String, nullable=True)         # medium WebP rendition
+    content_hash = Column(String, nullable=True, index=True)  # sha256 of the original bytes
     folder_path = Column(String, nullable=True)         # Folder structure (e.g., "animals/2024/zebras")
     uploaded_at = Column(DateTime, default=datetime.now)
 
@@ -31,17 +45,119 @@ class Media(Base):
     classification = Column(String, nullable=True)      # "blank" | "non_blank"
     confidence = Column(Float, nullable=True)           # confidence for classification
     species = Column(String, nullable=True)             # optional, if detected
-    predictions = Column(Text, nullable=True)           # raw YOLO detections (JSON)
+    predictions = Column(Text, nullable=True)           # JSON: legacy detections, manual edits, error details
+    detections = Column(LargeBinary, nullable=True)     # compact detector output (utils.detections blob)
+    model_version = Column(String, nullable=True, index=True)  # weights digest that produced the predictions
+    prediction_stage = Column(String, nullable=True)    # cascade exit: "prefilter" | "classifier" | "detector..."
 
     is_processed = Column(Boolean, default=False)       # Mark when YOLO done
+    queue_state = Column(String, nullable=True, index=True)  # "deferred" while held back by admission control
+
+    # Progressive batch processing (services/sampling.py)
+    batch_id = Column(String, nullable=True, index=True)     # /media/batch request of a stratified batch
+    sample_stratum = Column(String, nullable=True)           # "<folder>#<time bucket>" within the batch
+    sample_rank = Column(Integer, nullable=True)             # processing order within the batch
+
+    # Blank-frame retention (services/lifecycle.py)
+    storage_tier = Column(String, nullable=True, index=True)  # None = hot | "cold" | "pruned" (original replaced by renditions)
+    tiered_at = Column(DateTime, nullable=True)
+
+    # Background prefilter audit trail
+    prefilter_score = Column(Float, nullable=True)      # fraction of pixels changed vs. camera background
+    prefilter_decision = Column(String, nullable=True)  # "blank_candidate" | "pass" | None if filter off
 
     # Optional location data
     latitude = Column(Float, nullable=True)
     longitude = Column(Float, nullable=True)
+    location_source = Column(String, nullable=True)     # "client" | "exif" | "generated"
+
+    # EXIF metadata (filled by header-only extraction at ingest)
+    captured_at = Column(DateTime, nullable=True)
+    camera_serial = Column(String, nullable=True)
+    metadata_extracted = Column(Boolean, default=False)  # False until a header was read; failed reads are retried
+
+    # Non-blank listings and exports read only their own rows instead of scanning every blank;
+    # the EXIF retry finds recent rows whose header read failed
+    __table_args__ = (
+        Index("ix_media_user_classification", "user_id", "classification"),
+        Index("ix_media_metadata_pending", "metadata_extracted", "uploaded_at"),
+    )
+
+
+class DataVersion(Base):
+    __tablename__ = "data_versions"
+
+    user_id = Column(String, ForeignKey("users.id"), primary_key=True)
+    version = Column(Integer, nullable=False, default=0)  # bumped on every media create/update
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+
+class ReprocessJob(Base):
+    __tablename__ = "reprocess_jobs"
+
+    id = Column(String, primary_key=True)
+    target_version = Column(String, nullable=False)     # model version rows are brought up to
+    user_id = Column(String, nullable=True)             # None = every user
+    status = Column(String, default="pending")          # pending | running | paused | cancelled | completed | failed
+    checkpoint_id = Column(String, nullable=True)       # last media id handed out (keyset cursor)
+    total = Column(Integer, default=0)                  # stale rows when the job was created
+    processed = Column(Integer, default=0)
+    failed = Column(Integer, default=0)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.now)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+
+class ExportJob(Base):
+    __tablename__ = "export_jobs"
+
+    id = Column(String, primary_key=True)
+    user_id = Column(String, ForeignKey("users.id"), index=True)
+    kind = Column(String, default="zip")                 # archive format
+    status = Column(String, default="pending")          # pending | running | completed | partial | failed
+    data_version = Column(Integer, nullable=True)       # user's DataVersion the archive is known to match
+    manifest_hash = Column(String, nullable=True, index=True)  # sha256 of the exported rows
+    object_key = Column(String, nullable=True)          # archive location in storage
+    total = Column(Integer, default=0)                   # images in the archive
+    processed = Column(Integer, default=0)
+    failed = Column(Integer, default=0)                  # images that could not be fetched
+    size_bytes = Column(Integer, nullable=True)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.now)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+    completed_at = Column(DateTime, nullable=True)
+
+def migrate(engine):
+    """
+    Bring an existing database up to the models: create missing tables, then add
+    missing columns (ALTER TABLE ... ADD COLUMN, nullable, with the column's scalar
+    default for existing rows) and missing indexes. Additive only; nothing is
+    dropped or retyped.
+    """
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        inspector = inspect(conn)
+        for table in Base.metadata.sorted_tables:
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(engine.dialect)}"
+                if column.default is not None and column.default.is_scalar:
+                    ddl += f" DEFAULT {_literal(column, column.default.arg, engine.dialect)}"
+                conn.execute(text(ddl))
+                logger.info(f"Added column {table.name}.{column.name}")
+            indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in indexes:
+                    index.create(conn, checkfirst=True)
+                    logger.info(f"Created index {index.name}")
+
+
+def _literal(column, value, dialect) -> str:
+    processor = column.type.literal_processor(dialect)
+    return processor(value) if processor else repr(value)
+
 
-# Create DB tables (will add folder_path column if running fresh)
-# For existing DB, you'll need a migration
-Base.metadata.create_all(engine)
+migrate(engine)
 
 # DB Session
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
@@ -1,32 +1,57 @@
-from fastapi import APIRouter, Depends, HTTPException, Request, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, BackgroundTasks
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from sqlalchemy.orm import Session
 from typing import List, Optional
 from datetime import datetime
 import uuid
+import os
+import json
+import hashlib
+import threading
 import logging
-from fastapi.responses import StreamingResponse
+from fastapi.responses import StreamingResponse, FileResponse
 import io
 import csv
-import zipfile
-import requests  # For downloading images from S3
 
 # Local imports
 from ..database.db import (
     get_user_by_id,
     create_user,
     create_media,
-    get_media_by_user,
     get_media_by_id,
     create_media_batch,
     update_media_predictions,
     get_predictions_by_media,
     get_all_media,
+    update_media_metadata_batch,
+    get_data_version,
+    iter_media_rows,
+    incomplete_batch_counts,
+    MEDIA_ALL_COLUMNS,
+    MANUAL_MODEL_VERSION,
 )
 from ..database.models import get_db
-from ..utils.utils import authenticate_and_get_user
-from ..services.s3 import generate_presigned_put_url, get_object_url
+from ..utils.utils import authenticate_and_get_user, is_admin, require_admin
+from ..services.s3 import MULTIPART_PART_SIZE
+from ..services.storage import (storage, LocalStorage, STORAGE_LOCAL_PUBLIC_READ, is_fetchable_url, user_key,
+                                check_key, MultipartNotSupported)
 from ..services.worker import media_processor
+from ..services.scheduler import scheduler
+from ..services.admission import admission, AdmissionRejected
+from ..services.reprocess import reprocess_manager, job_status
+from ..services import columnar_export, export_jobs
+from ..services.export_jobs import export_manager
+from ..services.lifecycle import lifecycle_manager
+from ..services.model_reload import model_reloader
+from ..services.embeddings import embedding_store
+from ..services.sampling import plan_batch, sample_size, provisional_estimates
+from ..utils.profiling import profile_task
+from ..utils.tracing import span, resume, current_trace_context
+from ..utils.http_cache import cached_json_response
+from ..utils.serialization import json_response, ndjson_response, wants_ndjson
+from ..utils.detections import predictions_view, detection_count, Detections
+from ..services.exif import extract_metadata_batch, parse_exif, EXIF_HEADER_BYTES, start_retry_loop
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
@@ -58,6 +83,8 @@ class MediaResponse(BaseModel):
     user_id: str
     file_url: str
     file_type: str
+    thumbnail_url: Optional[str] = None
+    preview_url: Optional[str] = None
     folder_path: Optional[str] = None
     latitude: Optional[float]
     longitude: Optional[float]
@@ -65,6 +92,11 @@ class MediaResponse(BaseModel):
     classification: Optional[str] = None
     confidence: Optional[float] = None
     species: Optional[str] = None
+    captured_at: Optional[datetime] = None
+    camera_serial: Optional[str] = None
+    queue_state: Optional[str] = None
+    model_version: Optional[str] = None
+    storage_tier: Optional[str] = None
     class Config:
         from_attributes = True
 class BatchPresignFile(BaseModel):
@@ -81,7 +113,45 @@ class PresignedFile(BaseModel):
 class BatchPresignResponse(BaseModel):
     files: List[PresignedFile]
 
+class MultipartInitRequest(BaseModel):
+    file_name: str
+    file_size: int
+    content_type: Optional[str] = None
+
+class MultipartPart(BaseModel):
+    part_number: int
+    upload_url: str
+
+class MultipartInitResponse(BaseModel):
+    object_key: str
+    upload_id: str
+    file_url: str
+    part_size: int
+    parts: List[MultipartPart]
+
+class CompletedPart(BaseModel):
+    part_number: int
+    etag: str
+
+class MultipartCompleteRequest(BaseModel):
+    object_key: str
+    upload_id: str
+    parts: List[CompletedPart]
+
+class MultipartAbortRequest(BaseModel):
+    object_key: str
+    upload_id: str
+
 # Prediction
+class ReprocessRequest(BaseModel):
+    user_id: Optional[str] = None    # admins only; None = every user
+
+class ModelReloadRequest(BaseModel):
+    classifier_path: Optional[str] = None   # under backend/ml; None = reload the current file
+    detector_path: Optional[str] = None
+    version: Optional[str] = None           # model_version to stamp; None = weights digest
+    force: bool = False
+
 class PredictionUpdate(BaseModel):
     classification: str
     confidence: float
@@ -92,7 +162,8 @@ class PredictionUpdate(BaseModel):
 
 # ------------------ Background Tasks ------------------
 
-def process_media_background(media_id: str):
+@profile_task()
+def process_media_background(media_id: str, image_bytes: Optional[bytes] = None, trace_ctx: Optional[dict] = None):
     """Background task to process media through ML pipeline"""
     try:
         # Create a new DB session for background task
@@ -100,12 +171,123 @@ def process_media_background(media_id: str):
         db = SessionLocal()
         try:
             logger.info(f"Starting background processing for media {media_id}")
-            result = media_processor.process_media(media_id, db)
+            with resume(trace_ctx), span("process_media", media_id=media_id) as current:
+                result = media_processor.process_media(media_id, db, image_bytes=image_bytes)
+                current.set_attribute("classification", result.get("classification"))
             logger.info(f"Background processing complete for {media_id}: {result}")
         finally:
             db.close()
     except Exception as e:
         logger.error(f"Background processing failed for {media_id}: {e}", exc_info=True)
+    finally:
+        if image_bytes is not None:
+            upload_handoff_budget.release(len(image_bytes))
+
+def _with_predictions_view(rows):
+    """Swap the binary detections column of listing rows for the JSON predictions text."""
+    for row in rows:
+        blob = row.pop("detections", None)
+        if blob:
+            row["predictions"] = json.dumps(Detections.from_bytes(blob).to_dicts())
+        yield row
+
+
+def queue_processing(user_id: str, media_id: str, image_bytes: Optional[bytes] = None, priority: str = "batch",
+                     front: bool = False):
+    """Submit a media item to the inference scheduler under its owner's fair share"""
+    scheduler.submit(
+        process_media_background, media_id, image_bytes, current_trace_context(),
+        user_id=user_id, priority=priority, front=front
+    )
+
+
+# Deferred rows (admission control overflow) are released into the batch class as room frees up
+admission.start_pump(lambda user_id, media_id: queue_processing(user_id, media_id, priority="batch"))
+
+
+@profile_task()
+def extract_metadata_background(media_items: List[dict], trace_ctx: Optional[dict] = None):
+    """Background task to pull EXIF metadata from object headers (ranged reads)"""
+    try:
+        from ..database.models import SessionLocal
+        with resume(trace_ctx), span("extract_metadata", count=len(media_items)):
+            metadata = extract_metadata_batch(media_items)
+        db = SessionLocal()
+        try:
+            with resume(trace_ctx), span("db.update_media_metadata_batch", count=len(metadata)):
+                updated = update_media_metadata_batch(db, metadata)
+            logger.info(f"EXIF metadata stored for {updated} media")
+        finally:
+            db.close()
+    except Exception as e:
+        logger.error(f"EXIF metadata extraction failed: {e}", exc_info=True)
+
+
+# Header reads that failed (S3/HTTP errors) leave metadata_extracted False and are retried
+start_retry_loop(extract_metadata_background)
+
+# ------------------ Helpers ------------------
+
+CONTENT_TYPES = {
+    ".png": "image/png",
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".webp": "image/webp",
+    ".gif": "image/gif",
+    ".tif": "image/tiff",
+    ".tiff": "image/tiff",
+    ".mp4": "video/mp4",
+    ".mov": "video/quicktime",
+    ".avi": "video/x-msvideo",
+}
+
+
+def _user_object_key(user_id: str, file_name: str) -> str:
+    """Object key for a client-supplied file name; 400 unless it stays under f"{user_id}/"."""
+    try:
+        return user_key(user_id, file_name)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid file name: {file_name!r}")
+
+
+def _owns_key(user_id: str, key: str) -> bool:
+    """Whether key is a valid object key under f"{user_id}/"."""
+    try:
+        check_key(key)
+    except ValueError:
+        return False
+    return key.startswith(f"{user_id}/")
+
+
+def _content_type_for(file_name: str) -> str:
+    """Guess the upload content type from the file extension (defaults to JPEG)."""
+    ext = os.path.splitext(file_name.lower())[1]
+    return CONTENT_TYPES.get(ext, "image/jpeg")
+
+class ByteBudget:
+    """Global cap on upload bytes held in memory while waiting for inference"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.in_use = 0
+        self._lock = threading.Lock()
+
+    def try_acquire(self, size: int) -> bool:
+        with self._lock:
+            if self.in_use + size > self.limit:
+                return False
+            self.in_use += size
+            return True
+
+    def release(self, size: int):
+        with self._lock:
+            self.in_use = max(0, self.in_use - size)
+
+
+STREAM_CHUNK_SIZE = 1024 * 1024
+# Largest single upload whose bytes are kept for inference, and the total across uploads
+STREAM_HANDOFF_MAX_BYTES = int(os.getenv("STREAM_HANDOFF_MAX_BYTES", str(32 * 1024 * 1024)))
+upload_handoff_budget = ByteBudget(int(os.getenv("STREAM_HANDOFF_BUDGET_BYTES", str(512 * 1024 * 1024))))
 
 # ------------------ User Routes ------------------
 
@@ -134,6 +316,17 @@ def get_current_user(request: Request, db: Session = Depends(get_db)):
 
 # ------------------ Media Routes ------------------
 
+def _check_file_url(file_url, user_id: str):
+    """
+    Client-supplied file_urls must be http(s) or the user's own storage objects: the worker and
+    exports read our objects with the server's storage access and hand the bytes back.
+    """
+    if not is_fetchable_url(file_url):
+        raise HTTPException(status_code=400, detail=f"Unsupported file_url: {file_url!r}")
+    key = storage.key_from_url(file_url)
+    if key is not None and not _owns_key(user_id, key):
+        raise HTTPException(status_code=403, detail="file_url points at another user's object")
+
 @router.post("/media", response_model=MediaResponse)
 def create_media_record(
     media_data: MediaCreate,
@@ -142,6 +335,7 @@ def create_media_record(
     db: Session = Depends(get_db)
 ):
     clerk_user = authenticate_and_get_user(request)
+    _check_file_url(media_data.file_url, clerk_user.id)
     new_media = create_media(
         db=db,
         user_id=clerk_user.id,
@@ -151,102 +345,278 @@ def create_media_record(
         longitude=media_data.longitude,
     )
     
-    # Trigger ML processing in background
-    background_tasks.add_task(process_media_background, new_media.id)
+    # Pull EXIF metadata from the object header, then trigger ML processing in background
+    background_tasks.add_task(
+        extract_metadata_background,
+        [{"id": new_media.id, "file_url": new_media.file_url}],
+        current_trace_context()
+    )
+    queue_processing(clerk_user.id, new_media.id, priority="interactive")
     logger.info(f"Queued background processing for media {new_media.id}")
     
     return new_media
 
+@router.post("/media/upload", response_model=MediaResponse)
+async def upload_media_stream(
+    request: Request,
+    file_name: str = "upload",
+    folder_path: Optional[str] = None,
+    latitude: Optional[float] = None,
+    longitude: Optional[float] = None,
+    db: Session = Depends(get_db)
+):
+    """
+    Upload an image through the API instead of a presigned URL; the raw image is the request body.
+    The body is read chunk by chunk as it arrives and teed to storage, the hasher and (for
+    inference) an in-memory handoff buffer, so the worker does not download it again.
+    Handoff memory is reserved from the global budget chunk by chunk before the buffer grows;
+    files over STREAM_HANDOFF_MAX_BYTES, or once the budget is exhausted, fall back to the
+    normal download path, so memory across concurrent uploads stays bounded.
+    """
+    clerk_user = await run_in_threadpool(authenticate_and_get_user, request)
+    file_name = folder_path or file_name
+    object_key = _user_object_key(clerk_user.id, file_name)
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+    if not content_type.startswith(("image/", "video/")):
+        content_type = _content_type_for(file_name)
+
+    hasher = hashlib.sha256()
+    header = bytearray()
+    handoff = bytearray()
+    keep_bytes = True
+    try:
+        with storage.open_writer(object_key, content_type=content_type) as writer:
+            async for chunk in request.stream():
+                if not chunk:
+                    continue
+                hasher.update(chunk)
+                await run_in_threadpool(writer.write, chunk)
+                if len(header) < EXIF_HEADER_BYTES:
+                    header.extend(chunk[:EXIF_HEADER_BYTES - len(header)])
+                if keep_bytes:
+                    if (len(handoff) + len(chunk) <= STREAM_HANDOFF_MAX_BYTES
+                            and upload_handoff_budget.try_acquire(len(chunk))):
+                        handoff.extend(chunk)
+                    else:
+                        keep_bytes = False
+                        upload_handoff_budget.release(len(handoff))
+                        handoff = bytearray()
+            file_url = await run_in_threadpool(writer.close)
+    except BaseException:
+        upload_handoff_budget.release(len(handoff))
+        raise
+
+    def register():
+        new_media = create_media(
+            db=db,
+            user_id=clerk_user.id,
+            file_url=file_url,
+            file_type="video" if content_type.startswith("video/") else "image",
+            folder_path=folder_path,
+            latitude=latitude,
+            longitude=longitude,
+            content_hash=hasher.hexdigest(),
+        )
+        # EXIF comes from the header we already streamed, no ranged read needed
+        metadata = parse_exif(bytes(header))
+        metadata["id"] = new_media.id
+        update_media_metadata_batch(db, [metadata])
+        db.refresh(new_media)
+        return new_media
+
+    try:
+        new_media = await run_in_threadpool(register)
+    except BaseException:
+        upload_handoff_budget.release(len(handoff))
+        raise
+
+    # The buffer itself is handed over (no copy); its budget is released once inference is done
+    image_bytes = handoff if keep_bytes and handoff else None
+    queue_processing(clerk_user.id, new_media.id, image_bytes, priority="interactive")
+    logger.info(
+        f"Streamed {writer.bytes_written} bytes for media {new_media.id} "
+        f"({'in-memory handoff' if image_bytes is not None else 'worker will download'})"
+    )
+
+    return new_media
+
 @router.get("/media", response_model=List[MediaResponse])
 def get_user_media(request: Request, db: Session = Depends(get_db)):
     clerk_user = authenticate_and_get_user(request)
-    return get_media_by_user(db, clerk_user.id)
+    if wants_ndjson(request):
+        return ndjson_response(iter_media_rows(db, clerk_user.id))
+
+    def build():
+        return list(iter_media_rows(db, clerk_user.id))
+
+    return cached_json_response(request, clerk_user.id, get_data_version(db, clerk_user.id), build)
 
 @router.get("/media/heatmap")
 def get_media_heatmap(request: Request, db: Session = Depends(get_db)):
     """Return a list of media records with lat/lon for frontend heatmap."""
     clerk_user = authenticate_and_get_user(request)
-    media_list = get_media_by_user(db, clerk_user.id)
-    points = []
-    for m in media_list:
-        if m.latitude is not None and m.longitude is not None:
-            points.append({
-                "id": m.id,
-                "lat": m.latitude,
-                "lon": m.longitude,
-                "file_url": m.file_url,
-                "uploaded_at": m.uploaded_at.isoformat() if m.uploaded_at else None
-            })
-    return {"points": points}
 
-@router.get("/media/{media_id}", response_model=MediaResponse)
-def get_specific_media(media_id: str, request: Request, db: Session = Depends(get_db)):
-    clerk_user = authenticate_and_get_user(request)
-    media = get_media_by_id(db, media_id)
-    if not media:
-        raise HTTPException(status_code=404, detail="Media not found")
-    if media.user_id != clerk_user.id:
-        raise HTTPException(status_code=403, detail="Not authorized")
-    return media
+    def build():
+        columns = ("id", "latitude", "longitude", "file_url", "thumbnail_url", "uploaded_at")
+        points = []
+        for m in iter_media_rows(db, clerk_user.id, columns):
+            if m["latitude"] is not None and m["longitude"] is not None:
+                points.append({
+                    "id": m["id"],
+                    "lat": m["latitude"],
+                    "lon": m["longitude"],
+                    "file_url": m["file_url"],
+                    "thumbnail_url": m["thumbnail_url"],
+                    "uploaded_at": m["uploaded_at"].isoformat() if m["uploaded_at"] else None
+                })
+        return {"points": points}
+
+    return cached_json_response(request, clerk_user.id, get_data_version(db, clerk_user.id), build)
 
 @router.get("/media/presign")
 def get_presigned_url(file_name: str, request: Request):
     clerk_user = authenticate_and_get_user(request)
-    object_key = f"{clerk_user.id}_{uuid.uuid4()}_{file_name}"
-    upload_url = generate_presigned_put_url(object_key, expiration=3600, content_type="image/jpeg")
-    file_url = get_object_url(object_key)
+    object_key = _user_object_key(clerk_user.id, f"{uuid.uuid4()}_{file_name}")
+    upload_url = storage.presign_put(object_key, content_type="image/jpeg", expiration=3600)
+    file_url = storage.url_for(object_key)
     return {"upload_url": upload_url, "file_url": file_url}
 
 @router.post("/media/presign-batch", response_model=BatchPresignResponse)
 def get_batch_presigned_urls(batch_request: BatchPresignRequest, request: Request):
     clerk_user = authenticate_and_get_user(request)
-    result_files = []
-    
-    for file_name in batch_request.file_names:
-        # Keep the folder structure in the S3 key
-        # file_name could be "folder1/folder2/image.jpg"
-        object_key = f"{clerk_user.id}/{file_name}"
-        
-        # Determine content type from file extension
-        content_type = "image/jpeg"  # default
-        if file_name.lower().endswith('.png'):
-            content_type = "image/png"
-        elif file_name.lower().endswith('.jpg') or file_name.lower().endswith('.jpeg'):
-            content_type = "image/jpeg"
-        elif file_name.lower().endswith('.webp'):
-            content_type = "image/webp"
-        elif file_name.lower().endswith('.gif'):
-            content_type = "image/gif"
-        
-        upload_url = generate_presigned_put_url(object_key, expiration=3600, content_type=content_type)
-        file_url = get_object_url(object_key)
-        
-        result_files.append({
+
+    # Keep the folder structure in the S3 key
+    # file_name could be "folder1/folder2/image.jpg"
+    objects = [
+        (_user_object_key(clerk_user.id, file_name), _content_type_for(file_name))
+        for file_name in batch_request.file_names
+    ]
+
+    # One shared signer handles the whole batch
+    upload_urls = storage.presign_put_many(objects, expiration=3600)
+
+    result_files = [
+        {
             "upload_url": upload_url,
-            "file_url": file_url,
+            "file_url": storage.url_for(object_key),
             "folder_path": file_name  # Return the folder path for frontend tracking
-        })
+        }
+        for file_name, (object_key, _), upload_url in zip(batch_request.file_names, objects, upload_urls)
+    ]
     
     return {"files": result_files}
 
+@router.post("/media/multipart/initiate", response_model=MultipartInitResponse)
+def initiate_multipart_upload(init_request: MultipartInitRequest, request: Request):
+    """Start a multipart upload for a large file (videos, big TIFFs) and presign every part"""
+    clerk_user = authenticate_and_get_user(request)
+    if not storage.supports_multipart:
+        raise HTTPException(status_code=400, detail=f"{storage.name} storage does not support multipart uploads; use a single presigned PUT")
+    if init_request.file_size <= 0:
+        raise HTTPException(status_code=400, detail="file_size must be positive")
+
+    object_key = _user_object_key(clerk_user.id, init_request.file_name)
+    content_type = init_request.content_type or _content_type_for(init_request.file_name)
+    part_count = -(-init_request.file_size // MULTIPART_PART_SIZE)
+    if part_count > 10000:
+        raise HTTPException(status_code=400, detail="File too large for multipart upload")
+
+    upload_id, part_urls = storage.create_multipart_upload(
+        object_key, part_count, expiration=3600, content_type=content_type
+    )
+    return {
+        "object_key": object_key,
+        "upload_id": upload_id,
+        "file_url": storage.url_for(object_key),
+        "part_size": MULTIPART_PART_SIZE,
+        "parts": [
+            {"part_number": i, "upload_url": url} for i, url in enumerate(part_urls, start=1)
+        ],
+    }
+
+@router.post("/media/multipart/complete")
+def finish_multipart_upload(complete_request: MultipartCompleteRequest, request: Request):
+    clerk_user = authenticate_and_get_user(request)
+    if not _owns_key(clerk_user.id, complete_request.object_key):
+        raise HTTPException(status_code=403, detail="Not authorized")
+
+    try:
+        file_url = storage.complete_multipart_upload(
+            complete_request.object_key,
+            complete_request.upload_id,
+            [{"PartNumber": p.part_number, "ETag": p.etag} for p in complete_request.parts],
+        )
+    except MultipartNotSupported as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"file_url": file_url}
+
+@router.post("/media/multipart/abort")
+def cancel_multipart_upload(abort_request: MultipartAbortRequest, request: Request):
+    clerk_user = authenticate_and_get_user(request)
+    if not _owns_key(clerk_user.id, abort_request.object_key):
+        raise HTTPException(status_code=403, detail="Not authorized")
+
+    try:
+        storage.abort_multipart_upload(abort_request.object_key, abort_request.upload_id)
+    except MultipartNotSupported as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"message": "Upload aborted", "object_key": abort_request.object_key}
+
 @router.post("/media/batch", response_model=List[MediaResponse])
 def create_media_batch_records(
     payload: dict,
     background_tasks: BackgroundTasks,
     request: Request,
+    response: Response,
     db: Session = Depends(get_db)
 ):
     clerk_user = authenticate_and_get_user(request)
     files = payload.get("files", [])
     for f in files:
-        f["file_type"] = "image"
-    
-    created_media = create_media_batch(db, clerk_user.id, files)
-    
-    # Trigger ML processing for each uploaded file in background
-    for media in created_media:
-        background_tasks.add_task(process_media_background, media.id)
-        logger.info(f"Queued background processing for media {media.id}")
+        _check_file_url(f.get("file_url"), clerk_user.id)
+
+    # Bound outstanding inference work; overflow is deferred or refused with Retry-After
+    try:
+        reservation = admission.admit(db, clerk_user.id, len(files))
+    except AdmissionRejected as e:
+        if e.retry_after is None:
+            raise HTTPException(status_code=413, detail=str(e))
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+    # The reservation holds the room until the admitted rows are in the scheduler
+    with reservation:
+        admitted = reservation.admitted
+
+        # Large batches run a stratified sample (folders x capture time) first, then the rest
+        order = plan_batch(files)
+        lead = sample_size(len(files)) if order is not None else 0
+        if order is None:
+            order = list(range(len(files)))
+
+        for rank, i in enumerate(order):
+            files[i]["file_type"] = "image"
+            files[i]["queue_state"] = "deferred" if rank >= admitted else None
+
+        with span("db.create_media_batch", count=len(files)):
+            created_media = create_media_batch(db, clerk_user.id, files)
+
+        # Trigger ML processing for each admitted file in background; the sample jumps the user's queue
+        queued = [created_media[i] for i in order[:admitted]]
+        for media in reversed(queued[:lead]):
+            queue_processing(clerk_user.id, media.id, priority="batch", front=True)
+        for media in queued[lead:]:
+            queue_processing(clerk_user.id, media.id, priority="batch")
+
+    # Header-only EXIF extraction for the whole batch
+    background_tasks.add_task(
+        extract_metadata_background,
+        [{"id": m.id, "file_url": m.file_url} for m in created_media],
+        current_trace_context()
+    )
+
+    logger.info(f"Queued {admitted} media for processing, deferred {len(created_media) - admitted}")
+    if admitted < len(created_media):
+        response.headers["X-Deferred-Count"] = str(len(created_media) - admitted)
     
     return created_media
 
@@ -277,7 +647,8 @@ def update_prediction(
         classification=update.classification,
         confidence=update.confidence,
         species=update.species,
-        predictions=update.predictions
+        predictions=update.predictions,
+        model_version=MANUAL_MODEL_VERSION
     )
     return updated
 
@@ -296,28 +667,22 @@ def get_predictions(media_id: str, request: Request, db: Session = Depends(get_d
     if not media.is_processed:
         raise HTTPException(status_code=404, detail="Predictions not ready yet")
 
-    # Return predictions directly from media object
-    import json
-    predictions_data = media.predictions
-    if isinstance(predictions_data, str):
-        try:
-            predictions_data = json.loads(predictions_data)
-        except:
-            predictions_data = None
-
+    # Detections are kept as compact arrays; the dict view is built here
     return {
         "media_id": media.id,
         "classification": media.classification,
         "confidence": media.confidence,
         "species": media.species,
-        "predictions": predictions_data
+        "predictions": predictions_view(media.detections, media.predictions),
+        "prefilter_score": media.prefilter_score,
+        "prefilter_decision": media.prefilter_decision,
+        "model_version": media.model_version
     }
     
 
 @router.post("/predictions/process/{media_id}")
 def trigger_processing(
     media_id: str,
-    background_tasks: BackgroundTasks,
     request: Request,
     db: Session = Depends(get_db)
 ):
@@ -329,12 +694,131 @@ def trigger_processing(
     if media.user_id != clerk_user.id:
         raise HTTPException(status_code=403, detail="Not authorized")
     
-    background_tasks.add_task(process_media_background, media_id)
+    queue_processing(clerk_user.id, media_id, priority="reprocess")
     logger.info(f"Manually triggered processing for media {media_id}")
     
     return {"message": "Processing triggered", "media_id": media_id}
 
 
+@router.get("/ml/cascade/stats")
+def get_cascade_stats(request: Request):
+    """Per-stage exit counts and rates of the inference cascade since startup"""
+    authenticate_and_get_user(request)
+    if media_processor is None:
+        raise HTTPException(status_code=503, detail="ML service not available")
+    return media_processor.ml_service.cascade_stats.snapshot()
+
+
+@router.get("/ml/scheduler/stats")
+def get_scheduler_stats(request: Request):
+    """Queue depth, active users and recent queue wait per priority class"""
+    authenticate_and_get_user(request)
+    stats = scheduler.stats()
+    stats["admission"] = admission.stats()
+    return stats
+
+
+# Weight files are watched for changes when MODEL_WATCH_INTERVAL > 0
+model_reloader.start_watch()
+
+
+@router.get("/ml/models")
+def get_loaded_models(request: Request):
+    """Loaded model version and weights, and the report of the last hot reload (admin only)"""
+    require_admin(request)
+    if media_processor is None:
+        raise HTTPException(status_code=503, detail="ML service not available")
+    return model_reloader.status()
+
+
+@router.post("/ml/models/reload", status_code=202)
+def reload_models(reload_request: ModelReloadRequest, request: Request):
+    """
+    Load new weights beside the serving models, warm them up and swap them in without
+    a restart (admin only). Images already being processed finish on the old models.
+    """
+    require_admin(request)
+    if media_processor is None:
+        raise HTTPException(status_code=503, detail="ML service not available")
+    try:
+        started = model_reloader.trigger(**reload_request.model_dump())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not started:
+        raise HTTPException(status_code=409, detail="A model reload is already in progress")
+    return model_reloader.status()
+
+
+# Running reprocess jobs continue from their checkpoint after a restart
+reprocess_manager.resume_running()
+
+
+def _get_reprocess_job(db: Session, job_id: str, request: Request):
+    from ..database import models
+    job = db.get(models.ReprocessJob, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Reprocess job not found")
+    if not is_admin(request) and job.user_id != authenticate_and_get_user(request).id:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    return job
+
+
+@router.post("/ml/reprocess")
+def start_reprocess_job(reprocess_request: ReprocessRequest, request: Request, db: Session = Depends(get_db)):
+    """
+    Start a background job that re-runs the current models over every processed image
+    whose predictions came from another model version. Users reprocess their own media;
+    admins may target one user or everyone.
+    """
+    if media_processor is None:
+        raise HTTPException(status_code=503, detail="ML service not available")
+    if is_admin(request):
+        user_id = reprocess_request.user_id
+    else:
+        user_id = authenticate_and_get_user(request).id
+    job = reprocess_manager.create_job(db, media_processor.ml_service.model_version, user_id)
+    return job_status(job)
+
+
+@router.get("/ml/reprocess/{job_id}")
+def get_reprocess_job(job_id: str, request: Request, db: Session = Depends(get_db)):
+    """Progress of a reprocess job"""
+    return job_status(_get_reprocess_job(db, job_id, request))
+
+
+@router.post("/ml/reprocess/{job_id}/{action}")
+def control_reprocess_job(job_id: str, action: str, request: Request, db: Session = Depends(get_db)):
+    """Pause, resume or cancel a reprocess job"""
+    job = _get_reprocess_job(db, job_id, request)
+    try:
+        job = reprocess_manager.set_status(db, job, action)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return job_status(job)
+
+
+# Blank-frame retention (BLANK_RETENTION policy) runs on a timer and on demand
+lifecycle_manager.start_periodic()
+
+
+@router.post("/media/lifecycle/run", status_code=202)
+def run_blank_retention(request: Request):
+    """Start a blank-frame retention pass now (admin only)"""
+    require_admin(request)
+    if lifecycle_manager.policy == "keep":
+        raise HTTPException(status_code=400, detail="BLANK_RETENTION is 'keep'; nothing to do")
+    if not lifecycle_manager.trigger():
+        raise HTTPException(status_code=409, detail="A retention pass is already running")
+    return lifecycle_manager.stats()
+
+
+@router.get("/media/lifecycle/stats")
+def get_blank_retention_stats(request: Request):
+    """Retention policy and the result of the last pass (admin only)"""
+    require_admin(request)
+    return lifecycle_manager.stats()
+
+
 # Add these endpoints to your routes.py (after the existing prediction routes)
 
 # ------------------ Export Routes ------------------
@@ -344,14 +828,13 @@ def get_non_blank_media(request: Request, db: Session = Depends(get_db)):
     clerk_user = authenticate_and_get_user(request)
     
     from ..database import models
-    # Query only non-blank, processed media
-    media = db.query(models.Media).filter(
-        models.Media.user_id == clerk_user.id,
-        models.Media.is_processed == True,
-        models.Media.classification == "non-blank"
-    ).order_by(models.Media.uploaded_at.desc()).all()
-    
-    return media
+    # Query only non-blank, processed media (columns only, no ORM objects)
+    rows = _with_predictions_view(iter_media_rows(
+        db, clerk_user.id, MEDIA_ALL_COLUMNS,
+        criteria=(models.Media.is_processed == True, models.Media.classification == "non-blank"),
+        order_by=models.Media.uploaded_at.desc(),
+    ))
+    return ndjson_response(rows) if wants_ndjson(request) else json_response(list(rows))
 
 @router.get("/media/export/csv")
 def export_non_blank_csv(request: Request, db: Session = Depends(get_db)):
@@ -359,7 +842,6 @@ def export_non_blank_csv(request: Request, db: Session = Depends(get_db)):
     clerk_user = authenticate_and_get_user(request)
     
     from ..database import models
-    import json
     
     # Get non-blank media
     media = db.query(models.Media).filter(
@@ -388,8 +870,7 @@ def export_non_blank_csv(request: Request, db: Session = Depends(get_db)):
     
     # Write data
     for m in media:
-        predictions = json.loads(m.predictions) if m.predictions else []
-        detection_count = len(predictions) if isinstance(predictions, list) else 0
+        detections_found = detection_count(m.detections, m.predictions)
         
         filename = m.file_url.split('/')[-1]
         
@@ -398,7 +879,7 @@ def export_non_blank_csv(request: Request, db: Session = Depends(get_db)):
             filename,
             m.species or "",
             f"{m.confidence * 100:.2f}%" if m.confidence else "",
-            detection_count,
+            detections_found,
             m.file_url,
             m.folder_path or "",
             m.uploaded_at.isoformat(),
@@ -416,51 +897,93 @@ def export_non_blank_csv(request: Request, db: Session = Depends(get_db)):
         }
     )
 
+@router.get("/media/export/parquet")
+def export_columnar(
+    request: Request,
+    table: str = "media",
+    format: str = "parquet",
+    scope: str = "non-blank",
+    db: Session = Depends(get_db)
+):
+    """
+    Stream media rows (table=media) or one row per detection (table=detections) as
+    Parquet or an Arrow IPC stream (format=arrow), with typed columns. scope=all
+    includes blank and unprocessed images.
+    """
+    clerk_user = authenticate_and_get_user(request)
+    if not columnar_export.available():
+        raise HTTPException(status_code=501, detail="Columnar export requires pyarrow (install the backend's \"export\" extra)")
+    if table not in ("media", "detections") or format not in ("parquet", "arrow") or scope not in ("non-blank", "all"):
+        raise HTTPException(status_code=400, detail="Invalid table, format or scope")
+
+    from ..database import models
+    criteria = ()
+    if scope == "non-blank":
+        criteria = (models.Media.is_processed == True, models.Media.classification == "non-blank")
+    rows = iter_media_rows(
+        db, clerk_user.id, columnar_export.MEDIA_EXPORT_COLUMNS, criteria=criteria,
+        order_by=models.Media.uploaded_at, batch_size=columnar_export.EXPORT_ROW_GROUP_ROWS,
+    )
+    extension = "parquet" if format == "parquet" else "arrows"
+    media_type = "application/vnd.apache.parquet" if format == "parquet" else "application/vnd.apache.arrow.stream"
+    return StreamingResponse(
+        columnar_export.stream_export(rows, table, format),
+        media_type=media_type,
+        headers={
+            "Content-Disposition": f"attachment; filename={table}_{datetime.now().strftime('%Y%m%d')}.{extension}"
+        }
+    )
+
 @router.get("/media/export/summary")
 def get_export_summary(request: Request, db: Session = Depends(get_db)):
     """Get summary statistics for export"""
     clerk_user = authenticate_and_get_user(request)
-    
+
     from ..database import models
+
+    def build():
+        total_media = db.query(models.Media).filter(
+            models.Media.user_id == clerk_user.id
+        ).count()
     
-    total_media = db.query(models.Media).filter(
-        models.Media.user_id == clerk_user.id
-    ).count()
-    
-    non_blank = db.query(models.Media).filter(
-        models.Media.user_id == clerk_user.id,
-        models.Media.classification == "non-blank"
-    ).count()
+        non_blank = db.query(models.Media).filter(
+            models.Media.user_id == clerk_user.id,
+            models.Media.classification == "non-blank"
+        ).count()
     
-    blank = db.query(models.Media).filter(
-        models.Media.user_id == clerk_user.id,
-        models.Media.classification == "blank"
-    ).count()
+        blank = db.query(models.Media).filter(
+            models.Media.user_id == clerk_user.id,
+            models.Media.classification == "blank"
+        ).count()
     
-    processing = db.query(models.Media).filter(
-        models.Media.user_id == clerk_user.id,
-        models.Media.is_processed == False
-    ).count()
+        processing = db.query(models.Media).filter(
+            models.Media.user_id == clerk_user.id,
+            models.Media.is_processed == False
+        ).count()
     
-    # Get unique species
-    species_list = db.query(models.Media.species).filter(
-        models.Media.user_id == clerk_user.id,
-        models.Media.species != None
-    ).distinct().all()
+        # Get unique species
+        species_list = db.query(models.Media.species).filter(
+            models.Media.user_id == clerk_user.id,
+            models.Media.species != None
+        ).distinct().all()
     
-    unique_species = set()
-    for (s,) in species_list:
-        if s:
-            unique_species.update(s.split(','))
+        unique_species = set()
+        for (s,) in species_list:
+            if s:
+                unique_species.update(s.split(','))
     
-    return {
-        "total_images": total_media,
-        "non_blank": non_blank,
-        "blank": blank,
-        "processing": processing,
-        "unique_species": sorted(list(unique_species)),
-        "species_count": len(unique_species)
-    }
+        return {
+            "total_images": total_media,
+            "non_blank": non_blank,
+            "blank": blank,
+            "processing": processing,
+            "unique_species": sorted(list(unique_species)),
+            "species_count": len(unique_species),
+            # Where unfinished stratified batches are heading (null when none is in progress)
+            "provisional": provisional_estimates(incomplete_batch_counts(db, clerk_user.id))
+        }
+
+    return cached_json_response(request, clerk_user.id, get_data_version(db, clerk_user.id), build)
 
 # ------------------ Folder Routes ------------------
 
@@ -476,121 +999,60 @@ def get_media_by_folder(
     from ..database import models
     
     # Query media with file_url containing the folder path
-    media = db.query(models.Media).filter(
-        models.Media.user_id == clerk_user.id,
-        models.Media.file_url.like(f"%{folder_path}%")
-    ).order_by(models.Media.uploaded_at.desc()).all()
-    
-    return media
+    rows = _with_predictions_view(iter_media_rows(
+        db, clerk_user.id, MEDIA_ALL_COLUMNS,
+        criteria=(models.Media.file_url.like(f"%{folder_path}%"),),
+        order_by=models.Media.uploaded_at.desc(),
+    ))
+    return ndjson_response(rows) if wants_ndjson(request) else json_response(list(rows))
 
 @router.get("/media/folders")
 def list_user_folders(request: Request, db: Session = Depends(get_db)):
     """List all unique folder paths for the user"""
     clerk_user = authenticate_and_get_user(request)
-    
+
     from ..database import models
+
+    def build():
+        # Get all media for the user
+        all_media = db.query(models.Media).filter(
+            models.Media.user_id == clerk_user.id
+        ).all()
     
-    # Get all media for the user
-    all_media = db.query(models.Media).filter(
-        models.Media.user_id == clerk_user.id
-    ).all()
-    
-    # Extract unique folder paths
-    folders = set()
-    for media in all_media:
-        if media.folder_path:
-            # Get parent folders
-            parts = media.folder_path.split('/')
-            for i in range(1, len(parts) + 1):
-                folder = '/'.join(parts[:i])
-                if folder:
-                    folders.add(folder)
+        # Extract unique folder paths
+        folders = set()
+        for media in all_media:
+            if media.folder_path:
+                # Get parent folders
+                parts = media.folder_path.split('/')
+                for i in range(1, len(parts) + 1):
+                    folder = '/'.join(parts[:i])
+                    if folder:
+                        folders.add(folder)
     
-    return {
-        "folders": sorted(list(folders)),
-        "total_count": len(folders)
-    }
+        return {
+            "folders": sorted(list(folders)),
+            "total_count": len(folders)
+        }
+
+    return cached_json_response(request, clerk_user.id, get_data_version(db, clerk_user.id), build)
     
 
 @router.get("/media/export/zip")
 def export_non_blank_zip(request: Request, db: Session = Depends(get_db)):
     """
-    Export all non-blank images for the current user as a ZIP.
+    Export all non-blank images for the current user as a ZIP, built during the request.
     Organizes images by species folder (if available) or preserves folder structure.
-    Includes metadata.csv in the ZIP.
+    Includes metadata.csv in the ZIP. Prefer POST /media/export/jobs for large collections.
     """
-    from ..database import models
     clerk_user = authenticate_and_get_user(request)
 
-    # Query all non-blank, processed media
-    media_items = db.query(models.Media).filter(
-        models.Media.user_id == clerk_user.id,
-        models.Media.is_processed == True,
-        models.Media.classification == "non-blank"
-    ).all()
-
-    if not media_items:
+    rows = list(export_jobs.non_blank_rows(db, clerk_user.id))
+    if not rows:
         return {"detail": "No non-blank media found"}
 
-    # Create in-memory ZIP
     zip_buffer = io.BytesIO()
-    with zipfile.ZipFile(zip_buffer, mode="w", compression=zipfile.ZIP_DEFLATED) as zip_file:
-        # Prepare metadata.csv
-        metadata_io = io.StringIO()
-        writer = csv.writer(metadata_io)
-        writer.writerow([
-            "Media ID", "Filename", "Species", "Confidence",
-            "Detection Count", "File URL", "Folder Path", "Uploaded At",
-            "Latitude", "Longitude"
-        ])
-
-        for media in media_items:
-            # Write metadata
-            predictions = []
-            if media.predictions:
-                import json
-                try:
-                    predictions = json.loads(media.predictions)
-                except:
-                    predictions = []
-            detection_count = len(predictions) if isinstance(predictions, list) else 0
-
-            filename = media.file_url.split("/")[-1]
-
-            writer.writerow([
-                media.id,
-                filename,
-                media.species or "",
-                f"{media.confidence*100:.2f}%" if media.confidence else "",
-                detection_count,
-                media.file_url,
-                media.folder_path or "",
-                media.uploaded_at.isoformat(),
-                media.latitude or "",
-                media.longitude or ""
-            ])
-
-            # Determine folder inside ZIP
-            if media.species:
-                # If multiple species, pick first as folder
-                species_folder = media.species.split(",")[0].strip()
-                zip_path = f"{species_folder}/{filename}"
-            elif media.folder_path:
-                zip_path = f"{media.folder_path}/{filename}"
-            else:
-                zip_path = filename
-
-            # Download file from S3
-            try:
-                response = requests.get(media.file_url)
-                response.raise_for_status()
-                zip_file.writestr(zip_path, response.content)
-            except Exception as e:
-                print(f"Failed to download {media.file_url}: {e}")
-
-        # Add metadata.csv
-        zip_file.writestr("metadata.csv", metadata_io.getvalue())
-
+    export_jobs.write_archive(rows, zip_buffer)
     zip_buffer.seek(0)
     filename_zip = f"non_blank_images_{datetime.now().strftime('%Y%m%d')}.zip"
 
@@ -598,4 +1060,136 @@ def export_non_blank_zip(request: Request, db: Session = Depends(get_db)):
         zip_buffer,
         media_type="application/zip",
         headers={"Content-Disposition": f"attachment; filename={filename_zip}"}
-    )
\ No newline at end of file
+    )
+
+
+@router.post("/media/export/jobs", status_code=202)
+def create_export_job(request: Request, response: Response, db: Session = Depends(get_db)):
+    """
+    Build the non-blank ZIP in the background and return the job to poll.
+    An archive that still matches the user's data is returned at once (reused=true)
+    with its download URL, and a request while a build is running returns that build.
+    """
+    clerk_user = authenticate_and_get_user(request)
+    try:
+        job, reused = export_manager.request_export(db, clerk_user.id)
+    except LookupError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    if job.status == "completed":
+        response.status_code = 200
+    return export_jobs.job_status(job, reused=reused)
+
+
+@router.get("/media/export/jobs/{job_id}")
+def get_export_job(job_id: str, request: Request, db: Session = Depends(get_db)):
+    """Progress of an export job; download_url is set once it has completed (or finished partial)"""
+    from ..database import models
+    clerk_user = authenticate_and_get_user(request)
+    job = db.get(models.ExportJob, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Export job not found")
+    if job.user_id != clerk_user.id:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    return export_jobs.job_status(job)
+
+
+# Interrupted exports are rebuilt after a restart
+export_manager.resume_pending()
+
+
+# Declared after every other GET /media/... route so the {media_id} path
+# parameter does not shadow them (e.g. /media/folders, /media/non-blank)
+@router.get("/media/{media_id}", response_model=MediaResponse)
+def get_specific_media(media_id: str, request: Request, db: Session = Depends(get_db)):
+    clerk_user = authenticate_and_get_user(request)
+    media = get_media_by_id(db, media_id)
+    if not media:
+        raise HTTPException(status_code=404, detail="Media not found")
+    if media.user_id != clerk_user.id:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    return media
+
+
+SIMILAR_COLUMNS = ("id", "file_url", "thumbnail_url", "folder_path", "captured_at",
+                   "classification", "confidence", "species")
+
+
+@router.get("/media/{media_id}/similar")
+def get_similar_media(media_id: str, request: Request, k: int = 20, db: Session = Depends(get_db)):
+    """The k images of the same user whose classifier embeddings are closest to media_id's."""
+    clerk_user = authenticate_and_get_user(request)
+    if embedding_store is None:
+        raise HTTPException(status_code=503, detail="Similar-image search is disabled")
+    media = get_media_by_id(db, media_id)
+    if not media:
+        raise HTTPException(status_code=404, detail="Media not found")
+    if media.user_id != clerk_user.id:
+        raise HTTPException(status_code=403, detail="Not authorized")
+
+    if media_processor is None:
+        raise HTTPException(status_code=503, detail="ML service not available")
+
+    k = max(1, min(k, 200))
+    # Only vectors from the loaded models are comparable (see services/embeddings.py)
+    matches = embedding_store.similar(clerk_user.id, media_id, media_processor.ml_service.weights_digest, k)
+    if matches is None:
+        raise HTTPException(status_code=404,
+                            detail="Media has no embedding from the current models yet; process or reprocess it first")
+
+    from ..database import models
+    scores = dict(matches)
+    rows = {
+        row["id"]: row
+        for row in iter_media_rows(db, clerk_user.id, SIMILAR_COLUMNS,
+                                   criteria=(models.Media.id.in_(list(scores)),))
+    }
+    # Index entries of deleted media are skipped
+    results = [dict(rows[found], score=round(score, 4)) for found, score in matches if found in rows]
+    return json_response({"media_id": media_id, "results": results})
+
+
+# ------------------ Local Storage Routes ------------------
+# Only active with STORAGE_BACKEND=local; they stand in for the S3 endpoints that
+# presigned URLs and Media.file_url point at.
+
+def _require_local_storage() -> LocalStorage:
+    if not isinstance(storage, LocalStorage):
+        raise HTTPException(status_code=404, detail="Local storage is not enabled")
+    return storage
+
+
+@router.put("/storage/{key:path}")
+async def put_local_object(key: str, request: Request, expires: int = 0, signature: str = ""):
+    """Receive a presigned PUT for local storage, streaming the body to disk"""
+    local = _require_local_storage()
+    if not local.verify("PUT", key, expires, signature):
+        raise HTTPException(status_code=403, detail="Invalid or expired signature")
+
+    try:
+        writer = local.open_writer(key)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid key")
+    with writer:
+        async for chunk in request.stream():
+            writer.write(chunk)
+        writer.close()
+    return {"file_url": local.url_for(key), "size": writer.bytes_written}
+
+
+@router.get("/storage/{key:path}")
+def get_local_object(key: str, expires: int = 0, signature: str = ""):
+    """
+    Serve an object from local storage.
+    FileResponse hands the path to the server, which uses sendfile/zero-copy
+    where the ASGI server supports it, so bytes never pass through Python.
+    """
+    local = _require_local_storage()
+    if not STORAGE_LOCAL_PUBLIC_READ and not local.verify("GET", key, expires, signature):
+        raise HTTPException(status_code=403, detail="Invalid or expired signature")
+    try:
+        path = local.path_for(key)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid key")
+    if not path.is_file():
+        raise HTTPException(status_code=404, detail="Object not found")
+    return FileResponse(path, media_type=_content_type_for(key))
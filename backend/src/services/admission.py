@@ -0,0 +1,231 @@
+"""
+Admission control for bulk ingest.
+
+Outstanding inference work is bounded globally (ADMISSION_MAX_QUEUED) and per
+user (ADMISSION_MAX_QUEUED_PER_USER), measured as jobs queued in the scheduler.
+When a /media/batch request does not fit, ADMISSION_OVERFLOW decides:
+
+- "defer" (default): all rows are created, the overflow with
+  queue_state="deferred". A pump thread moves deferred rows into the scheduler
+  as capacity frees up, spread across users. Deferred rows live in the DB, so
+  they survive a restart. Requests are only refused once a user's deferred
+  backlog reaches ADMISSION_MAX_DEFERRED_PER_USER.
+- "reject": requests that do not fit are refused outright.
+
+Refusals carry a Retry-After computed from the work ahead of the request and
+the scheduler's measured drain rate.
+
+Room is checked and reserved under one lock: admit() returns a Reservation that
+counts against the limits until the request's jobs are in the scheduler, so
+concurrent batches cannot each see the same free room. Deferred rows stay
+deferred in the DB until the pump has queued them, so a crash in between
+releases them again after the restart.
+"""
+
+import logging
+import math
+import os
+import threading
+from collections import Counter
+from typing import Callable, Dict, Optional
+
+from .scheduler import scheduler, InferenceScheduler
+from ..database.db import count_deferred_media, deferred_backlog, next_deferred_media, release_deferred_media
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+ADMISSION_MAX_QUEUED = int(os.getenv("ADMISSION_MAX_QUEUED", "20000"))
+ADMISSION_MAX_QUEUED_PER_USER = int(os.getenv("ADMISSION_MAX_QUEUED_PER_USER", "5000"))
+ADMISSION_MAX_DEFERRED_PER_USER = int(os.getenv("ADMISSION_MAX_DEFERRED_PER_USER", "200000"))
+ADMISSION_OVERFLOW = os.getenv("ADMISSION_OVERFLOW", "defer").lower()
+DEFERRED_PUMP_INTERVAL = float(os.getenv("DEFERRED_PUMP_INTERVAL", "5"))
+# Used until the scheduler has completed anything to measure
+FALLBACK_RETRY_AFTER = 30
+MAX_RETRY_AFTER = 3600
+
+
+class AdmissionRejected(Exception):
+    """Request refused. retry_after is in seconds, or None if retrying the same request cannot succeed."""
+
+    def __init__(self, message: str, retry_after: Optional[int]):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class Reservation:
+    """
+    Room held for one request until its jobs are queued (or it fails); use as a context manager.
+
+    queued: {user_id: jobs about to be submitted}; deferred: {user_id: rows about to be deferred}
+    """
+
+    def __init__(self, controller: "AdmissionController", queued: Dict[str, int], deferred: Dict[str, int] = None):
+        self.controller = controller
+        self.queued = queued
+        self.deferred = deferred or {}
+        self.admitted = sum(queued.values())
+        self._held = True
+
+    def release(self):
+        if self._held:
+            self._held = False
+            with self.controller._room_lock:
+                self.controller._hold(self.queued, self.deferred, -1)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+        return False
+
+
+class AdmissionController:
+    def __init__(self, sched: InferenceScheduler, max_queued: int = ADMISSION_MAX_QUEUED,
+                 max_queued_per_user: int = ADMISSION_MAX_QUEUED_PER_USER,
+                 max_deferred_per_user: int = ADMISSION_MAX_DEFERRED_PER_USER,
+                 overflow: str = ADMISSION_OVERFLOW):
+        self.scheduler = sched
+        self.max_queued = max_queued
+        self.max_queued_per_user = max_queued_per_user
+        self.max_deferred_per_user = max_deferred_per_user
+        self.overflow = overflow
+        self._pump = None
+        self._lock = threading.Lock()
+        # Room handed out by admit()/pump_once() whose jobs are not in the scheduler yet
+        self._room_lock = threading.Lock()
+        self._reserved: Dict[str, int] = {}
+        self._reserved_deferred: Dict[str, int] = {}
+
+    def _hold(self, queued: Dict[str, int], deferred: Dict[str, int], sign: int):
+        """Add (sign=1) or return (sign=-1) reserved room; caller holds _room_lock."""
+        for held, counts in ((self._reserved, queued), (self._reserved_deferred, deferred)):
+            for user_id, n in counts.items():
+                held[user_id] = held.get(user_id, 0) + sign * n
+                if held[user_id] <= 0:
+                    del held[user_id]
+
+    def _global_room(self) -> int:
+        return self.max_queued - self.scheduler.depth() - sum(self._reserved.values())
+
+    def capacity(self, user_id: str) -> int:
+        """How many more jobs this user may queue right now."""
+        user_room = (self.max_queued_per_user - self.scheduler.depth(user_id=user_id)
+                     - self._reserved.get(user_id, 0))
+        return max(0, min(self._global_room(), user_room))
+
+    def retry_after(self, backlog: int) -> int:
+        """Seconds until roughly `backlog` more jobs have drained at the measured rate."""
+        rate = self.scheduler.drain_rate()
+        if rate <= 0:
+            return FALLBACK_RETRY_AFTER
+        return int(min(MAX_RETRY_AFTER, max(1, math.ceil(backlog / rate))))
+
+    def admit(self, db, user_id: str, count: int) -> Reservation:
+        """
+        Decide how many of `count` new media are queued now; the rest are deferred.
+
+        Args:
+            db: session, used to look up the user's deferred backlog
+            user_id: the submitting user
+            count: number of new media rows in the request
+
+        Returns:
+            a Reservation whose admitted rows are queued immediately and the remaining
+            count - admitted deferred; release it once they are submitted or the rows committed
+
+        Raises:
+            AdmissionRejected: in "reject" mode when the request does not fit, or in
+                "defer" mode when the user's deferred backlog is full
+        """
+        with self._room_lock:
+            admitted = self._decide(db, user_id, count)
+            reservation = Reservation(self, {user_id: admitted}, {user_id: count - admitted})
+            self._hold(reservation.queued, reservation.deferred, 1)
+        return reservation
+
+    def _decide(self, db, user_id: str, count: int) -> int:
+        room = self.capacity(user_id)
+        if self.overflow == "reject":
+            if count <= room:
+                return count
+            if count > self.max_queued_per_user:
+                raise AdmissionRejected(
+                    f"Batch of {count} exceeds the per-user limit of {self.max_queued_per_user}; split it",
+                    None,
+                )
+            raise AdmissionRejected(
+                f"Inference backlog is full ({self.scheduler.depth()} queued); retry later",
+                self.retry_after(count - room),
+            )
+
+        # Rows other requests are deferring right now are not committed yet
+        deferred = count_deferred_media(db, user_id) + self._reserved_deferred.get(user_id, 0)
+        # Rows already deferred go first, so new rows never overtake them
+        admitted = 0 if deferred else min(count, room)
+        if count - admitted and deferred + count - admitted > self.max_deferred_per_user:
+            raise AdmissionRejected(
+                f"Too many deferred images ({deferred}); retry later",
+                self.retry_after(deferred + count - admitted - self.max_deferred_per_user),
+            )
+        return admitted
+
+    def start_pump(self, submit: Callable[[str, str], None], interval: float = DEFERRED_PUMP_INTERVAL):
+        """Start the thread that releases deferred rows; submit(user_id, media_id) queues one."""
+        with self._lock:
+            if self._pump is not None or self.overflow != "defer":
+                return
+            self._pump = threading.Thread(target=self._run_pump, args=(submit, interval),
+                                          name="admission-pump", daemon=True)
+            self._pump.start()
+
+    def _run_pump(self, submit, interval):
+        stop = threading.Event()
+        while not stop.wait(interval):
+            try:
+                self.pump_once(submit)
+            except Exception as e:
+                logger.error(f"Deferred pump failed: {e}", exc_info=True)
+
+    def pump_once(self, submit) -> int:
+        """Release as many deferred rows as there is room for, split evenly across users."""
+        if self._global_room() <= 0:
+            return 0
+        from ..database.models import SessionLocal
+        db = SessionLocal()
+        try:
+            with self._room_lock:
+                global_room = self._global_room()
+                backlog = deferred_backlog(db) if global_room > 0 else None
+                if not backlog:
+                    return 0
+                share = max(1, global_room // len(backlog))
+                limits = {user_id: min(share, self.capacity(user_id), n) for user_id, n in backlog.items()}
+                rows = next_deferred_media(db, {u: n for u, n in limits.items() if n > 0})
+                reservation = Reservation(self, dict(Counter(user_id for _, user_id in rows)))
+                self._hold(reservation.queued, reservation.deferred, 1)
+            with reservation:
+                for media_id, user_id in rows:
+                    submit(user_id, media_id)
+                # Only now: rows claimed but never submitted stay deferred across a crash
+                release_deferred_media(db, [media_id for media_id, _ in rows])
+        finally:
+            db.close()
+        if rows:
+            logger.info(f"Released {len(rows)} deferred media into the inference queue")
+        return len(rows)
+
+    def stats(self) -> dict:
+        return {
+            "overflow": self.overflow,
+            "queued": self.scheduler.depth(),
+            "reserved": sum(self._reserved.values()),
+            "max_queued": self.max_queued,
+            "max_queued_per_user": self.max_queued_per_user,
+            "drain_rate_per_s": round(self.scheduler.drain_rate(), 3),
+        }
+
+
+admission = AdmissionController(scheduler)
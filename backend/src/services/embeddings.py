@@ -0,0 +1,258 @@
+"""
+Per-user on-disk embedding index for similar-image search.
+
+The classifier already runs on every image; a forward hook on its pooling
+layer (see MLService) captures the backbone features for free. They are
+reduced to EMBEDDING_DIM with a fixed random projection, L2 normalized and
+appended to the owner's index as float16.
+
+Vectors from different classifier weights live in different spaces and are
+not comparable, so indexes are kept per embedding space (the loaded models'
+weights_digest). New weights - a deploy or a hot reload - start a fresh index
+that fills as images are processed or reprocessed; queries use the index of
+the models currently loaded.
+
+Layout under EMBEDDING_DIR/<space>/<user_id>/ (append-only, memory-mapped for reads):
+    vectors.f16   float16 [n, dim]
+    ids.bin       media ids, fixed 36 bytes each
+    lists.i32     IVF list of each vector (-1 until the index is trained)
+    centroids.npy float32 [nlist, dim]
+
+Below EMBEDDING_IVF_MIN vectors a query is an exact scan. Above it, k-means
+centroids are trained on a sample in a background thread (and retrained when
+the index has doubled), and a query only scores vectors in the
+EMBEDDING_NPROBE closest lists. One writer process per index is assumed;
+the API process and the offline ingest should not write the same user
+concurrently.
+"""
+
+import json
+import logging
+import os
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+EMBEDDINGS_ENABLED = os.getenv("EMBEDDINGS_ENABLED", "1") == "1"
+EMBEDDING_DIR = os.getenv("EMBEDDING_DIR", "./embeddings")
+EMBEDDING_DIM = int(os.getenv("EMBEDDING_DIM", "256"))
+EMBEDDING_IVF_MIN = int(os.getenv("EMBEDDING_IVF_MIN", "20000"))
+EMBEDDING_NPROBE = int(os.getenv("EMBEDDING_NPROBE", "8"))
+KMEANS_SAMPLE = 50000
+KMEANS_ITERATIONS = 10
+ID_BYTES = 36
+ASSIGN_CHUNK = 65536
+
+_projections: Dict[Tuple[int, int], np.ndarray] = {}
+
+
+def project(features: np.ndarray, dim: int = EMBEDDING_DIM) -> np.ndarray:
+    """Fixed random projection to dim, then L2 normalization (float16)."""
+    features = np.asarray(features, dtype=np.float32).reshape(-1)
+    if features.shape[0] > dim:
+        key = (features.shape[0], dim)
+        matrix = _projections.get(key)
+        if matrix is None:
+            # Seeded so every process (API, ingest workers) uses the same projection
+            rng = np.random.default_rng(0)
+            matrix = _projections[key] = (rng.standard_normal(key) / np.sqrt(dim)).astype(np.float32)
+        features = features @ matrix
+    norm = np.linalg.norm(features)
+    return (features / norm if norm > 0 else features).astype(np.float16)
+
+
+def _kmeans(sample: np.ndarray, k: int, iterations: int = KMEANS_ITERATIONS) -> np.ndarray:
+    """Spherical k-means (cosine) on unit vectors."""
+    rng = np.random.default_rng(0)
+    centroids = sample[rng.choice(len(sample), size=k, replace=False)].copy()
+    for _ in range(iterations):
+        labels = np.argmax(sample @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, sample)
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        empty = norms[:, 0] == 0
+        sums[empty] = sample[rng.choice(len(sample), size=int(empty.sum()))]
+        centroids = sums / np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-12)
+    return centroids.astype(np.float32)
+
+
+def _assign(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    out = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), ASSIGN_CHUNK):
+        chunk = np.asarray(vectors[start:start + ASSIGN_CHUNK], dtype=np.float32)
+        out[start:start + len(chunk)] = np.argmax(chunk @ centroids.T, axis=1)
+    return out
+
+
+class UserIndex:
+    def __init__(self, directory: str, dim: int = EMBEDDING_DIM):
+        self.directory = directory
+        self.dim = dim
+        self.lock = threading.RLock()
+        self._vectors = None
+        self._ids = None
+        self._lists = None
+        self._rows: Dict[str, int] = {}
+        self._rows_indexed = 0
+        self._mapped_count = -1
+        self.centroids = None
+        self.trained_count = 0
+        self._training = False
+        os.makedirs(directory, exist_ok=True)
+        meta = self._path("meta.json")
+        if os.path.exists(meta):
+            with open(meta) as f:
+                state = json.load(f)
+            self.trained_count = state.get("trained_count", 0)
+        if os.path.exists(self._path("centroids.npy")):
+            self.centroids = np.load(self._path("centroids.npy"))
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def count(self) -> int:
+        sizes = [
+            os.path.getsize(p) // width if os.path.exists(p) else 0
+            for p, width in ((self._path("vectors.f16"), self.dim * 2), (self._path("ids.bin"), ID_BYTES),
+                             (self._path("lists.i32"), 4))
+        ]
+        return min(sizes)
+
+    def _map(self):
+        """(Re)open the memory maps when the index has grown since the last read."""
+        n = self.count()
+        if n != self._mapped_count:
+            if n:
+                self._vectors = np.memmap(self._path("vectors.f16"), np.float16, "r", shape=(n, self.dim))
+                self._ids = np.memmap(self._path("ids.bin"), f"S{ID_BYTES}", "r", shape=(n,))
+                self._lists = np.memmap(self._path("lists.i32"), np.int32, "r", shape=(n,))
+            else:
+                self._vectors = self._ids = self._lists = None
+            self._mapped_count = n
+        return n
+
+    def _row_of(self, media_id: str) -> Optional[int]:
+        # The files are append-only, so only rows added since the last lookup need indexing.
+        # Later rows win, so a reprocessed image resolves to its newest vector.
+        for i in range(self._rows_indexed, self._mapped_count):
+            self._rows[self._ids[i].decode()] = i
+        self._rows_indexed = max(self._rows_indexed, self._mapped_count)
+        return self._rows.get(media_id)
+
+    def add(self, media_id: str, vector: np.ndarray):
+        vector = np.asarray(vector, dtype=np.float16).reshape(self.dim)
+        with self.lock:
+            list_id = -1
+            if self.centroids is not None:
+                list_id = int(np.argmax(self.centroids @ vector.astype(np.float32)))
+            with open(self._path("vectors.f16"), "ab") as f:
+                f.write(vector.tobytes())
+            with open(self._path("ids.bin"), "ab") as f:
+                f.write(media_id.encode()[:ID_BYTES].ljust(ID_BYTES, b"\0"))
+            with open(self._path("lists.i32"), "ab") as f:
+                f.write(np.int32(list_id).tobytes())
+            n = self.count()
+            if n >= EMBEDDING_IVF_MIN and n >= 2 * self.trained_count and not self._training:
+                self._training = True
+                threading.Thread(target=self._train, name="embedding-train", daemon=True).start()
+
+    def _train(self):
+        try:
+            with self.lock:
+                n = self._map()
+                vectors = self._vectors
+            nlist = max(16, int(np.sqrt(n)))
+            rng = np.random.default_rng(n)
+            sample_rows = np.sort(rng.choice(n, size=min(n, KMEANS_SAMPLE), replace=False))
+            centroids = _kmeans(np.asarray(vectors[sample_rows], dtype=np.float32), min(nlist, len(sample_rows)))
+            lists = _assign(vectors, centroids)
+
+            with self.lock:
+                # Vectors appended while training get assigned against the new centroids too
+                total = self._map()
+                if total > n:
+                    lists = np.concatenate([lists, _assign(self._vectors[n:total], centroids)])
+                tmp = self._path("lists.i32.tmp")
+                lists.tofile(tmp)
+                os.replace(tmp, self._path("lists.i32"))
+                np.save(self._path("centroids.npy"), centroids)
+                self.centroids = centroids
+                self.trained_count = total
+                with open(self._path("meta.json"), "w") as f:
+                    json.dump({"trained_count": total, "nlist": len(centroids), "dim": self.dim}, f)
+                self._mapped_count = -1
+            logger.info(f"Trained IVF index at {self.directory}: {total} vectors, {len(centroids)} lists")
+        except Exception as e:
+            logger.error(f"Embedding index training failed for {self.directory}: {e}", exc_info=True)
+        finally:
+            self._training = False
+
+    def search(self, media_id: str, k: int = 20, nprobe: int = EMBEDDING_NPROBE) -> Optional[List[Tuple[str, float]]]:
+        """k most similar media to media_id as (media_id, cosine); None if media_id is not indexed."""
+        with self.lock:
+            n = self._map()
+            if not n:
+                return None
+            row = self._row_of(media_id)
+            if row is None:
+                return None
+            vectors, ids, lists, centroids = self._vectors, self._ids, self._lists, self.centroids
+            newest = self._rows
+
+        query = np.asarray(vectors[row], dtype=np.float32)
+        if centroids is not None:
+            probes = np.argsort(centroids @ query)[::-1][:nprobe]
+            candidates = np.flatnonzero(np.isin(lists, probes) | (lists < 0))
+        else:
+            candidates = np.arange(n)
+        scores = np.asarray(vectors[candidates], dtype=np.float32) @ query
+
+        order = np.argsort(scores)[::-1]
+        results, seen = [], {media_id}
+        for i in order:
+            found = ids[candidates[i]].decode()
+            # Reprocessing appends a new vector; superseded rows of an image are ignored
+            if found in seen or newest.get(found) != candidates[i]:
+                continue
+            seen.add(found)
+            results.append((found, float(scores[i])))
+            if len(results) >= k:
+                break
+        return results
+
+
+def _safe_name(name: str) -> str:
+    return "".join(c if c.isalnum() or c in "-_." else "_" for c in name).lstrip(".") or "_"
+
+
+class EmbeddingStore:
+    """Lazily opened UserIndex per (embedding space, user)"""
+
+    def __init__(self, root: str = EMBEDDING_DIR):
+        self.root = root
+        self._indexes: Dict[Tuple[str, str], UserIndex] = {}
+        self._lock = threading.Lock()
+
+    def index_for(self, user_id: str, space: str) -> UserIndex:
+        with self._lock:
+            index = self._indexes.get((space, user_id))
+            if index is None:
+                directory = os.path.join(self.root, _safe_name(space), _safe_name(user_id))
+                index = self._indexes[(space, user_id)] = UserIndex(directory)
+            return index
+
+    def add(self, user_id: str, media_id: str, embedding: np.ndarray, space: str):
+        """space: weights_digest of the models that produced the embedding"""
+        self.index_for(user_id, space).add(media_id, embedding)
+
+    def similar(self, user_id: str, media_id: str, space: str, k: int = 20) -> Optional[List[Tuple[str, float]]]:
+        """Neighbours within one embedding space; None if media_id has no vector in it."""
+        return self.index_for(user_id, space).search(media_id, k)
+
+
+embedding_store = EmbeddingStore() if EMBEDDINGS_ENABLED else None
@@ -0,0 +1,235 @@
+"""
+exif.py
+
+Header-only EXIF extraction for uploaded media.
+
+Camera trap JPEGs keep their EXIF block in the APP1 segment right after the
+SOI marker, so the first ~64 KB of the object is enough to recover GPS,
+capture time and camera serial without downloading the full 5-10 MB file.
+
+A failed header fetch leaves Media.metadata_extracted False; a retry loop
+picks such rows up again every EXIF_RETRY_INTERVAL for EXIF_RETRY_MAX_AGE
+after the upload.
+"""
+
+import io
+import logging
+import os
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+import requests
+from PIL import Image
+
+from .storage import storage, is_fetchable_url
+from ..database.db import get_media_missing_metadata
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+EXIF_HEADER_BYTES = int(os.getenv("EXIF_HEADER_BYTES", str(64 * 1024)))
+EXIF_FETCH_WORKERS = int(os.getenv("EXIF_FETCH_WORKERS", "8"))
+EXIF_RETRY_INTERVAL = float(os.getenv("EXIF_RETRY_INTERVAL", "300"))  # seconds; 0 disables retries
+EXIF_RETRY_MAX_AGE = float(os.getenv("EXIF_RETRY_MAX_AGE", str(24 * 3600)))  # seconds after upload
+EXIF_RETRY_BATCH = int(os.getenv("EXIF_RETRY_BATCH", "500"))
+
+# EXIF tag ids
+_GPS_IFD = 0x8825
+_EXIF_IFD = 0x8769
+_DATETIME = 0x0132
+_DATETIME_ORIGINAL = 0x9003
+_BODY_SERIAL = 0xA431
+_CAMERA_SERIAL = 0xC62F
+
+
+def fetch_header(file_url: str, num_bytes: int = EXIF_HEADER_BYTES) -> bytes:
+    """
+    Fetch only the first num_bytes of an object.
+
+    Objects in our storage backend use its range read (S3 ranged GET, or an
+    mmap slice for local storage); anything else uses an HTTP Range request.
+    Servers that ignore Range still only get num_bytes read off the socket
+    before the connection is closed.
+    """
+    object_key = storage.key_from_url(file_url)
+    if object_key is not None:
+        return storage.get_range(object_key, 0, num_bytes - 1)
+
+    headers = {"Range": f"bytes=0-{num_bytes - 1}"}
+    with requests.get(file_url, headers=headers, stream=True, timeout=30) as response:
+        response.raise_for_status()
+        data = bytearray()
+        for chunk in response.iter_content(chunk_size=16 * 1024):
+            data.extend(chunk)
+            if len(data) >= num_bytes:
+                break
+        return bytes(data[:num_bytes])
+
+
+def _find_jpeg_exif(header: bytes) -> Optional[bytes]:
+    """Return the APP1 Exif payload from a (possibly truncated) JPEG header."""
+    if not header.startswith(b"\xff\xd8"):
+        return None
+    pos = 2
+    while pos + 4 <= len(header):
+        if header[pos] != 0xFF:
+            return None
+        marker = header[pos + 1]
+        if marker in (0xD9, 0xDA):  # EOI / start of scan: no more metadata
+            return None
+        (length,) = struct.unpack(">H", header[pos + 2:pos + 4])
+        segment = header[pos + 4:pos + 2 + length]
+        if marker == 0xE1 and segment.startswith(b"Exif\x00\x00"):
+            return segment
+        pos += 2 + length
+    return None
+
+
+def _to_degrees(value) -> Optional[float]:
+    try:
+        d, m, s = (float(v) for v in value)
+        return d + m / 60.0 + s / 3600.0
+    except Exception:
+        return None
+
+
+def _parse_datetime(value) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        return datetime.strptime(str(value).strip("\x00 "), "%Y:%m:%d %H:%M:%S")
+    except ValueError:
+        return None
+
+
+def parse_exif(header: bytes) -> Dict:
+    """
+    Parse GPS, capture timestamp and camera serial from the start of an image.
+
+    Returns a dict with keys latitude, longitude, captured_at, camera_serial;
+    any value that is missing or unreadable is None.
+    """
+    result = {"latitude": None, "longitude": None, "captured_at": None, "camera_serial": None}
+
+    exif = Image.Exif()
+    payload = _find_jpeg_exif(header)
+    try:
+        if payload is not None:
+            exif.load(payload)
+        else:
+            # TIFF and friends keep their IFDs at the start of the file too
+            exif = Image.open(io.BytesIO(header)).getexif()
+    except Exception as e:
+        logger.debug(f"No readable EXIF in header: {e}")
+        return result
+
+    exif_ifd = exif.get_ifd(_EXIF_IFD)
+    gps_ifd = exif.get_ifd(_GPS_IFD)
+
+    result["captured_at"] = _parse_datetime(exif_ifd.get(_DATETIME_ORIGINAL) or exif.get(_DATETIME))
+
+    serial = exif_ifd.get(_BODY_SERIAL) or exif.get(_CAMERA_SERIAL)
+    if serial:
+        result["camera_serial"] = str(serial).strip("\x00 ")
+
+    # GPS tags: 1/2 = lat ref/value, 3/4 = lon ref/value
+    lat = _to_degrees(gps_ifd.get(2)) if gps_ifd.get(2) else None
+    lon = _to_degrees(gps_ifd.get(4)) if gps_ifd.get(4) else None
+    if lat is not None and lon is not None:
+        if gps_ifd.get(1) == "S":
+            lat = -lat
+        if gps_ifd.get(3) == "W":
+            lon = -lon
+        result["latitude"] = round(lat, 6)
+        result["longitude"] = round(lon, 6)
+
+    return result
+
+
+def extract_metadata(file_url: str) -> Dict:
+    """Fetch the header of a single object and parse its EXIF metadata."""
+    header = fetch_header(file_url)
+    metadata = parse_exif(header)
+    metadata["header_bytes"] = len(header)
+    return metadata
+
+
+def extract_metadata_batch(media: List[Dict]) -> List[Dict]:
+    """
+    Extract EXIF metadata for many media items concurrently.
+
+    Args:
+        media: list of dicts with keys ['id', 'file_url']
+
+    Returns:
+        list of dicts with 'id' plus the parsed metadata fields. Items whose
+        header could not be fetched carry only 'error' and header_bytes 0.
+    """
+    def _one(item):
+        try:
+            metadata = extract_metadata(item["file_url"])
+        except Exception as e:
+            logger.warning(f"EXIF header fetch failed for {item['id']}: {e}")
+            metadata = {"header_bytes": 0, "error": str(e)}
+        metadata["id"] = item["id"]
+        return metadata
+
+    with ThreadPoolExecutor(max_workers=EXIF_FETCH_WORKERS) as pool:
+        results = list(pool.map(_one, media))
+
+    fetched = sum(r["header_bytes"] for r in results)
+    failed = sum(1 for r in results if r.get("error"))
+    logger.info(f"Extracted EXIF for {len(results) - failed} media using {fetched} header bytes"
+                + (f"; {failed} fetches failed and will be retried" if failed else ""))
+    return results
+
+
+def retry_missing_metadata(extract: Callable[[List[Dict]], None]) -> int:
+    """
+    Hand recent media whose header was never read to extract (e.g. extract_metadata_background).
+
+    Rows younger than one retry interval are left to their first extraction; rows older
+    than EXIF_RETRY_MAX_AGE are given up on. Returns the number of media handed over.
+    """
+    from ..database.models import SessionLocal
+    now = datetime.now()
+    db = SessionLocal()
+    try:
+        items = get_media_missing_metadata(db, since=now - timedelta(seconds=EXIF_RETRY_MAX_AGE),
+                                           before=now - timedelta(seconds=EXIF_RETRY_INTERVAL),
+                                           limit=EXIF_RETRY_BATCH)
+    finally:
+        db.close()
+    # Media registered in place by the ingest CLI (file://) are never read by the server
+    items = [item for item in items if is_fetchable_url(item["file_url"])]
+    if items:
+        logger.info(f"Retrying EXIF extraction for {len(items)} media")
+        extract(items)
+    return len(items)
+
+
+_retry_thread = None
+_retry_lock = threading.Lock()
+
+
+def start_retry_loop(extract: Callable[[List[Dict]], None], interval: float = EXIF_RETRY_INTERVAL):
+    """Run retry_missing_metadata every interval seconds in a daemon thread (once per process)."""
+    global _retry_thread
+    with _retry_lock:
+        if interval <= 0 or _retry_thread is not None:
+            return
+
+        def loop():
+            stop = threading.Event()
+            while not stop.wait(interval):
+                try:
+                    retry_missing_metadata(extract)
+                except Exception as e:
+                    logger.error(f"EXIF retry failed: {e}", exc_info=True)
+
+        _retry_thread = threading.Thread(target=loop, name="exif-retry", daemon=True)
+        _retry_thread.start()
@@ -0,0 +1,349 @@
+"""
+Background ZIP exports of a user's non-blank images.
+
+An export job streams the archive straight into storage (local file or S3
+multipart upload) from a small thread pool, so building it never holds an
+API worker or the whole archive in memory. Progress is stored on the
+ExportJob row and the client downloads the result through a presigned URL.
+
+Finished archives are reused instead of rebuilt:
+1. the user's DataVersion is unchanged since the archive was built, or
+2. the version moved (e.g. new blank uploads) but the manifest - a hash of
+   every exported row's metadata - is identical.
+Repeated requests while a job is running return that job. Builds where some
+images could not be fetched finish as "partial": they can be downloaded, but
+are never reused, so the next request rebuilds and retries the missing images.
+"""
+
+import csv
+import hashlib
+import io
+import logging
+import os
+import threading
+import time
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+from .storage import storage, fetch_bytes
+from ..database import models
+from ..database.db import get_data_version, iter_media_rows
+from ..utils.detections import detection_count
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+EXPORT_JOB_WORKERS = int(os.getenv("EXPORT_JOB_WORKERS", "1"))
+EXPORT_FETCH_WORKERS = int(os.getenv("EXPORT_FETCH_WORKERS", "8"))
+EXPORT_URL_EXPIRATION = int(os.getenv("EXPORT_URL_EXPIRATION", "3600"))
+PROGRESS_INTERVAL = 2.0  # seconds between progress commits
+FETCH_WINDOW = 64        # images fetched concurrently ahead of the writer
+ACTIVE_STATUSES = ("pending", "running")
+DOWNLOADABLE_STATUSES = ("completed", "partial")  # only "completed" archives are reused
+
+EXPORT_COLUMNS = (
+    "id", "file_url", "species", "confidence", "detections", "predictions",
+    "folder_path", "uploaded_at", "latitude", "longitude",
+)
+METADATA_HEADER = [
+    "Media ID", "Filename", "Species", "Confidence",
+    "Detection Count", "File URL", "Folder Path", "Uploaded At",
+    "Latitude", "Longitude"
+]
+
+
+def non_blank_rows(db, user_id: str) -> Iterable[Dict]:
+    """The rows a non-blank export contains, in primary key order (stable manifest)."""
+    return iter_media_rows(
+        db, user_id, EXPORT_COLUMNS,
+        criteria=(models.Media.is_processed == True, models.Media.classification == "non-blank"),
+        order_by=models.Media.id,
+    )
+
+
+def metadata_row(row: Dict) -> list:
+    return [
+        row["id"],
+        row["file_url"].split("/")[-1],
+        row["species"] or "",
+        f"{row['confidence']*100:.2f}%" if row["confidence"] else "",
+        detection_count(row["detections"], row["predictions"]),
+        row["file_url"],
+        row["folder_path"] or "",
+        row["uploaded_at"].isoformat() if row["uploaded_at"] else "",
+        row["latitude"] or "",
+        row["longitude"] or "",
+    ]
+
+
+def zip_path(row: Dict) -> str:
+    """Species folder (first species if several), else the uploaded folder structure."""
+    filename = row["file_url"].split("/")[-1]
+    if row["species"]:
+        return f"{row['species'].split(',')[0].strip()}/{filename}"
+    if row["folder_path"]:
+        return f"{row['folder_path']}/{filename}"
+    return filename
+
+
+def manifest_hash(rows: Iterable[Dict]) -> Tuple[str, int]:
+    """sha256 over the metadata of every exported row, and the row count."""
+    digest = hashlib.sha256()
+    count = 0
+    for row in rows:
+        digest.update(repr(metadata_row(row)).encode())
+        count += 1
+    return digest.hexdigest(), count
+
+
+class _ZipSink:
+    """Adapts a storage writer to the write/flush file object zipfile streams into"""
+
+    def __init__(self, writer):
+        self.writer = writer
+
+    def write(self, data) -> int:
+        self.writer.write(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+
+def write_archive(rows: Iterable[Dict], fileobj,
+                  on_progress: Optional[Callable[[int, int], None]] = None) -> Tuple[str, int, int]:
+    """
+    Write the non-blank ZIP (images + metadata.csv) to fileobj, fetching images concurrently.
+
+    Images are stored without recompression (JPEG/PNG are already compressed);
+    only metadata.csv is deflated.
+
+    Args:
+        rows: rows with EXPORT_COLUMNS, e.g. non_blank_rows(db, user_id)
+        fileobj: writable file object; it need not be seekable
+        on_progress: called with (written, failed) after every image
+
+    Returns:
+        (manifest hash of the rows written, images written, images that failed)
+    """
+    digest = hashlib.sha256()
+    metadata_io = io.StringIO()
+    writer = csv.writer(metadata_io)
+    writer.writerow(METADATA_HEADER)
+    written = failed = 0
+
+    def fetch(row):
+        try:
+            return fetch_bytes(row["file_url"])
+        except Exception as e:
+            logger.warning(f"Failed to download {row['file_url']}: {e}")
+            return None
+
+    with zipfile.ZipFile(fileobj, mode="w", compression=zipfile.ZIP_STORED) as zip_file, \
+            ThreadPoolExecutor(max_workers=EXPORT_FETCH_WORKERS, thread_name_prefix="export-fetch") as pool:
+        window = []
+
+        def drain():
+            nonlocal written, failed
+            for row, data in zip(window, pool.map(fetch, window)):
+                line = metadata_row(row)
+                digest.update(repr(line).encode())
+                writer.writerow(line)
+                if data is None:
+                    failed += 1
+                else:
+                    zip_file.writestr(zip_path(row), data)
+                    written += 1
+                if on_progress:
+                    on_progress(written, failed)
+            window.clear()
+
+        for row in rows:
+            window.append(row)
+            if len(window) >= FETCH_WINDOW:
+                drain()
+        drain()
+        zip_file.writestr("metadata.csv", metadata_io.getvalue(), compress_type=zipfile.ZIP_DEFLATED)
+    return digest.hexdigest(), written, failed
+
+
+def job_status(job: models.ExportJob, reused: bool = False) -> Dict:
+    done = (job.processed or 0) + (job.failed or 0)
+    status = {
+        "job_id": job.id,
+        "status": job.status,
+        "reused": reused,
+        "total": job.total,
+        "processed": job.processed,
+        "failed": job.failed,
+        "progress": round(done / job.total, 4) if job.total else (1.0 if job.status == "completed" else 0.0),
+        "size_bytes": job.size_bytes,
+        "data_version": job.data_version,
+        "error": job.error,
+        "created_at": job.created_at,
+        "completed_at": job.completed_at,
+        "download_url": None,
+    }
+    if job.status in DOWNLOADABLE_STATUSES and job.object_key:
+        status["download_url"] = storage.presign_get(job.object_key, expiration=EXPORT_URL_EXPIRATION)
+    return status
+
+
+class ExportManager:
+    """Creates, reuses and runs export jobs on a small thread pool"""
+
+    def __init__(self, workers: int = EXPORT_JOB_WORKERS):
+        self.workers = workers
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _submit_build(self, job_id: str):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="export-job")
+        self._executor.submit(self._build, job_id)
+
+    def _latest(self, db, user_id: str, kind: str, *criteria) -> Optional[models.ExportJob]:
+        return (
+            db.query(models.ExportJob)
+            .filter(models.ExportJob.user_id == user_id, models.ExportJob.kind == kind, *criteria)
+            .order_by(models.ExportJob.created_at.desc())
+            .first()
+        )
+
+    def _available(self, job: Optional[models.ExportJob]) -> bool:
+        if job is None or not job.object_key:
+            return False
+        try:
+            return storage.exists(job.object_key)
+        except Exception as e:
+            logger.warning(f"Could not check export archive {job.object_key}: {e}")
+            return False
+
+    def current_archive(self, db, user_id: str, kind: str = "zip") -> Optional[models.ExportJob]:
+        """A finished archive that matches the user's current data version, if any."""
+        job = self._latest(db, user_id, kind, models.ExportJob.status == "completed",
+                           models.ExportJob.data_version == get_data_version(db, user_id))
+        return job if self._available(job) else None
+
+    def request_export(self, db, user_id: str, kind: str = "zip") -> Tuple[models.ExportJob, bool]:
+        """
+        Return an up-to-date archive job for the user, starting a build only if needed.
+
+        Returns:
+            (job, reused): reused is True when an existing archive or running job is returned
+
+        Raises:
+            LookupError: the user has no non-blank media
+        """
+        version = get_data_version(db, user_id)
+        job = self.current_archive(db, user_id, kind)
+        if job is not None:
+            return job, True
+
+        running = self._latest(db, user_id, kind, models.ExportJob.status.in_(ACTIVE_STATUSES))
+        if running is not None:
+            return running, True
+
+        manifest, total = manifest_hash(non_blank_rows(db, user_id))
+        if not total:
+            raise LookupError("No non-blank media found")
+        previous = self._latest(db, user_id, kind, models.ExportJob.status == "completed",
+                                models.ExportJob.manifest_hash == manifest)
+        if self._available(previous):
+            # Only unrelated rows changed: the archive is still exact for this version
+            previous.data_version = version
+            db.commit()
+            logger.info(f"Export {previous.id} reused for {user_id} at data version {version}")
+            return previous, True
+
+        job = models.ExportJob(
+            id=str(uuid.uuid4()),
+            user_id=user_id,
+            kind=kind,
+            status="pending",
+            data_version=version,
+            manifest_hash=manifest,
+            total=total,
+            processed=0,
+            failed=0,
+        )
+        job.object_key = f"exports/{user_id}/{job.id}.zip"
+        db.add(job)
+        db.commit()
+        db.refresh(job)
+        self._submit_build(job.id)
+        return job, False
+
+    def resume_pending(self):
+        """Rebuild jobs interrupted by a restart (archives are streamed, so they start over)."""
+        db = models.SessionLocal()
+        try:
+            job_ids = [job_id for (job_id,) in
+                       db.query(models.ExportJob.id).filter(models.ExportJob.status.in_(ACTIVE_STATUSES))]
+        finally:
+            db.close()
+        for job_id in job_ids:
+            self._submit_build(job_id)
+
+    def _build(self, job_id: str):
+        db = models.SessionLocal()
+        try:
+            job = db.get(models.ExportJob, job_id)
+            if job is None:
+                return
+            # Version first: rows changing during the build then leave it stale rather than wrong
+            job.data_version = get_data_version(db, job.user_id)
+            job.status = "running"
+            job.processed = job.failed = 0
+            db.commit()
+            started = time.perf_counter()
+            last_commit = [started]
+
+            def on_progress(written, failed):
+                now = time.perf_counter()
+                if now - last_commit[0] >= PROGRESS_INTERVAL:
+                    job.processed, job.failed = written, failed
+                    db.commit()
+                    last_commit[0] = now
+
+            # Rows stream from their own session so progress commits don't disturb the cursor
+            read_db = models.SessionLocal()
+            try:
+                with storage.open_writer(job.object_key, content_type="application/zip") as writer:
+                    manifest, written, failed = write_archive(
+                        non_blank_rows(read_db, job.user_id), _ZipSink(writer), on_progress
+                    )
+                    writer.close()
+            finally:
+                read_db.close()
+
+            job.total = written + failed
+            job.processed, job.failed = written, failed
+            job.manifest_hash = manifest
+            job.size_bytes = writer.bytes_written
+            # A transient fetch error must not become a lasting gap: partial archives are not reused
+            job.status = "partial" if failed else "completed"
+            job.completed_at = datetime.now()
+            db.commit()
+            logger.info(
+                f"Export {job_id}: {written} images ({failed} failed), "
+                f"{writer.bytes_written} bytes in {time.perf_counter() - started:.1f}s"
+            )
+        except Exception as e:
+            logger.error(f"Export {job_id} failed: {e}", exc_info=True)
+            db.rollback()
+            job = db.get(models.ExportJob, job_id)
+            if job is not None:
+                job.status = "failed"
+                job.error = str(e)
+                db.commit()
+        finally:
+            db.close()
+
+
+export_manager = ExportManager()
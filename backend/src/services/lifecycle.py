@@ -0,0 +1,213 @@
+"""
+Retention policy for blank frames.
+
+Most frames are blank, and once a blank classification is confident (or was
+confirmed by hand) the full-size original is rarely looked at again.
+BLANK_RETENTION selects what lifecycle jobs do with blank originals older
+than BLANK_RETENTION_MIN_AGE_DAYS:
+
+- "keep" (default): nothing
+- "cold": copy the original into the cold tier (S3 STORAGE_COLD_CLASS, or
+  STORAGE_LOCAL_COLD_ROOT), point Media.file_url at the copy, delete the hot
+  object
+- "thumbnail": keep only the WebP renditions (generated if missing) and the
+  sha256 content_hash of the original; Media.file_url points at the preview
+
+Jobs walk candidates in primary key order, BLANK_RETENTION_BATCH_SIZE at a
+time. For each batch the new objects are written first, then the rows are
+updated in one transaction (bumping the owners' data version so cached
+listings refresh), and only then are the hot originals deleted. A crash can
+leave an orphaned original, but never a row pointing at a missing object.
+Objects the storage backend does not own (file:// or foreign URLs) are skipped.
+"""
+
+import hashlib
+import io
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+from PIL import Image
+
+from .renditions import make_renditions, rendition_key
+from .storage import storage
+from ..database import models
+from ..database.db import next_blank_retention_candidates, apply_storage_tiering
+from ..utils.metrics import registry, Counter
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+BLANK_RETENTION = os.getenv("BLANK_RETENTION", "keep").lower()
+BLANK_RETENTION_MIN_AGE_DAYS = float(os.getenv("BLANK_RETENTION_MIN_AGE_DAYS", "7"))
+BLANK_RETENTION_MIN_CONFIDENCE = float(os.getenv("BLANK_RETENTION_MIN_CONFIDENCE", "0.9"))
+BLANK_RETENTION_BATCH_SIZE = int(os.getenv("BLANK_RETENTION_BATCH_SIZE", "500"))
+BLANK_RETENTION_INTERVAL = float(os.getenv("BLANK_RETENTION_INTERVAL", "3600"))  # 0 = only on demand
+POLICIES = ("keep", "cold", "thumbnail")
+
+lifecycle_objects = registry.register(Counter(
+    "trapsense_lifecycle_objects_total", "Blank originals handled by retention jobs", ["result"]))
+
+
+class LifecycleManager:
+    """Runs retention passes periodically or on demand; one pass at a time per process"""
+
+    def __init__(self, policy: str = BLANK_RETENTION, batch_size: int = BLANK_RETENTION_BATCH_SIZE,
+                 min_age_days: float = BLANK_RETENTION_MIN_AGE_DAYS,
+                 min_confidence: float = BLANK_RETENTION_MIN_CONFIDENCE):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown BLANK_RETENTION policy: {policy}")
+        self.policy = policy
+        self.batch_size = batch_size
+        self.min_age_days = min_age_days
+        self.min_confidence = min_confidence
+        self._running = threading.Lock()
+        self._periodic = None
+        self.last_run: Optional[Dict] = None
+
+    def _tier_one(self, row: Dict) -> Optional[Dict]:
+        """Write the replacement object(s) for one row; returns the row update, or None to skip."""
+        key = storage.key_from_url(row["file_url"])
+        if key is None:
+            return None
+
+        if self.policy == "cold":
+            cold_key = storage.copy_to_cold(key)
+            return {"id": row["id"], "file_url": storage.url_for(cold_key),
+                    "storage_tier": "cold", "_delete": key, "_written": cold_key}
+
+        update = {"id": row["id"], "storage_tier": "pruned", "_delete": key}
+        original = None
+        if not row["content_hash"]:
+            original = storage.get(key)
+            update["content_hash"] = hashlib.sha256(original).hexdigest()
+        thumbnail_url, preview_url = row["thumbnail_url"], row["preview_url"]
+        if not thumbnail_url:
+            if original is None:
+                original = storage.get(key)
+            image = Image.open(io.BytesIO(original)).convert("RGB")
+            for name, data in make_renditions(image).items():
+                url = storage.put_bytes(rendition_key(row["user_id"], row["id"], name), data,
+                                        content_type="image/webp")
+                if name == "thumb":
+                    thumbnail_url = update["thumbnail_url"] = url
+                elif name == "preview":
+                    preview_url = update["preview_url"] = url
+        update["file_url"] = preview_url or thumbnail_url
+        return update
+
+    def run_once(self, limit: Optional[int] = None) -> Dict:
+        """
+        One retention pass over every eligible blank frame (or the first `limit`).
+
+        Returns:
+            counts per result ("cold", "pruned", "skipped", "failed") and timing
+        """
+        if self.policy == "keep":
+            return {"policy": self.policy, "counts": {}}
+        if not self._running.acquire(blocking=False):
+            raise RuntimeError("A retention pass is already running")
+        started = time.perf_counter()
+        counts = {"cold": 0, "pruned": 0, "skipped": 0, "failed": 0}
+        db = models.SessionLocal()
+        try:
+            older_than = datetime.now() - timedelta(days=self.min_age_days)
+            after_id = None
+            seen = 0
+            while limit is None or seen < limit:
+                page_size = self.batch_size if limit is None else min(self.batch_size, limit - seen)
+                rows = next_blank_retention_candidates(db, older_than, self.min_confidence, after_id, page_size)
+                db.commit()
+                if not rows:
+                    break
+                after_id = rows[-1]["id"]
+                seen += len(rows)
+
+                updates = []
+                for row in rows:
+                    try:
+                        update = self._tier_one(row)
+                    except Exception as e:
+                        logger.warning(f"Retention failed for {row['id']}: {e}")
+                        counts["failed"] += 1
+                        continue
+                    if update is None:
+                        counts["skipped"] += 1
+                    else:
+                        updates.append(update)
+
+                # Rows first, hot originals last: an interrupted batch never leaves a dangling file_url.
+                # Rows relabelled since they were selected are not updated, and keep their original.
+                keys = {u["id"]: (u.pop("_delete"), u.pop("_written", None)) for u in updates}
+                applied = apply_storage_tiering(db, updates)
+                for media_id, (key, written) in keys.items():
+                    stale = key if media_id in applied else written
+                    if stale is None:
+                        continue
+                    try:
+                        storage.delete(stale)
+                    except Exception as e:
+                        logger.warning(f"Could not delete {stale}: {e}")
+                result = "cold" if self.policy == "cold" else "pruned"
+                counts[result] += len(applied)
+                counts["skipped"] += len(updates) - len(applied)
+                lifecycle_objects.inc(len(applied), result=result)
+            for result in ("skipped", "failed"):
+                if counts[result]:
+                    lifecycle_objects.inc(counts[result], result=result)
+        finally:
+            db.close()
+            self._running.release()
+
+        self.last_run = {
+            "policy": self.policy,
+            "counts": counts,
+            "seconds": round(time.perf_counter() - started, 3),
+            "finished_at": datetime.now(),
+        }
+        logger.info(f"Blank retention pass ({self.policy}): {counts}")
+        return self.last_run
+
+    def trigger(self) -> bool:
+        """Start a pass in the background; False if one is already running."""
+        if self._running.locked():
+            return False
+        threading.Thread(target=self._run_safely, name="blank-retention", daemon=True).start()
+        return True
+
+    def _run_safely(self):
+        try:
+            self.run_once()
+        except RuntimeError as e:
+            logger.info(f"Blank retention skipped: {e}")
+        except Exception as e:
+            logger.error(f"Blank retention pass failed: {e}", exc_info=True)
+
+    def start_periodic(self, interval: float = BLANK_RETENTION_INTERVAL):
+        """Run a pass every `interval` seconds (no-op for "keep" or interval 0)."""
+        if self.policy == "keep" or interval <= 0 or self._periodic is not None:
+            return
+
+        def loop():
+            stop = threading.Event()
+            while not stop.wait(interval):
+                self._run_safely()
+
+        self._periodic = threading.Thread(target=loop, name="blank-retention-timer", daemon=True)
+        self._periodic.start()
+
+    def stats(self) -> Dict:
+        return {
+            "policy": self.policy,
+            "min_age_days": self.min_age_days,
+            "min_confidence": self.min_confidence,
+            "running": self._running.locked(),
+            "last_run": self.last_run,
+        }
+
+
+lifecycle_manager = LifecycleManager()
@@ -2,11 +2,18 @@ import torch
 import torchvision.transforms as transforms
 from PIL import Image
 import io
+import hashlib
 import logging
 from pathlib import Path
 import numpy as np
-from typing import Tuple, Dict, List, Optional
+from typing import Tuple, Dict, Optional, Union
 import os
+import threading
+import time
+
+from ..utils.tracing import stage
+from ..utils.detections import Detections
+from .embeddings import EMBEDDINGS_ENABLED, project
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -17,19 +24,90 @@ ML_DIR = Path(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(__
 CLASSIFIER_PATH = ML_DIR / 'classifier' / 'best_classification_model.pt'
 DETECTOR_PATH = ML_DIR / 'detection' / 'yolov8n_detection_model.pt'
 
+# "yolo" (default) loads the trained weights; "stub" is a cheap deterministic
+# stand-in for load tests and offline development (see StubMLService)
+ML_MODELS = os.getenv("ML_MODELS", "yolo").lower()
+# Force a device (e.g. "cpu") instead of using CUDA whenever it is available
+ML_DEVICE = os.getenv("ML_DEVICE")
+ML_STUB_LATENCY_MS = float(os.getenv("ML_STUB_LATENCY_MS", "0"))
+
 # Validate paths exist
-if not CLASSIFIER_PATH.exists():
-    raise FileNotFoundError(f"Classifier model not found at {CLASSIFIER_PATH}")
-if not DETECTOR_PATH.exists():
-    raise FileNotFoundError(f"Detector model not found at {DETECTOR_PATH}")
+if ML_MODELS != "stub":
+    if not CLASSIFIER_PATH.exists():
+        raise FileNotFoundError(f"Classifier model not found at {CLASSIFIER_PATH}")
+    if not DETECTOR_PATH.exists():
+        raise FileNotFoundError(f"Detector model not found at {DETECTOR_PATH}")
 
 logger.info(f"Using ML models from directory: {ML_DIR}")
 
-class MLService:
+# Inference cascade thresholds (see MLService.process_media)
+CASCADE_ENABLED = os.getenv("CASCADE_ENABLED", "1") == "1"
+CASCADE_BLANK_EXIT_CONF = float(os.getenv("CASCADE_BLANK_EXIT_CONF", "0.90"))      # confident blanks stop here
+CASCADE_NONBLANK_CONF = float(os.getenv("CASCADE_NONBLANK_CONF", "0.80"))          # confident non-blanks go straight to full res
+CASCADE_LOW_IMGSZ = int(os.getenv("CASCADE_LOW_IMGSZ", "320"))                     # detector size for ambiguous frames
+CASCADE_LOW_ACCEPT_CONF = float(os.getenv("CASCADE_LOW_ACCEPT_CONF", "0.50"))      # low-res hit strong enough to accept
+DETECTION_CONF = float(os.getenv("DETECTION_CONF", "0.25"))
+
+# Overrides the weights digest as the version stamped on predictions (e.g. a release tag)
+MODEL_VERSION = os.getenv("MODEL_VERSION")
+
+
+def file_digest(path: Path, chunk_size: int = 1024 * 1024) -> str:
+    """sha256 of a weights file."""
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def weights_digest(classifier_path: Path, detector_path: Path) -> str:
+    """Short digests of both weight files, e.g. "cls-0123456789ab.det-ba9876543210"."""
+    return f"cls-{file_digest(classifier_path)[:12]}.det-{file_digest(detector_path)[:12]}"
+
+
+def model_version_for(classifier_path: Path, detector_path: Path) -> str:
+    """Version string stamped on every prediction: MODEL_VERSION, else the weights digest."""
+    if MODEL_VERSION:
+        return MODEL_VERSION
+    return weights_digest(classifier_path, detector_path)
+
+
+class CascadeStats:
+    """Thread-safe counters of which cascade stage each image exited at"""
+
+    STAGES = ("prefilter", "classifier", "detector_low", "detector_full")
+
     def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {stage: 0 for stage in self.STAGES}
+
+    def record(self, stage: str):
+        with self._lock:
+            self._counts[stage] = self._counts.get(stage, 0) + 1
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            counts = dict(self._counts)
+        total = sum(counts.values())
+        return {
+            "total": total,
+            "exits": counts,
+            "exit_rates": {stage: (count / total if total else 0.0) for stage, count in counts.items()},
+        }
+
+class MLService:
+    def __init__(self, classifier_path: Path = CLASSIFIER_PATH, detector_path: Path = DETECTOR_PATH):
+        self.classifier_path = Path(classifier_path)
+        self.detector_path = Path(detector_path)
         self.classifier = None
         self.detector = None
-        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        self.model_version = None
+        self.weights_digest = None
+        self.cascade_stats = CascadeStats()
+        # Backbone features of the last classify_image call on this thread (see _register_embedding_hook)
+        self._embedding_local = threading.local()
+        self.device = torch.device(ML_DEVICE or ("cuda" if torch.cuda.is_available() else "cpu"))
         logger.info(f"Using device: {self.device}")
         
         self.transform = transforms.Compose([
@@ -45,16 +123,16 @@ class MLService:
         """Load both classification and detection models."""
         # 1. Load Classifier
         try:
-            logger.info(f"Loading classifier from {CLASSIFIER_PATH}")
-            if not os.path.exists(CLASSIFIER_PATH):
+            logger.info(f"Loading classifier from {self.classifier_path}")
+            if not os.path.exists(self.classifier_path):
                 raise FileNotFoundError(
-                    f"Classifier model not found at {CLASSIFIER_PATH}. "
+                    f"Classifier model not found at {self.classifier_path}. "
                     f"Please ensure the model file is in the correct location: {ML_DIR}/classifier/"
                 )
             
             try:
                 from ultralytics import YOLO
-                self.classifier = YOLO(str(CLASSIFIER_PATH))
+                self.classifier = YOLO(str(self.classifier_path))
                 self.classifier.to(self.device)
                 
             except ImportError:
@@ -64,6 +142,8 @@ class MLService:
                                 f"Make sure it's a valid UltraLytics classification model.")
             
             logger.info("Successfully loaded classifier model")
+            if EMBEDDINGS_ENABLED:
+                self._register_embedding_hook()
             
         except Exception as e:
             logger.error(f"Error loading classifier: {str(e)}")
@@ -71,16 +151,16 @@ class MLService:
 
         # 2. Load Detector
         try:
-            logger.info(f"Loading YOLOv8 detector from {DETECTOR_PATH}")
-            if not os.path.exists(DETECTOR_PATH):
+            logger.info(f"Loading YOLOv8 detector from {self.detector_path}")
+            if not os.path.exists(self.detector_path):
                 raise FileNotFoundError(
-                    f"YOLOv8 model not found at {DETECTOR_PATH}. "
+                    f"YOLOv8 model not found at {self.detector_path}. "
                     f"Please ensure the model file is in the correct location: {ML_DIR}/detection/"
                 )
             
             try:
                 from ultralytics import YOLO
-                self.detector = YOLO(str(DETECTOR_PATH))
+                self.detector = YOLO(str(self.detector_path))
                 self.detector.to(self.device)
             except ImportError:
                 raise ImportError("Failed to import YOLO. Please install ultralytics: pip install ultralytics")
@@ -89,27 +169,58 @@ class MLService:
                                 f"Make sure it's a valid YOLOv8 model file.")
             
             logger.info("Successfully loaded YOLOv8 detector model")
+            self.weights_digest = weights_digest(self.classifier_path, self.detector_path)
+            self.model_version = MODEL_VERSION or self.weights_digest
+            logger.info(f"Model version: {self.model_version}")
             
         except Exception as e:
             logger.error(f"Error loading detector: {str(e)}")
             raise
 
+    def _register_embedding_hook(self):
+        """Capture the classifier head's pooled backbone features on every forward pass."""
+        try:
+            pool = self.classifier.model.model[-1].pool
+        except (AttributeError, IndexError, TypeError):
+            logger.warning("Classifier has no pooling layer to hook; similar-image search disabled")
+            return
+
+        def keep_features(module, inputs, output):
+            # Single-image predict: keep the first row only
+            self._embedding_local.features = output.detach().flatten(1)[0].float().cpu().numpy()
+
+        pool.register_forward_hook(keep_features)
+
+    def take_embedding(self) -> Optional[np.ndarray]:
+        """Projected embedding from this thread's last classification, or None; clears it."""
+        features = getattr(self._embedding_local, "features", None)
+        self._embedding_local.features = None
+        return project(features) if features is not None else None
+
     def preprocess_image(self, image_bytes: bytes) -> torch.Tensor:
         """Convert image bytes to tensor."""
         image = Image.open(io.BytesIO(image_bytes)).convert('RGB')
         return self.transform(image).unsqueeze(0).to(self.device)
 
-    def classify_image(self, image_bytes: bytes) -> Tuple[str, float]:
-        """Classify image as blank/non-blank."""
+    @staticmethod
+    def decode_image(image: Union[bytes, Image.Image]) -> Image.Image:
+        """Decode image bytes to an RGB PIL Image (already decoded images pass through)."""
+        if isinstance(image, Image.Image):
+            return image if image.mode == 'RGB' else image.convert('RGB')
+        return Image.open(io.BytesIO(image)).convert('RGB')
+
+    def classify_image(self, image: Union[bytes, Image.Image]) -> Tuple[str, float]:
+        """Classify image (bytes or decoded PIL Image) as blank/non-blank."""
         if self.classifier is None:
             raise RuntimeError("Classifier model not loaded")
 
         try:
-            # Convert bytes to PIL Image
-            image = Image.open(io.BytesIO(image_bytes)).convert('RGB')
+            image = self.decode_image(image)
             
             # Run UltraLytics prediction
-            results = self.classifier.predict(image, verbose=False)
+            self._embedding_local.features = None
+            with stage("classify"):
+                results = self.classifier.predict(image, verbose=False)
             
             # Get prediction (assuming model was trained with classes=['blank', 'non-blank'])
             pred_idx = results[0].probs.top1
@@ -125,30 +236,24 @@ class MLService:
             logger.error(f"Error during classification: {str(e)}")
             raise
 
-    def detect_objects(self, image_bytes: bytes) -> List[Dict]:
-        """Detect objects in image using YOLOv8."""
+    def detect_objects(self, image: Union[bytes, Image.Image], imgsz: Optional[int] = None) -> Detections:
+        """
+        Detect objects in image using YOLOv8 (at the model's default size unless imgsz is given).
+        Returns compact arrays (boxes/conf/cls); use .to_dicts() for the per-box dict view.
+        """
         if self.detector is None:
             raise RuntimeError("Detector model not loaded")
 
         try:
-            # Convert bytes to PIL Image
-            image = Image.open(io.BytesIO(image_bytes)).convert('RGB')
+            image = self.decode_image(image)
             
             # Run inference
-            results = self.detector(image, verbose=False, conf=0.25)
-            
-            # Parse results
-            detections = []
-            for r in results:
-                boxes = r.boxes
-                for box in boxes:
-                    detection = {
-                        'bbox': box.xyxy[0].tolist(),  # [x1, y1, x2, y2]
-                        'confidence': float(box.conf.item()),
-                        'class_id': int(box.cls.item()),
-                        'class_name': r.names[int(box.cls.item())]
-                    }
-                    detections.append(detection)
+            kwargs = {"imgsz": imgsz} if imgsz else {}
+            with stage("detect_low" if imgsz else "detect", imgsz=imgsz):
+                results = self.detector(image, verbose=False, conf=DETECTION_CONF, **kwargs)
+            
+            # One vectorized tensor -> NumPy conversion for all boxes
+            detections = Detections.from_results(results)
             
             logger.info(f"Detected {len(detections)} objects")
             return detections
@@ -157,45 +262,152 @@ class MLService:
             logger.error(f"Error during object detection: {str(e)}")
             raise
 
-    def process_media(self, image_bytes: bytes) -> Dict:
+    def process_media(self, image: Union[bytes, Image.Image]) -> Dict:
         """
         Process media through the full pipeline: classification -> detection if non-blank.
+        Accepts raw bytes or an already decoded PIL Image (decoded once and reused by every stage).
         Returns data in format compatible with database update.
+
+        With CASCADE_ENABLED the pipeline is confidence gated:
+          1. confident blanks exit after the classifier
+          2. confident non-blanks run the detector at full resolution
+          3. ambiguous frames run the detector at CASCADE_LOW_IMGSZ first and
+             escalate to full resolution only when the cheap pass is inconclusive
+        The exit stage is returned under 'stage' and counted in cascade_stats.
         """
         try:
+            image = self.decode_image(image)
+
             # Step 1: Classification
-            classification, confidence = self.classify_image(image_bytes)
+            classification, confidence = self.classify_image(image)
             
             result = {
                 'classification': classification,
                 'confidence': confidence,
                 'species': None,
-                'predictions': None
+                'predictions': None,
+                'stage': "classifier",
+                'embedding': self.take_embedding()
             }
-            
-            # Step 2: If non-blank, run detection
-            if classification == "non-blank":
+
+            if not CASCADE_ENABLED:
+                # Legacy behaviour: trust the top-1 label outright
+                if classification == "non-blank":
+                    self._apply_detections(result, self.detect_objects(image), "detector_full")
+                else:
+                    logger.info("Image classified as blank, skipping detection")
+                self.cascade_stats.record(result['stage'])
+                return result
+
+            # Step 2: Confident blank -> exit immediately
+            if classification == "blank" and confidence >= CASCADE_BLANK_EXIT_CONF:
+                logger.info("Confident blank, skipping detection")
+                self.cascade_stats.record("classifier")
+                return result
+
+            # Step 3: Confident non-blank -> full resolution detection
+            if classification == "non-blank" and confidence >= CASCADE_NONBLANK_CONF:
                 logger.info("Running object detection on non-blank image...")
-                detections = self.detect_objects(image_bytes)
-                result['predictions'] = detections
-                
-                # Extract unique species names
-                if detections:
-                    unique_species = list(set(d['class_name'] for d in detections))
-                    result['species'] = ','.join(unique_species)  # Store as comma-separated string
-                    logger.info(f"Found species: {unique_species}")
+                self._apply_detections(result, self.detect_objects(image), "detector_full")
+                self.cascade_stats.record(result['stage'])
+                return result
+
+            # Step 4: Ambiguous -> cheap low resolution pass
+            logger.info(f"Ambiguous classification ({classification}, {confidence:.4f}), running low-res detection")
+            detections = self.detect_objects(image, imgsz=CASCADE_LOW_IMGSZ)
+            best = detections.max_confidence()
+
+            if best >= CASCADE_LOW_ACCEPT_CONF:
+                self._apply_detections(result, detections, "detector_low")
+            elif not detections and classification == "blank":
+                result['stage'] = "detector_low"
             else:
-                logger.info("Image classified as blank, skipping detection")
-            
+                # Weak hits, or the classifier leaned non-blank: escalate
+                logger.info("Low-res pass inconclusive, escalating to full resolution")
+                self._apply_detections(result, self.detect_objects(image), "detector_full")
+
+            self.cascade_stats.record(result['stage'])
             return result
             
         except Exception as e:
             logger.error(f"Error in ML pipeline: {str(e)}")
             raise
 
+    @staticmethod
+    def _apply_detections(result: Dict, detections: Detections, stage: str):
+        """Fill predictions/species on a pipeline result from detector output."""
+        result['stage'] = stage
+        result['predictions'] = detections
+        if len(detections):
+            # Any confident detection overrides a blank/ambiguous classifier label
+            if result['classification'] != "non-blank":
+                # The classifier's number was its confidence in "blank"; the stored confidence
+                # for the overriding label is the best detection's confidence instead
+                result['confidence'] = detections.max_confidence()
+            result['classification'] = "non-blank"
+            unique_species = detections.species()
+            result['species'] = ','.join(unique_species)  # Store as comma-separated string
+            logger.info(f"Found species: {unique_species}")
+
+class StubMLService(MLService):
+    """
+    Model-free stand-in with the MLService interface (ML_MODELS=stub).
+
+    A frame is "non-blank" when enough of a 64x36 thumbnail is dark (the
+    synthetic benchmark frames draw animals as dark blobs), and the dark
+    region's bounding box becomes one detection. ML_STUB_LATENCY_MS adds a
+    fixed per-image delay to emulate inference cost.
+    """
+
+    DARK_LEVEL = 70
+    DARK_FRACTION = 0.01
+    SPECIES = ("zebra", "wildebeest", "gazelle", "elephant", "lion")
+
+    def __init__(self, classifier_path: Path = CLASSIFIER_PATH, detector_path: Path = DETECTOR_PATH):
+        self.classifier_path = Path(classifier_path)
+        self.detector_path = Path(detector_path)
+        self.classifier = None
+        self.detector = None
+        self.weights_digest = "stub"
+        self.model_version = MODEL_VERSION or "stub"
+        self.cascade_stats = CascadeStats()
+        self._embedding_local = threading.local()
+        self.device = torch.device("cpu")
+        logger.info("Using stub ML models")
+
+    def _dark_box(self, image: Image.Image) -> Optional[Tuple[float, float, float, float]]:
+        small = np.asarray(image.convert("L").resize((64, 36)))
+        mask = small < self.DARK_LEVEL
+        if mask.mean() < self.DARK_FRACTION:
+            return None
+        ys, xs = np.nonzero(mask)
+        sx, sy = image.width / 64, image.height / 36
+        return xs.min() * sx, ys.min() * sy, (xs.max() + 1) * sx, (ys.max() + 1) * sy
+
+    def classify_image(self, image: Union[bytes, Image.Image]) -> Tuple[str, float]:
+        image = self.decode_image(image)
+        with stage("classify"):
+            if ML_STUB_LATENCY_MS:
+                time.sleep(ML_STUB_LATENCY_MS / 1000)
+            box = self._dark_box(image)
+        return ("non-blank", 0.95) if box else ("blank", 0.97)
+
+    def detect_objects(self, image: Union[bytes, Image.Image], imgsz: Optional[int] = None) -> Detections:
+        image = self.decode_image(image)
+        with stage("detect"):
+            box = self._dark_box(image)
+        if box is None:
+            return Detections.empty()
+        class_id = int(sum(box)) % len(self.SPECIES)
+        return Detections([box], [0.9], [class_id], {class_id: self.SPECIES[class_id]})
+
+    def take_embedding(self) -> Optional[np.ndarray]:
+        return None
+
+
 # Create global instance
 try:
-    ml_service = MLService()
+    ml_service = StubMLService() if ML_MODELS == "stub" else MLService()
     logger.info("MLService initialized successfully")
 except Exception as e:
     logger.error(f"Failed to initialize MLService: {e}")
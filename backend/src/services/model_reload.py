@@ -0,0 +1,292 @@
+"""
+Hot model reload.
+
+New weights are loaded into a second MLService next to the one serving
+traffic (torch and ultralytics are already imported, so only the weights are
+read), warmed up on synthetic frames, and then swapped in with a single
+reference assignment on the MediaProcessor. The inference scheduler keeps
+running throughout: every job pins the service it started with, so in-flight
+images finish and are stamped with the old model_version, and the next job
+picks up the new one. The old models are freed when their last job ends.
+
+Reloads are started by an admin (POST /ml/models/reload) or by a file watch
+on the weight files (MODEL_WATCH_INTERVAL). Each reload reports load and
+warm-up time and the throughput before, during and after the swap, so the
+cost of a deploy is visible. With MODEL_RELOAD_REPROCESS=1 a reprocess job
+for the new version starts automatically; running jobs for the old version
+cancel themselves at their next batch. Similar-image search moves to the new
+weights' own embedding index, which fills as images are (re)processed.
+
+Both model sets are resident during the reload, so the host needs memory for two.
+"""
+
+import logging
+import os
+import threading
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Optional
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from . import ml as ml_module
+from .worker import media_processor
+from ..utils.metrics import registry, Counter, images_processed, throughput_window
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+MODEL_WATCH_INTERVAL = float(os.getenv("MODEL_WATCH_INTERVAL", "0"))  # seconds; 0 disables the file watch
+MODEL_WARMUP_RUNS = int(os.getenv("MODEL_WARMUP_RUNS", "2"))
+MODEL_RELOAD_REPORT_WINDOW = float(os.getenv("MODEL_RELOAD_REPORT_WINDOW", "60"))  # seconds measured after the swap
+MODEL_RELOAD_REPROCESS = os.getenv("MODEL_RELOAD_REPROCESS", "0") == "1"
+
+model_reloads = registry.register(Counter(
+    "trapsense_model_reloads_total", "Hot model reload attempts", ["result"]))
+
+
+def _warmup_frames():
+    """A blank-looking and an 'animal' frame, so both the classifier and the detector paths run."""
+    rng = np.random.default_rng(0)
+    frames = []
+    for animal in (False, True):
+        pixels = np.clip(rng.normal(110, 12, size=(480, 640, 3)), 0, 255).astype(np.uint8)
+        image = Image.fromarray(pixels, "RGB")
+        if animal:
+            ImageDraw.Draw(image).ellipse([200, 220, 420, 360], fill=(45, 35, 30))
+        frames.append(image)
+    return frames
+
+
+def _weights_signature(paths) -> tuple:
+    signature = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            signature.append((stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            signature.append(None)
+    return tuple(signature)
+
+
+class ModelReloader:
+    """Loads, warms and swaps MLService instances; one reload at a time"""
+
+    def __init__(self, processor=media_processor):
+        self.processor = processor
+        self._lock = threading.Lock()
+        self._watch = None
+        self.last_reload: Optional[Dict] = None
+
+    def _resolve(self, path: Optional[str], current: Path) -> Path:
+        """Weights must live under ML_DIR (loading them unpickles arbitrary objects)."""
+        if not path:
+            return current
+        resolved = Path(path)
+        if not resolved.is_absolute():
+            resolved = ml_module.ML_DIR / resolved
+        resolved = resolved.resolve()
+        if ml_module.ML_DIR.resolve() not in resolved.parents:
+            raise ValueError(f"Model weights must be under {ml_module.ML_DIR}")
+        if not resolved.is_file():
+            raise ValueError(f"Model weights not found: {resolved}")
+        return resolved
+
+    def reload(self, classifier_path: Optional[str] = None, detector_path: Optional[str] = None,
+               version: Optional[str] = None, force: bool = False, reason: str = "admin") -> Dict:
+        """
+        Load new weights beside the serving models, warm them up and swap them in.
+
+        Args:
+            classifier_path, detector_path: new weight files under ML_DIR (default: the current paths,
+                i.e. pick up weights replaced in place)
+            version: model_version to stamp (default: the weights digest)
+            force: swap even if the weights are unchanged
+            reason: recorded in the report ("admin", "file-watch")
+
+        Returns:
+            the reload report
+
+        Raises:
+            RuntimeError: no ML service, or a reload is already in progress
+            ValueError: invalid weight paths
+        """
+        if self.processor is None:
+            raise RuntimeError("ML service not available")
+        if not self._lock.acquire(blocking=False):
+            raise RuntimeError("A model reload is already in progress")
+        try:
+            old = self.processor.ml_service
+            report = {
+                "id": str(uuid.uuid4()),
+                "reason": reason,
+                "status": "loading",
+                "old_version": old.model_version,
+                "new_version": None,
+                "started_at": datetime.now(),
+                "error": None,
+            }
+            self.last_reload = report
+            try:
+                return self._reload(old, report, self._resolve(classifier_path, old.classifier_path),
+                                    self._resolve(detector_path, old.detector_path), version, force)
+            except Exception as e:
+                report["status"] = "failed"
+                report["error"] = str(e)
+                model_reloads.inc(result="failed")
+                logger.error(f"Model reload failed, still serving {old.model_version}: {e}", exc_info=True)
+                raise
+        finally:
+            self._lock.release()
+
+    def _reload(self, old, report: Dict, classifier_path: Path, detector_path: Path,
+                version: Optional[str], force: bool) -> Dict:
+        started = time.perf_counter()
+        processed_before = images_processed.total()
+        rate_before = throughput_window.rate()
+
+        service_class = ml_module.StubMLService if ml_module.ML_MODELS == "stub" else ml_module.MLService
+        new = service_class(classifier_path, detector_path)
+        report["load_seconds"] = round(time.perf_counter() - started, 3)
+
+        unchanged = new.weights_digest == old.weights_digest
+        if unchanged and not force and version in (None, old.model_version):
+            report["status"] = "unchanged"
+            report["new_version"] = old.model_version
+            model_reloads.inc(result="unchanged")
+            logger.info(f"Model reload: weights unchanged ({old.weights_digest}), keeping current models")
+            return report
+        new.model_version = version or (old.model_version if unchanged else new.weights_digest)
+        report["new_version"] = new.model_version
+
+        warm_started = time.perf_counter()
+        for _ in range(MODEL_WARMUP_RUNS):
+            for frame in _warmup_frames():
+                new.classify_image(frame)
+                new.detect_objects(frame)
+        new.take_embedding()
+        report["warmup_seconds"] = round(time.perf_counter() - warm_started, 3)
+
+        # Counters carry over; the swap itself is one reference assignment between jobs
+        new.cascade_stats = old.cascade_stats
+        self.processor.ml_service = new
+        ml_module.ml_service = new
+        swapped = time.perf_counter()
+        processed_at_swap = images_processed.total()
+
+        during = (processed_at_swap - processed_before) / (swapped - started) if swapped > started else 0.0
+        report.update({
+            "status": "swapped",
+            "swapped_at": datetime.now(),
+            "total_seconds": round(swapped - started, 3),
+            "throughput": {
+                "before_per_s": round(rate_before, 3),
+                "during_reload_per_s": round(during, 3),
+                "after_per_s": None,
+                "dip_ratio": round(1 - during / rate_before, 3) if rate_before > 0 else None,
+            },
+        })
+        model_reloads.inc(result="swapped")
+        logger.info(f"Swapped models {old.model_version} -> {new.model_version} "
+                    f"(load {report['load_seconds']}s, warm-up {report['warmup_seconds']}s)")
+
+        timer = threading.Timer(MODEL_RELOAD_REPORT_WINDOW, self._measure_after,
+                                args=(report, processed_at_swap, swapped))
+        timer.daemon = True
+        timer.start()
+        if MODEL_RELOAD_REPROCESS:
+            self._start_reprocess(new.model_version)
+        return report
+
+    def _measure_after(self, report: Dict, processed_at_swap: float, swapped: float):
+        elapsed = time.perf_counter() - swapped
+        report["throughput"]["after_per_s"] = round((images_processed.total() - processed_at_swap) / elapsed, 3)
+        logger.info(f"Model reload {report['id']} throughput: {report['throughput']}")
+        # Jobs pinned to the old models have finished by now
+        if ml_module.torch.cuda.is_available():
+            ml_module.torch.cuda.empty_cache()
+
+    def _start_reprocess(self, version: str):
+        from .reprocess import reprocess_manager
+        from ..database.models import SessionLocal
+        db = SessionLocal()
+        try:
+            job = reprocess_manager.create_job(db, version)
+            logger.info(f"Started reprocess job {job.id} for {version}")
+        except Exception as e:
+            logger.error(f"Could not start reprocess job for {version}: {e}", exc_info=True)
+        finally:
+            db.close()
+
+    def trigger(self, **kwargs) -> bool:
+        """
+        Reload in a background thread; False if a reload is already running.
+
+        Raises:
+            ValueError: invalid weight paths (checked before the thread starts)
+        """
+        if self._lock.locked():
+            return False
+        if self.processor is not None:
+            for name in ("classifier_path", "detector_path"):
+                self._resolve(kwargs.get(name), None)
+
+        def run():
+            try:
+                self.reload(**kwargs)
+            except Exception:
+                pass  # logged and recorded in last_reload
+
+        threading.Thread(target=run, name="model-reload", daemon=True).start()
+        return True
+
+    def start_watch(self, interval: float = MODEL_WATCH_INTERVAL):
+        """Reload when the current weight files change and have been stable for one interval."""
+        if interval <= 0 or self.processor is None or self._watch is not None:
+            return
+
+        def paths():
+            service = self.processor.ml_service
+            return service.classifier_path, service.detector_path
+
+        def loop():
+            seen = _weights_signature(paths())
+            pending = None
+            stop = threading.Event()
+            while not stop.wait(interval):
+                current = _weights_signature(paths())
+                if current == seen:
+                    pending = None
+                    continue
+                if None in current or current != pending:
+                    pending = current  # still being written; check again next tick
+                    continue
+                logger.info("Model weights changed on disk, reloading")
+                try:
+                    self.reload(reason="file-watch")
+                except Exception:
+                    pass
+                seen, pending = _weights_signature(paths()), None
+
+        self._watch = threading.Thread(target=loop, name="model-watch", daemon=True)
+        self._watch.start()
+
+    def status(self) -> Dict:
+        service = self.processor.ml_service if self.processor is not None else None
+        return {
+            "model_version": service.model_version if service else None,
+            "weights_digest": service.weights_digest if service else None,
+            "classifier_path": str(service.classifier_path) if service else None,
+            "detector_path": str(service.detector_path) if service else None,
+            "device": str(service.device) if service else None,
+            "reloading": self._lock.locked(),
+            "watch_interval_s": MODEL_WATCH_INTERVAL,
+            "last_reload": self.last_reload,
+        }
+
+
+model_reloader = ModelReloader()
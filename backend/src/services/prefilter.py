@@ -0,0 +1,122 @@
+"""
+prefilter.py
+
+Cheap background-model pre-filter that runs before the classifier.
+
+Camera traps are static, so consecutive frames from the same camera share
+almost all of their pixels. For every camera (identified by ``folder_path``)
+we keep a running low-resolution grayscale background estimate and score each
+new frame by how far it deviates from it. Frames whose score stays under the
+threshold are "blank candidates" and can skip the CNN entirely.
+"""
+
+import io
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+# "off" disables the filter, "audit" scores frames but still runs the CNN,
+# "skip" trusts blank candidates and skips the classifier for them.
+PREFILTER_MODE = os.getenv("PREFILTER_MODE", "off").lower()
+PREFILTER_THRESHOLD = float(os.getenv("PREFILTER_THRESHOLD", "0.02"))
+PREFILTER_ALPHA = float(os.getenv("PREFILTER_ALPHA", "0.1"))
+PREFILTER_WARMUP = int(os.getenv("PREFILTER_WARMUP", "5"))
+PREFILTER_SIZE = (64, 48)
+PREFILTER_MAX_CAMERAS = int(os.getenv("PREFILTER_MAX_CAMERAS", "1024"))
+
+# Per-pixel absolute difference (0-1 scale) that counts as "changed"
+PIXEL_DELTA = 0.08
+
+
+class _CameraBackground:
+    """Running background estimate for a single camera"""
+
+    __slots__ = ("mean", "frames")
+
+    def __init__(self, frame: np.ndarray):
+        self.mean = frame.copy()
+        self.frames = 1
+
+
+class BackgroundPrefilter:
+    """Per-camera running background model used to flag blank candidates"""
+
+    def __init__(
+        self,
+        threshold: float = PREFILTER_THRESHOLD,
+        alpha: float = PREFILTER_ALPHA,
+        warmup: int = PREFILTER_WARMUP,
+        max_cameras: int = PREFILTER_MAX_CAMERAS,
+    ):
+        self.threshold = threshold
+        self.alpha = alpha
+        self.warmup = warmup
+        self.max_cameras = max_cameras
+        self._backgrounds: "OrderedDict[str, _CameraBackground]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _low_res(image_bytes: bytes) -> np.ndarray:
+        """Decode image bytes to a small normalised grayscale array."""
+        image = Image.open(io.BytesIO(image_bytes))
+        # JPEG can decode straight to a reduced scale, which is far cheaper
+        # than a full decode followed by a resize.
+        image.draft("L", PREFILTER_SIZE)
+        image = image.convert("L").resize(PREFILTER_SIZE, Image.BILINEAR)
+        frame = np.asarray(image, dtype=np.float32) / 255.0
+        # Normalise global brightness so exposure changes do not look like motion
+        return frame - frame.mean()
+
+    def score(self, camera_key: Optional[str], image_bytes: bytes) -> Tuple[bool, float]:
+        """
+        Score a frame against its camera's background and update the model.
+
+        Args:
+            camera_key: Camera identifier (the media folder_path)
+            image_bytes: Raw image bytes
+
+        Returns:
+            (is_blank_candidate, score) where score is the fraction of pixels
+            that changed noticeably. Frames seen during warm-up are never
+            blank candidates.
+        """
+        frame = self._low_res(image_bytes)
+        key = camera_key or ""
+
+        with self._lock:
+            background = self._backgrounds.get(key)
+            if background is None or background.mean.shape != frame.shape:
+                self._backgrounds[key] = _CameraBackground(frame)
+                self._evict()
+                return False, 1.0
+
+            self._backgrounds.move_to_end(key)
+            diff = np.abs(frame - background.mean)
+            score = float(np.count_nonzero(diff > PIXEL_DELTA)) / diff.size
+
+            # Blend the frame into the background. Animals are transient, so
+            # a slow learning rate keeps them from being absorbed.
+            background.mean += self.alpha * (frame - background.mean)
+            background.frames += 1
+            warmed_up = background.frames > self.warmup
+
+        return warmed_up and score < self.threshold, score
+
+    def _evict(self):
+        while len(self._backgrounds) > self.max_cameras:
+            self._backgrounds.popitem(last=False)
+
+
+# Global prefilter instance (None when disabled)
+prefilter = BackgroundPrefilter() if PREFILTER_MODE in ("audit", "skip") else None
+if prefilter is not None:
+    logger.info(f"Background prefilter enabled (mode={PREFILTER_MODE}, threshold={PREFILTER_THRESHOLD})")
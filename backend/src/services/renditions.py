@@ -0,0 +1,69 @@
+"""
+renditions.py
+
+WebP thumbnail and preview renditions generated from the image the worker
+has already decoded for inference, so browsing never has to pull originals.
+"""
+
+import io
+import logging
+import os
+from typing import Dict
+
+from PIL import Image
+
+from .storage import storage
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+RENDITIONS_ENABLED = os.getenv("RENDITIONS_ENABLED", "1") == "1"
+
+# name -> (longest edge in pixels, WebP quality). Ordered largest first so each
+# rendition can be downscaled from the previous one instead of the original.
+RENDITIONS = {
+    "preview": (1024, 80),
+    "thumb": (256, 70),
+}
+
+
+def rendition_key(user_id: str, media_id: str, name: str) -> str:
+    """Derived object key for a rendition of a media item."""
+    return f"{user_id}/_renditions/{media_id}_{name}.webp"
+
+
+def make_renditions(image: Image.Image) -> Dict[str, bytes]:
+    """Encode every configured rendition of a decoded RGB image as WebP bytes."""
+    encoded = {}
+    current = image
+    for name, (max_edge, quality) in RENDITIONS.items():
+        current = current.copy()
+        current.thumbnail((max_edge, max_edge), Image.BILINEAR, reducing_gap=2.0)
+        buffer = io.BytesIO()
+        current.save(buffer, format="WEBP", quality=quality, method=4)
+        encoded[name] = buffer.getvalue()
+    return encoded
+
+
+def store_renditions(image: Image.Image, user_id: str, media_id: str) -> Dict[str, str]:
+    """
+    Generate and upload renditions for a media item.
+
+    Returns:
+        dict of rendition name -> URL. Empty if renditions are disabled or the
+        upload failed; renditions are best effort and never fail processing.
+    """
+    if not RENDITIONS_ENABLED:
+        return {}
+
+    urls = {}
+    try:
+        for name, data in make_renditions(image).items():
+            key = rendition_key(user_id, media_id, name)
+            urls[name] = storage.put_bytes(key, data, content_type="image/webp")
+        logger.info(f"Stored renditions for {media_id}: {sorted(urls)}")
+    except Exception as e:
+        logger.warning(f"Failed to store renditions for {media_id}: {e}")
+        return {}
+    return urls
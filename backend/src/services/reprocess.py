@@ -0,0 +1,189 @@
+"""
+Bulk reprocessing after a model upgrade.
+
+A ReprocessJob brings every processed media row (of one user, or of everyone)
+up to the currently loaded model version. The job walks stale rows in primary
+key order, REPROCESS_BATCH_SIZE at a time, and submits each batch to the
+scheduler in the lowest "reprocess" class, so uploads always go first. After
+each batch it waits for the results, then stores the last id as a checkpoint
+together with the counts. Pausing, a crash or a restart therefore loses at
+most one batch, and a running job resumes from its checkpoint on startup.
+
+Rows entered by hand (model_version "manual") are never touched, and rows
+that fail stay stale so that a later job picks them up again. A job whose
+target is no longer the loaded model (after a hot reload) cancels itself at
+its next batch.
+"""
+
+import logging
+import os
+import threading
+import uuid
+from typing import Dict, Optional
+
+from .scheduler import scheduler, InferenceScheduler
+from .worker import media_processor
+from ..database import models
+from ..database.db import count_stale_media, next_stale_media
+from ..utils.tracing import span
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+REPROCESS_BATCH_SIZE = int(os.getenv("REPROCESS_BATCH_SIZE", "200"))
+ACTIVE_STATUSES = ("pending", "running")
+
+
+def _reprocess_one(media_id: str, with_renditions: bool) -> Dict:
+    db = models.SessionLocal()
+    try:
+        with span("reprocess_media", media_id=media_id):
+            return media_processor.process_media(media_id, db, with_renditions=with_renditions, reprocess=True)
+    finally:
+        db.close()
+
+
+def job_status(job: models.ReprocessJob) -> Dict:
+    done = (job.processed or 0) + (job.failed or 0)
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "target_version": job.target_version,
+        "user_id": job.user_id,
+        "total": job.total,
+        "processed": job.processed,
+        "failed": job.failed,
+        "progress": round(done / job.total, 4) if job.total else 1.0,
+        "checkpoint_id": job.checkpoint_id,
+        "error": job.error,
+        "created_at": job.created_at,
+        "updated_at": job.updated_at,
+    }
+
+
+class ReprocessManager:
+    """Creates, runs and controls ReprocessJobs; one thread per running job"""
+
+    def __init__(self, sched: InferenceScheduler, batch_size: int = REPROCESS_BATCH_SIZE):
+        self.scheduler = sched
+        self.batch_size = batch_size
+        self._threads: Dict[str, threading.Thread] = {}
+        self._lock = threading.Lock()
+
+    def create_job(self, db, target_version: str, user_id: Optional[str] = None) -> models.ReprocessJob:
+        """Create and start a job for every row of user_id (or all users) not on target_version."""
+        job = models.ReprocessJob(
+            id=str(uuid.uuid4()),
+            target_version=target_version,
+            user_id=user_id,
+            status="running",
+            total=count_stale_media(db, target_version, user_id),
+            processed=0,
+            failed=0,
+        )
+        db.add(job)
+        db.commit()
+        db.refresh(job)
+        logger.info(f"Reprocess job {job.id}: {job.total} rows to bring up to {target_version}")
+        self._start(job.id)
+        return job
+
+    def set_status(self, db, job: models.ReprocessJob, action: str) -> models.ReprocessJob:
+        """Apply "pause", "resume" or "cancel" to a job."""
+        if job.status in ("completed", "cancelled"):
+            raise ValueError(f"Job is already {job.status}")
+        if action == "pause":
+            job.status = "paused"
+        elif action == "cancel":
+            job.status = "cancelled"
+        elif action == "resume":
+            job.status = "running"
+            job.error = None
+        else:
+            raise ValueError(f"Unknown action: {action}")
+        db.commit()
+        db.refresh(job)
+        if job.status == "running":
+            self._start(job.id)
+        return job
+
+    def resume_running(self):
+        """Restart threads for jobs that were running when the process stopped."""
+        db = models.SessionLocal()
+        try:
+            job_ids = [job_id for (job_id,) in
+                       db.query(models.ReprocessJob.id).filter(models.ReprocessJob.status.in_(ACTIVE_STATUSES))]
+        finally:
+            db.close()
+        for job_id in job_ids:
+            self._start(job_id)
+
+    def _start(self, job_id: str):
+        with self._lock:
+            thread = self._threads.get(job_id)
+            if thread is not None and thread.is_alive():
+                return
+            thread = threading.Thread(target=self._run, args=(job_id,), name=f"reprocess-{job_id[:8]}", daemon=True)
+            self._threads[job_id] = thread
+            thread.start()
+
+    def _run(self, job_id: str):
+        db = models.SessionLocal()
+        try:
+            while True:
+                job = db.get(models.ReprocessJob, job_id)
+                db.refresh(job)
+                if job.status not in ACTIVE_STATUSES:
+                    return
+                if media_processor is None:
+                    raise RuntimeError("ML service not available")
+                loaded = media_processor.ml_service.model_version
+                if loaded != job.target_version:
+                    # A hot reload replaced the models; stale rows wait for a job targeting the new
+                    # version (started automatically with MODEL_RELOAD_REPROCESS=1, else by hand)
+                    job.status = "cancelled"
+                    job.error = f"Superseded: loaded model is {loaded}, job targets {job.target_version}"
+                    db.commit()
+                    logger.info(f"Reprocess job {job_id}: {job.error}")
+                    return
+
+                page = next_stale_media(db, job.target_version, job.checkpoint_id, job.user_id, self.batch_size)
+                if not page:
+                    job.status = "completed"
+                    db.commit()
+                    logger.info(f"Reprocess job {job_id} completed: {job.processed} ok, {job.failed} failed")
+                    return
+
+                # Don't hold a DB transaction open while the batch runs
+                db.commit()
+                futures = [
+                    self.scheduler.submit(_reprocess_one, media_id, not has_thumbnail,
+                                          user_id=owner, priority="reprocess")
+                    for media_id, owner, has_thumbnail in page
+                ]
+                ok = 0
+                for future in futures:
+                    try:
+                        ok += bool(future.result().get("success"))
+                    except Exception as e:
+                        logger.error(f"Reprocess job {job_id}: task failed: {e}")
+
+                # Checkpoint only after the whole page finished
+                job.processed = (job.processed or 0) + ok
+                job.failed = (job.failed or 0) + len(page) - ok
+                job.checkpoint_id = page[-1][0]
+                db.commit()
+        except Exception as e:
+            logger.error(f"Reprocess job {job_id} failed: {e}", exc_info=True)
+            db.rollback()
+            job = db.get(models.ReprocessJob, job_id)
+            if job is not None:
+                job.status = "failed"
+                job.error = str(e)
+                db.commit()
+        finally:
+            db.close()
+
+
+reprocess_manager = ReprocessManager(scheduler)
@@ -1,5 +1,7 @@
 import boto3 as aws
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from botocore.client import Config
 from botocore.exceptions import ClientError
 import dotenv
@@ -15,6 +17,15 @@ BUCKET_NAME = os.getenv("AWS_S3_BUCKET")
 AWS_ACCESS_KEY_ID =  os.getenv("ACCESS_KEY") 
 AWS_SECRET_ACCESS_KEY = os.getenv("SECRET_ACCESS_KEY") 
 
+# Optional S3-compatible endpoint (MinIO, moto server) for local runs and benchmarks
+ENDPOINT_URL = os.getenv("AWS_S3_ENDPOINT_URL")
+
+# Part size for /media/multipart uploads; clients choose multipart for large files
+MULTIPART_PART_SIZE = int(os.getenv("S3_MULTIPART_PART_SIZE", str(16 * 1024 * 1024)))
+
+_s3_client = None
+_s3_client_lock = threading.Lock()
+
 
 def _create_s3_client():
     """Create and return an S3 client if credentials are available, otherwise return None."""
@@ -23,12 +34,34 @@ def _create_s3_client():
     return aws.client(
         "s3",
         region_name=REGION_NAME,
+        endpoint_url=ENDPOINT_URL,
         aws_access_key_id=AWS_ACCESS_KEY_ID,
         aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-        config=Config(signature_version="s3v4")
+        config=Config(signature_version="s3v4", max_pool_connections=50)
     )
 
 
+def get_s3_client():
+    """Return the shared S3 client, creating it on first use.
+
+    boto3 clients are thread-safe, and building one costs milliseconds, so every call
+    site reuses this instance instead of calling _create_s3_client() per request.
+    """
+    global _s3_client
+    if _s3_client is None:
+        with _s3_client_lock:
+            if _s3_client is None:
+                _s3_client = _create_s3_client()
+    return _s3_client
+
+
+def _require_client():
+    s3_client = get_s3_client()
+    if s3_client is None:
+        raise RuntimeError("S3 credentials or bucket not configured (AWS_ACCESS_KEY_ID/AWS_SECRET_ACCESS_KEY/AWS_S3_BUCKET)")
+    return s3_client
+
+
 def generate_presigned_put_url(object_name: str, expiration: int = 3600, content_type: str = None):
     """Generate a presigned URL to upload (PUT) an object to S3.
 
@@ -42,9 +75,7 @@ def generate_presigned_put_url(object_name: str, expiration: int = 3600, content
     if content_type:
         params['ContentType'] = content_type
 
-    s3_client = _create_s3_client()
-    if s3_client is None:
-        raise RuntimeError("S3 credentials or bucket not configured (AWS_ACCESS_KEY_ID/AWS_SECRET_ACCESS_KEY/AWS_S3_BUCKET)")
+    s3_client = _require_client()
     try:
         url = s3_client.generate_presigned_url('put_object', Params=params, ExpiresIn=expiration)
         return url
@@ -52,20 +83,97 @@ def generate_presigned_put_url(object_name: str, expiration: int = 3600, content
         raise
 
 
+def generate_presigned_put_urls(objects, expiration: int = 3600, max_workers: int = 1):
+    """Presign PUT URLs for many objects with one shared client.
+
+    objects is an iterable of (object_name, content_type) tuples; URLs are returned in the
+    same order. Signing is pure-Python CPU work, so the loop over the shared client is the
+    fast path; max_workers > 1 only pays off for very large batches on free-threaded builds.
+    """
+    s3_client = _require_client()
+
+    def _sign(item):
+        object_name, content_type = item
+        params = {'Bucket': BUCKET_NAME, 'Key': object_name}
+        if content_type:
+            params['ContentType'] = content_type
+        return s3_client.generate_presigned_url('put_object', Params=params, ExpiresIn=expiration)
+
+    objects = list(objects)
+    if max_workers <= 1 or len(objects) < 1000:
+        return [_sign(item) for item in objects]
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        return list(pool.map(_sign, objects))
+
+
+def create_multipart_upload(object_name: str, part_count: int, expiration: int = 3600, content_type: str = None):
+    """Start a multipart upload and presign a PUT URL for each part.
+
+    Returns (upload_id, [presigned part URL, ...]); part numbers are 1-based in list order.
+    """
+    s3_client = _require_client()
+    params = {'Bucket': BUCKET_NAME, 'Key': object_name}
+    if content_type:
+        params['ContentType'] = content_type
+    upload_id = s3_client.create_multipart_upload(**params)['UploadId']
+
+    part_urls = [
+        s3_client.generate_presigned_url(
+            'upload_part',
+            Params={'Bucket': BUCKET_NAME, 'Key': object_name, 'UploadId': upload_id, 'PartNumber': part_number},
+            ExpiresIn=expiration,
+        )
+        for part_number in range(1, part_count + 1)
+    ]
+    return upload_id, part_urls
+
+
+def complete_multipart_upload(object_name: str, upload_id: str, parts: list) -> str:
+    """Complete a multipart upload. parts is a list of {'PartNumber': int, 'ETag': str}."""
+    s3_client = _require_client()
+    s3_client.complete_multipart_upload(
+        Bucket=BUCKET_NAME,
+        Key=object_name,
+        UploadId=upload_id,
+        MultipartUpload={'Parts': sorted(parts, key=lambda p: p['PartNumber'])},
+    )
+    return get_object_url(object_name)
+
+
+def abort_multipart_upload(object_name: str, upload_id: str):
+    """Abort a multipart upload and discard any uploaded parts."""
+    _require_client().abort_multipart_upload(Bucket=BUCKET_NAME, Key=object_name, UploadId=upload_id)
+
+
+def generate_presigned_get_url(object_name: str, expiration: int = 3600) -> str:
+    """Generate a presigned URL to download (GET) a private object."""
+    return _require_client().generate_presigned_url(
+        'get_object', Params={'Bucket': BUCKET_NAME, 'Key': object_name}, ExpiresIn=expiration
+    )
+
+
+def list_object_keys(prefix: str = ""):
+    """Yield every object key under prefix (paginated ListObjectsV2)."""
+    paginator = _require_client().get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=BUCKET_NAME, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            yield obj['Key']
+
+
 def get_object_url(object_name: str) -> str:
     """Return the public URL for an object in the bucket.
 
     Note: whether this URL is accessible depends on bucket/object ACLs. If objects are private,
     you'll need to generate a presigned GET URL to allow temporary access.
     """
+    if ENDPOINT_URL:
+        return f"{ENDPOINT_URL.rstrip('/')}/{BUCKET_NAME}/{object_name}"
     return f"https://{BUCKET_NAME}.s3.{REGION_NAME}.amazonaws.com/{object_name}"
 
 
 async def download_file_from_s3(object_name: str) -> bytes:
     """Download a file from S3 and return its bytes."""
-    s3_client = _create_s3_client()
-    if s3_client is None:
-        raise RuntimeError("S3 credentials or bucket not configured")
+    s3_client = _require_client()
     
     try:
         response = s3_client.get_object(Bucket=BUCKET_NAME, Key=object_name)
@@ -84,9 +192,7 @@ def upload_fileobj_to_s3(fileobj, object_name: str, content_type: str = None):
     if content_type:
         extra_args['ContentType'] = content_type
 
-    s3_client = _create_s3_client()
-    if s3_client is None:
-        raise RuntimeError("S3 credentials or bucket not configured (AWS_ACCESS_KEY_ID/AWS_SECRET_ACCESS_KEY/AWS_S3_BUCKET)")
+    s3_client = _require_client()
     try:
         
         try:
@@ -99,3 +205,107 @@ def upload_fileobj_to_s3(fileobj, object_name: str, content_type: str = None):
     except ClientError:
         raise
 
+
+
+def delete_object(object_name: str):
+    _require_client().delete_object(Bucket=BUCKET_NAME, Key=object_name)
+
+
+def copy_object(source_name: str, target_name: str, storage_class: str = None):
+    """Server-side copy within the bucket (managed, so large objects are copied in parts)."""
+    extra_args = {'StorageClass': storage_class} if storage_class else None
+    _require_client().copy({'Bucket': BUCKET_NAME, 'Key': source_name}, BUCKET_NAME, target_name,
+                           ExtraArgs=extra_args)
+
+
+def object_key_from_url(file_url: str):
+    """Return the object key if file_url points into our bucket, otherwise None."""
+    prefix = get_object_url("")
+    if BUCKET_NAME and file_url.startswith(prefix):
+        return file_url[len(prefix):]
+    return None
+
+
+def download_range_from_s3(object_name: str, start: int, end: int) -> bytes:
+    """Download bytes [start, end] (inclusive) of an object using a ranged GET."""
+    s3_client = _require_client()
+
+    try:
+        response = s3_client.get_object(Bucket=BUCKET_NAME, Key=object_name, Range=f"bytes={start}-{end}")
+        return response['Body'].read()
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'NoSuchKey':
+            raise FileNotFoundError(f"File {object_name} not found in S3")
+        raise
+
+
+class S3StreamWriter:
+    """Write an object to S3 incrementally without holding the whole body in memory.
+
+    Bytes are buffered up to part_size; full parts are sent with UploadPart. Objects that
+    never fill a part are sent with a single PutObject on close(). Use as a context manager
+    so a failed upload aborts the multipart upload instead of leaking parts.
+    """
+
+    MIN_PART_SIZE = 5 * 1024 * 1024  # S3 minimum for every part but the last
+
+    def __init__(self, object_name: str, content_type: str = None, part_size: int = 8 * 1024 * 1024):
+        self.s3_client = _require_client()
+        self.object_name = object_name
+        self.content_type = content_type
+        self.part_size = max(part_size, self.MIN_PART_SIZE)
+        self.bytes_written = 0
+        self._buffer = bytearray()
+        self._upload_id = None
+        self._parts = []
+
+    def write(self, chunk: bytes):
+        self._buffer.extend(chunk)
+        self.bytes_written += len(chunk)
+        while len(self._buffer) >= self.part_size:
+            self._upload_part(bytes(self._buffer[:self.part_size]))
+            del self._buffer[:self.part_size]
+
+    def _upload_part(self, data: bytes):
+        if self._upload_id is None:
+            params = {'Bucket': BUCKET_NAME, 'Key': self.object_name}
+            if self.content_type:
+                params['ContentType'] = self.content_type
+            self._upload_id = self.s3_client.create_multipart_upload(**params)['UploadId']
+        part_number = len(self._parts) + 1
+        response = self.s3_client.upload_part(
+            Bucket=BUCKET_NAME, Key=self.object_name, UploadId=self._upload_id,
+            PartNumber=part_number, Body=data,
+        )
+        self._parts.append({'PartNumber': part_number, 'ETag': response['ETag']})
+
+    def close(self) -> str:
+        """Flush remaining bytes, finish the upload and return the object URL."""
+        if self._upload_id is None:
+            params = {'Bucket': BUCKET_NAME, 'Key': self.object_name, 'Body': bytes(self._buffer)}
+            if self.content_type:
+                params['ContentType'] = self.content_type
+            self.s3_client.put_object(**params)
+        else:
+            if self._buffer:
+                self._upload_part(bytes(self._buffer))
+            self.s3_client.complete_multipart_upload(
+                Bucket=BUCKET_NAME, Key=self.object_name, UploadId=self._upload_id,
+                MultipartUpload={'Parts': self._parts},
+            )
+        self._buffer = bytearray()
+        return get_object_url(self.object_name)
+
+    def abort(self):
+        if self._upload_id is not None:
+            abort_multipart_upload(self.object_name, self._upload_id)
+            self._upload_id = None
+        self._buffer = bytearray()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.abort()
+        return False
@@ -0,0 +1,185 @@
+"""
+Progressive processing of large batches.
+
+Processed first-in first-out, a 100k-image batch says nothing about its blank
+ratio or species mix until the last image is done. Batches of at least
+PROGRESSIVE_MIN_BATCH images are therefore queued in a stratified order:
+
+- rows are grouped into strata by folder and capture time (the client's
+  last_modified, else filename order within the folder, cut into
+  PROGRESSIVE_TIME_BUCKETS buckets)
+- each stratum is shuffled and the strata are interleaved in proportion to
+  their size, so every prefix of the order is a proportional stratified
+  sample of the batch
+
+The first sample_size() rows go to the front of the user's queue and the rest
+follow in the same order, so the total compute is unchanged. Deferred rows
+are released in sample_rank order too.
+
+While a batch is incomplete, provisional_estimates() turns its processed rows
+into post-stratified estimates of the blank ratio and of species frequencies
+with ~95% intervals, which /media/export/summary returns next to the exact
+counts.
+"""
+
+import math
+import os
+import posixpath
+import random
+import re
+import uuid
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+PROGRESSIVE_MIN_BATCH = int(os.getenv("PROGRESSIVE_MIN_BATCH", "500"))  # smaller batches stay FIFO; 0 disables
+PROGRESSIVE_SAMPLE_FRACTION = float(os.getenv("PROGRESSIVE_SAMPLE_FRACTION", "0.05"))
+PROGRESSIVE_SAMPLE_MIN = int(os.getenv("PROGRESSIVE_SAMPLE_MIN", "200"))
+PROGRESSIVE_TIME_BUCKETS = int(os.getenv("PROGRESSIVE_TIME_BUCKETS", "4"))
+Z_95 = 1.96
+
+
+def _natural_key(name: str):
+    """IMG_9 before IMG_10: camera counters are the best time proxy without EXIF."""
+    return [int(part) if part.isdigit() else part.lower() for part in re.split(r"(\d+)", name)]
+
+
+def strata_for(files: List[Dict]) -> List[str]:
+    """Stratum label per file: "<folder>#<time bucket>"."""
+    by_folder = defaultdict(list)
+    for i, f in enumerate(files):
+        by_folder[posixpath.dirname(f.get("folder_path") or "")].append(i)
+
+    strata = [None] * len(files)
+    for folder, indices in by_folder.items():
+        indices.sort(key=lambda i: (files[i].get("last_modified") or 0,
+                                    _natural_key(files[i].get("folder_path") or files[i].get("file_url") or "")))
+        buckets = max(min(PROGRESSIVE_TIME_BUCKETS, len(indices)), 1)
+        for rank, i in enumerate(indices):
+            strata[i] = f"{folder}#{rank * buckets // len(indices)}"
+    return strata
+
+
+def stratified_order(strata: List[str], seed=None) -> List[int]:
+    """
+    Indices of strata in an order whose every prefix is a proportional stratified sample.
+
+    Each stratum is shuffled and its k-th member placed at (k + u) / size for a
+    random offset u; sorting on that position interleaves the strata by size.
+    """
+    rng = random.Random(seed)
+    members = defaultdict(list)
+    for i, stratum in enumerate(strata):
+        members[stratum].append(i)
+    positioned = []
+    for indices in members.values():
+        rng.shuffle(indices)
+        offset = rng.random()
+        positioned.extend(((rank + offset) / len(indices), i) for rank, i in enumerate(indices))
+    positioned.sort()
+    return [i for _, i in positioned]
+
+
+def sample_size(count: int) -> int:
+    """Rows of a batch that jump ahead of the user's queue."""
+    return min(count, max(PROGRESSIVE_SAMPLE_MIN, math.ceil(count * PROGRESSIVE_SAMPLE_FRACTION)))
+
+
+def plan_batch(files: List[Dict]) -> Optional[List[int]]:
+    """
+    Stamp batch_id, sample_stratum and sample_rank on the files of a new batch (in place).
+
+    Returns:
+        indices of files in processing order, or None if the batch stays FIFO
+    """
+    if PROGRESSIVE_MIN_BATCH <= 0 or len(files) < PROGRESSIVE_MIN_BATCH:
+        return None
+    batch_id = str(uuid.uuid4())
+    strata = strata_for(files)
+    order = stratified_order(strata)
+    for rank, i in enumerate(order):
+        files[i].update(batch_id=batch_id, sample_stratum=strata[i], sample_rank=rank)
+    return order
+
+
+def _estimate(strata: List[Dict], hits: List[int], labelled_total: int, hits_total: int) -> Dict:
+    """
+    Post-stratified estimate of how many rows of the batches have an attribute.
+
+    Per stratum, the remaining rows are predicted at the stratum's observed rate
+    (the pooled rate if none of it is processed yet). The prediction variance of
+    the remaining total is remaining * size * p(1-p) / labelled, with p smoothed
+    as (x+1)/(n+2) so a stratum with no hits still has width.
+    """
+    pooled = hits_total / labelled_total
+    estimate = variance = 0.0
+    known = remaining_total = 0
+    for stratum, x in zip(strata, hits):
+        n, remaining = stratum["labelled"], stratum["remaining"]
+        known += x
+        remaining_total += remaining
+        if not remaining:
+            continue
+        if n:
+            p, smoothed = x / n, (x + 1) / (n + 2)
+        else:
+            n, p, smoothed = labelled_total, pooled, (hits_total + 1) / (labelled_total + 2)
+        estimate += remaining * p
+        variance += remaining * (remaining + n) * smoothed * (1 - smoothed) / n
+    half_width = Z_95 * math.sqrt(variance)
+    return {
+        "estimate": known + estimate,
+        "low": max(known + estimate - half_width, known),
+        "high": min(known + estimate + half_width, known + remaining_total),
+    }
+
+
+def provisional_estimates(strata_counts: Dict, max_species: int = 50) -> Optional[Dict]:
+    """
+    Blank ratio and species frequencies the incomplete batches are heading for.
+
+    Args:
+        strata_counts: output of db.incomplete_batch_counts
+        max_species: species reported, most frequent first
+
+    Returns:
+        None if no batch is in progress; estimates are null until a first image is processed
+    """
+    if not strata_counts:
+        return None
+    strata = list(strata_counts.values())
+    batches = len({batch_id for batch_id, _ in strata_counts})
+    labelled = sum(s["labelled"] for s in strata)
+    remaining = sum(s["remaining"] for s in strata)
+    images = labelled + remaining
+    result = {
+        "batches": batches,
+        "images": images,
+        "processed": labelled,
+        "sampled_fraction": round(labelled / images, 4) if images else 0.0,
+        "blank_ratio": None,
+        "species": [],
+    }
+    if not labelled:
+        return result
+
+    def ratio(interval):
+        return {key: round(value / images, 4) for key, value in interval.items()}
+
+    blanks = [s["blank"] for s in strata]
+    result["blank_ratio"] = ratio(_estimate(strata, blanks, labelled, sum(blanks)))
+
+    species = set()
+    for s in strata:
+        species.update(s["species"])
+    estimates = []
+    for name in species:
+        hits = [s["species"].get(name, 0) for s in strata]
+        interval = _estimate(strata, hits, labelled, sum(hits))
+        estimates.append({
+            "species": name,
+            "images": {key: round(value) for key, value in interval.items()},
+            "frequency": ratio(interval),
+        })
+    estimates.sort(key=lambda e: e["images"]["estimate"], reverse=True)
+    result["species"] = estimates[:max_species]
+    return result
@@ -0,0 +1,234 @@
+"""
+Inference scheduler with priority classes and per-user fair sharing.
+
+Jobs are submitted with a user_id and one of three priority classes:
+
+- "interactive": single uploads a person is waiting on (POST /media, /media/upload)
+- "batch": bulk uploads (/media/batch)
+- "reprocess": manual or model-upgrade reprocessing
+
+A free worker always takes the highest non-empty class. Within a class, users
+are served by start-time fair queuing: each user carries a virtual time that
+advances by 1/weight per dispatched job and the user with the lowest virtual
+time goes next. One user's 50k-image batch therefore interleaves with every
+other user's work instead of queueing ahead of it. Users that were idle rejoin
+at the current clock, so they cannot bank credit.
+
+Queue wait (submit -> start) is recorded per class in the
+trapsense_queue_wait_seconds histogram and in recent-wait percentiles
+returned by stats().
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import deque, Counter
+from concurrent.futures import Future
+from typing import Callable, Dict, Optional
+
+from ..utils.metrics import queue_depth, queue_wait_seconds, RateWindow
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+PRIORITY_CLASSES = ("interactive", "batch", "reprocess")
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "2"))
+# Workers that only take interactive jobs, so single uploads never wait behind a busy pool
+SCHEDULER_INTERACTIVE_RESERVED = int(os.getenv("SCHEDULER_INTERACTIVE_RESERVED", "0"))
+# Per-user weights, e.g. "user_abc=2,user_def=0.5" (default weight 1)
+SCHEDULER_USER_WEIGHTS = os.getenv("SCHEDULER_USER_WEIGHTS", "")
+RECENT_WAITS = 2000
+
+
+def _parse_weights(spec: str) -> Dict[str, float]:
+    weights = {}
+    for item in spec.split(","):
+        if "=" in item:
+            user_id, weight = item.split("=", 1)
+            try:
+                weights[user_id.strip()] = max(float(weight), 0.01)
+            except ValueError:
+                logger.warning(f"Ignoring invalid scheduler weight: {item}")
+    return weights
+
+
+class Job:
+    __slots__ = ("fn", "args", "kwargs", "user_id", "priority", "enqueued_at", "future")
+
+    def __init__(self, fn: Callable, args, kwargs, user_id: str, priority: str):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.user_id = user_id
+        self.priority = priority
+        self.enqueued_at = time.monotonic()
+        self.future = Future()
+
+
+class _FairQueue:
+    """Per-user FIFOs for one priority class, dispatched by start-time fair queuing"""
+
+    def __init__(self):
+        self.queues: Dict[str, deque] = {}
+        self.vtime: Dict[str, float] = {}
+        self.clock = 0.0
+        self.size = 0
+
+    def push(self, job: Job, front: bool = False):
+        queue = self.queues.get(job.user_id)
+        if queue is None:
+            queue = self.queues[job.user_id] = deque()
+            self.vtime[job.user_id] = self.clock
+        if front:
+            queue.appendleft(job)
+        else:
+            queue.append(job)
+        self.size += 1
+
+    def pop(self, weight: Callable[[str], float]) -> Job:
+        user_id = min(self.queues, key=self.vtime.__getitem__)
+        queue = self.queues[user_id]
+        job = queue.popleft()
+        self.size -= 1
+        self.clock = self.vtime[user_id]
+        if queue:
+            self.vtime[user_id] += 1.0 / weight(user_id)
+        else:
+            del self.queues[user_id]
+            del self.vtime[user_id]
+        return job
+
+
+class InferenceScheduler:
+    """Thread pool fed from per-class fair queues; submit() returns a Future"""
+
+    def __init__(self, workers: int = INFERENCE_WORKERS, interactive_reserved: int = SCHEDULER_INTERACTIVE_RESERVED,
+                 weights: Optional[Dict[str, float]] = None):
+        self.workers = max(workers, 1)
+        self.interactive_reserved = min(max(interactive_reserved, 0), self.workers - 1)
+        self.weights = dict(weights or {})
+        self._queues = {p: _FairQueue() for p in PRIORITY_CLASSES}
+        self._user_depth = Counter()
+        self._running = 0
+        self._completed = Counter()
+        self._waits = {p: deque(maxlen=RECENT_WAITS) for p in PRIORITY_CLASSES}
+        self._drain = RateWindow(60.0)
+        self._cond = threading.Condition()
+        self._threads = []
+        for p in PRIORITY_CLASSES:
+            queue_depth.set(0, priority=p)
+
+    def _ensure_started(self):
+        # Called with the lock held; threads start on first use so importers
+        # that never submit (ingest CLI, benchmarks) do not spawn idle workers
+        if self._threads:
+            return
+        for i in range(self.workers):
+            classes = ("interactive",) if i < self.interactive_reserved else PRIORITY_CLASSES
+            thread = threading.Thread(target=self._work, args=(classes,), name=f"inference-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"Inference scheduler started with {self.workers} workers "
+                    f"({self.interactive_reserved} reserved for interactive)")
+
+    def weight(self, user_id: str) -> float:
+        return self.weights.get(user_id, 1.0)
+
+    def set_weight(self, user_id: str, weight: float):
+        with self._cond:
+            self.weights[user_id] = max(weight, 0.01)
+
+    def submit(self, fn: Callable, *args, user_id: str, priority: str = "batch", front: bool = False,
+               **kwargs) -> Future:
+        """
+        Queue fn(*args, **kwargs) for a worker thread.
+
+        Args:
+            user_id: owner of the work; fair sharing is across user ids
+            priority: "interactive", "batch" or "reprocess"
+            front: go ahead of the user's other jobs in this class (sample of a progressive batch)
+
+        Returns:
+            Future resolving to fn's return value
+        """
+        if priority not in self._queues:
+            raise ValueError(f"Unknown priority class: {priority}")
+        job = Job(fn, args, kwargs, user_id, priority)
+        with self._cond:
+            self._ensure_started()
+            self._queues[priority].push(job, front)
+            self._user_depth[user_id] += 1
+            queue_depth.inc(priority=priority)
+            self._cond.notify_all()
+        return job.future
+
+    def _next(self, classes) -> Job:
+        with self._cond:
+            while True:
+                for priority in classes:
+                    queue = self._queues[priority]
+                    if queue.size:
+                        job = queue.pop(self.weight)
+                        self._user_depth[job.user_id] -= 1
+                        if self._user_depth[job.user_id] <= 0:
+                            del self._user_depth[job.user_id]
+                        self._running += 1
+                        queue_depth.dec(priority=priority)
+                        return job
+                self._cond.wait()
+
+    def _work(self, classes):
+        while True:
+            job = self._next(classes)
+            wait = time.monotonic() - job.enqueued_at
+            queue_wait_seconds.observe(wait, priority=job.priority)
+            try:
+                if job.future.set_running_or_notify_cancel():
+                    try:
+                        job.future.set_result(job.fn(*job.args, **job.kwargs))
+                    except BaseException as e:
+                        job.future.set_exception(e)
+            finally:
+                with self._cond:
+                    self._running -= 1
+                    self._completed[job.priority] += 1
+                    self._waits[job.priority].append(wait)
+                self._drain.mark()
+
+    def depth(self, priority: Optional[str] = None, user_id: Optional[str] = None) -> int:
+        """Queued (not yet started) jobs, optionally for one class or one user."""
+        with self._cond:
+            if user_id is not None:
+                return self._user_depth.get(user_id, 0)
+            if priority is not None:
+                return self._queues[priority].size
+            return sum(q.size for q in self._queues.values())
+
+    def drain_rate(self) -> float:
+        """Jobs completed per second over the last minute."""
+        return self._drain.rate()
+
+    def stats(self) -> Dict:
+        with self._cond:
+            classes = {}
+            for p in PRIORITY_CLASSES:
+                waits = sorted(self._waits[p])
+                classes[p] = {
+                    "queued": self._queues[p].size,
+                    "active_users": len(self._queues[p].queues),
+                    "completed": self._completed[p],
+                    "wait_p50_s": round(waits[len(waits) // 2], 3) if waits else None,
+                    "wait_p95_s": round(waits[min(len(waits) - 1, int(len(waits) * 0.95))], 3) if waits else None,
+                }
+            return {
+                "workers": self.workers,
+                "interactive_reserved": self.interactive_reserved,
+                "running": self._running,
+                "drain_rate_per_s": round(self._drain.rate(), 3),
+                "classes": classes,
+            }
+
+
+scheduler = InferenceScheduler(weights=_parse_weights(SCHEDULER_USER_WEIGHTS))
@@ -0,0 +1,408 @@
+"""
+storage.py
+
+Pluggable object storage used by the API, the worker and the exporters.
+
+STORAGE_BACKEND selects the implementation:
+- "s3" (default): the bucket configured in services/s3.py
+- "local": a directory on this machine, served by the /api/storage routes.
+  Reads go through memory-mapped files, so a field station without internet
+  can run the whole stack on one box.
+
+Keys under COLD_PREFIX form the cold tier (see services/lifecycle.py): an S3
+storage class such as GLACIER_IR, or STORAGE_LOCAL_COLD_ROOT for local storage.
+"""
+
+import hashlib
+import hmac
+import io
+import logging
+import mmap
+import os
+import posixpath
+import shutil
+import tempfile
+import time
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional, Tuple
+from urllib.parse import quote, unquote, urlencode
+
+import requests
+
+from . import s3
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "s3").lower()
+STORAGE_LOCAL_ROOT = os.getenv("STORAGE_LOCAL_ROOT", "./storage_data")
+STORAGE_PUBLIC_URL = os.getenv("STORAGE_PUBLIC_URL", "http://localhost:8000/api/storage")
+STORAGE_SIGNING_SECRET = os.getenv("STORAGE_SIGNING_SECRET", "")
+STORAGE_LOCAL_PUBLIC_READ = os.getenv("STORAGE_LOCAL_PUBLIC_READ", "1") == "1"
+STORAGE_LOCAL_COLD_ROOT = os.getenv("STORAGE_LOCAL_COLD_ROOT")  # default: <root>/_cold
+STORAGE_COLD_CLASS = os.getenv("STORAGE_COLD_CLASS", "GLACIER_IR")  # instant retrieval, so reads keep working
+COLD_PREFIX = "_cold/"
+
+
+def check_key(key: str) -> str:
+    """Return key if it is a plain relative key: not absolute, no empty, "." or ".." segments."""
+    if not key or key.startswith("/") or "\\" in key or any(part in ("", ".", "..") for part in key.split("/")):
+        raise ValueError(f"Invalid storage key: {key!r}")
+    return key
+
+
+def user_key(user_id: str, file_name: str) -> str:
+    """
+    Storage key for a client-supplied file name (may carry folders) under f"{user_id}/".
+
+    Raises:
+        ValueError: the name is empty or would leave the user's prefix
+    """
+    name = posixpath.normpath(file_name.replace("\\", "/").lstrip("/"))
+    return check_key(f"{user_id}/{name}")
+
+
+class MultipartNotSupported(RuntimeError):
+    """The storage backend has no multipart uploads (check supports_multipart first)"""
+
+
+class StorageBackend(ABC):
+    """Interface shared by every storage implementation"""
+
+    name = "base"
+    supports_multipart = False
+
+    @abstractmethod
+    def url_for(self, key: str) -> str:
+        """Stable URL stored in Media.file_url for an object."""
+
+    @abstractmethod
+    def key_from_url(self, url: str) -> Optional[str]:
+        """Inverse of url_for; None if the URL does not belong to this backend."""
+
+    @abstractmethod
+    def put(self, key: str, fileobj, content_type: str = None) -> str:
+        """Store a file-like object and return its URL."""
+
+    def put_bytes(self, key: str, data: bytes, content_type: str = None) -> str:
+        return self.put(key, io.BytesIO(data), content_type=content_type)
+
+    @abstractmethod
+    def open_writer(self, key: str, content_type: str = None):
+        """Incremental writer (write/close/abort, usable as a context manager)."""
+
+    @abstractmethod
+    def get(self, key: str) -> bytes:
+        ...
+
+    @abstractmethod
+    def get_range(self, key: str, start: int, end: int) -> bytes:
+        """Bytes [start, end] inclusive."""
+
+    @abstractmethod
+    def exists(self, key: str) -> bool:
+        ...
+
+    @abstractmethod
+    def delete(self, key: str):
+        ...
+
+    @abstractmethod
+    def copy_to_cold(self, key: str) -> str:
+        """Copy an object into the cold tier and return its cold key (the original stays until deleted)."""
+
+    def presign_put(self, key: str, content_type: str = None, expiration: int = 3600) -> str:
+        return self.presign_put_many([(key, content_type)], expiration=expiration)[0]
+
+    @abstractmethod
+    def presign_put_many(self, objects: Iterable[Tuple[str, Optional[str]]], expiration: int = 3600) -> List[str]:
+        ...
+
+    @abstractmethod
+    def presign_get(self, key: str, expiration: int = 3600) -> str:
+        ...
+
+    @abstractmethod
+    def list(self, prefix: str = "") -> Iterator[str]:
+        ...
+
+    # Multipart uploads (only where supports_multipart is True)
+    def create_multipart_upload(self, key: str, part_count: int, expiration: int = 3600, content_type: str = None):
+        raise MultipartNotSupported(f"{self.name} storage does not support multipart uploads")
+
+    def complete_multipart_upload(self, key: str, upload_id: str, parts: list) -> str:
+        raise MultipartNotSupported(f"{self.name} storage does not support multipart uploads")
+
+    def abort_multipart_upload(self, key: str, upload_id: str):
+        raise MultipartNotSupported(f"{self.name} storage does not support multipart uploads")
+
+
+class S3Storage(StorageBackend):
+    """Storage backed by the configured S3 bucket"""
+
+    name = "s3"
+    supports_multipart = True
+
+    def url_for(self, key: str) -> str:
+        return s3.get_object_url(key)
+
+    def key_from_url(self, url: str) -> Optional[str]:
+        return s3.object_key_from_url(url)
+
+    def put(self, key: str, fileobj, content_type: str = None) -> str:
+        return s3.upload_fileobj_to_s3(fileobj, key, content_type=content_type)
+
+    def open_writer(self, key: str, content_type: str = None):
+        return s3.S3StreamWriter(key, content_type=content_type)
+
+    def get(self, key: str) -> bytes:
+        s3_client = s3.get_s3_client()
+        if s3_client is None:
+            raise RuntimeError("S3 credentials or bucket not configured")
+        try:
+            return s3_client.get_object(Bucket=s3.BUCKET_NAME, Key=key)['Body'].read()
+        except s3.ClientError as e:
+            if e.response['Error']['Code'] == 'NoSuchKey':
+                raise FileNotFoundError(f"File {key} not found in S3")
+            raise
+
+    def get_range(self, key: str, start: int, end: int) -> bytes:
+        return s3.download_range_from_s3(key, start, end)
+
+    def exists(self, key: str) -> bool:
+        s3_client = s3.get_s3_client()
+        if s3_client is None:
+            raise RuntimeError("S3 credentials or bucket not configured")
+        try:
+            s3_client.head_object(Bucket=s3.BUCKET_NAME, Key=key)
+            return True
+        except s3.ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+
+    def delete(self, key: str):
+        s3.delete_object(key)
+
+    def copy_to_cold(self, key: str) -> str:
+        cold_key = f"{COLD_PREFIX}{key}"
+        s3.copy_object(key, cold_key, storage_class=STORAGE_COLD_CLASS)
+        return cold_key
+
+    def presign_put_many(self, objects, expiration: int = 3600) -> List[str]:
+        return s3.generate_presigned_put_urls(objects, expiration=expiration)
+
+    def presign_get(self, key: str, expiration: int = 3600) -> str:
+        return s3.generate_presigned_get_url(key, expiration=expiration)
+
+    def list(self, prefix: str = "") -> Iterator[str]:
+        return s3.list_object_keys(prefix)
+
+    def create_multipart_upload(self, key: str, part_count: int, expiration: int = 3600, content_type: str = None):
+        return s3.create_multipart_upload(key, part_count, expiration=expiration, content_type=content_type)
+
+    def complete_multipart_upload(self, key: str, upload_id: str, parts: list) -> str:
+        return s3.complete_multipart_upload(key, upload_id, parts)
+
+    def abort_multipart_upload(self, key: str, upload_id: str):
+        s3.abort_multipart_upload(key, upload_id)
+
+
+class _LocalWriter:
+    """Writes to a temp file next to the target and renames it into place on close"""
+
+    def __init__(self, storage: "LocalStorage", key: str):
+        self.storage = storage
+        self.key = key
+        self.path = storage.path_for(key)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd, self._tmp_path = tempfile.mkstemp(dir=self.path.parent, prefix=".upload-")
+        self._file = os.fdopen(fd, "wb")
+        self.bytes_written = 0
+
+    def write(self, chunk: bytes):
+        self._file.write(chunk)
+        self.bytes_written += len(chunk)
+
+    def close(self) -> str:
+        self._file.close()
+        os.replace(self._tmp_path, self.path)
+        return self.storage.url_for(self.key)
+
+    def abort(self):
+        self._file.close()
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.abort()
+        return False
+
+
+class LocalStorage(StorageBackend):
+    """
+    Storage in a local directory.
+
+    Presigned URLs point at the /api/storage routes and carry an HMAC signature
+    with an expiry, mirroring S3 presigned URL semantics.
+    """
+
+    name = "local"
+
+    def __init__(self, root: str = STORAGE_LOCAL_ROOT, base_url: str = STORAGE_PUBLIC_URL,
+                 secret: str = STORAGE_SIGNING_SECRET, cold_root: str = STORAGE_LOCAL_COLD_ROOT):
+        self.root = Path(root).resolve()
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.cold_root = Path(cold_root).resolve() if cold_root else self.root / COLD_PREFIX.rstrip("/")
+        self.base_url = base_url.rstrip("/")
+        if not secret:
+            logger.warning("STORAGE_SIGNING_SECRET not set; using a per-process random secret")
+            secret = os.urandom(32).hex()
+        self._secret = secret.encode()
+
+    def path_for(self, key: str) -> Path:
+        check_key(key)
+        root = self.root
+        if key.startswith(COLD_PREFIX):
+            root, key = self.cold_root, key[len(COLD_PREFIX):]
+        path = (root / key).resolve()
+        if root not in path.parents:
+            raise ValueError(f"Invalid storage key: {key}")
+        return path
+
+    def url_for(self, key: str) -> str:
+        return f"{self.base_url}/{quote(key)}"
+
+    def key_from_url(self, url: str) -> Optional[str]:
+        prefix = f"{self.base_url}/"
+        if not url.startswith(prefix):
+            return None
+        return unquote(url[len(prefix):].split("?", 1)[0])
+
+    def put(self, key: str, fileobj, content_type: str = None) -> str:
+        with self.open_writer(key) as writer:
+            while True:
+                chunk = fileobj.read(1024 * 1024)
+                if not chunk:
+                    break
+                writer.write(chunk)
+            return writer.close()
+
+    def open_writer(self, key: str, content_type: str = None):
+        return _LocalWriter(self, key)
+
+    def _read(self, key: str, start: int = 0, end: Optional[int] = None) -> bytes:
+        path = self.path_for(key)
+        if not path.exists():
+            raise FileNotFoundError(f"File {key} not found in local storage")
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return b""
+            # Only the pages covering the requested range are faulted in
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                return mm[start:None if end is None else end + 1]
+
+    def get(self, key: str) -> bytes:
+        return self._read(key)
+
+    def get_range(self, key: str, start: int, end: int) -> bytes:
+        return self._read(key, start, end)
+
+    def sign(self, method: str, key: str, expires: int) -> str:
+        message = f"{method}\n{key}\n{expires}".encode()
+        return hmac.new(self._secret, message, hashlib.sha256).hexdigest()
+
+    def verify(self, method: str, key: str, expires: int, signature: str) -> bool:
+        if expires < time.time():
+            return False
+        return hmac.compare_digest(self.sign(method, key, expires), signature or "")
+
+    def _presign(self, method: str, key: str, expiration: int) -> str:
+        expires = int(time.time()) + expiration
+        query = urlencode({"expires": expires, "signature": self.sign(method, key, expires)})
+        return f"{self.url_for(key)}?{query}"
+
+    def exists(self, key: str) -> bool:
+        try:
+            return self.path_for(key).is_file()
+        except ValueError:
+            return False
+
+    def delete(self, key: str):
+        try:
+            self.path_for(key).unlink()
+        except FileNotFoundError:
+            pass
+
+    def copy_to_cold(self, key: str) -> str:
+        cold_key = f"{COLD_PREFIX}{key}"
+        target = self.path_for(cold_key)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=target.parent, prefix=".upload-")
+        os.close(fd)
+        try:
+            shutil.copyfile(self.path_for(key), tmp_path)
+            os.replace(tmp_path, target)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return cold_key
+
+    def presign_put_many(self, objects, expiration: int = 3600) -> List[str]:
+        return [self._presign("PUT", key, expiration) for key, _ in objects]
+
+    def presign_get(self, key: str, expiration: int = 3600) -> str:
+        return self._presign("GET", key, expiration)
+
+    def list(self, prefix: str = "") -> Iterator[str]:
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                if filename.startswith(".upload-"):
+                    continue
+                key = os.path.relpath(os.path.join(dirpath, filename), self.root).replace(os.sep, "/")
+                if key.startswith(prefix):
+                    yield key
+
+
+def get_storage_backend() -> StorageBackend:
+    """Build the backend selected by STORAGE_BACKEND."""
+    if STORAGE_BACKEND == "local":
+        return LocalStorage()
+    if STORAGE_BACKEND == "s3":
+        return S3Storage()
+    raise ValueError(f"Unknown STORAGE_BACKEND: {STORAGE_BACKEND}")
+
+
+def is_fetchable_url(file_url: str) -> bool:
+    """Whether file_url is an object of our storage backend or an http(s) URL."""
+    if not isinstance(file_url, str):
+        return False
+    return storage.key_from_url(file_url) is not None or file_url.lower().startswith(("http://", "https://"))
+
+
+def fetch_bytes(file_url: str, timeout: int = 30) -> bytes:
+    """Read an object by URL: through the storage backend when it owns the URL, else over HTTP.
+
+    Media.file_url is client-supplied, so nothing else (file://, ftp://, ...) is ever read here;
+    media registered in place by the offline ingest CLI is read from disk by ingest.py only.
+    """
+    key = storage.key_from_url(file_url)
+    if key is not None:
+        return storage.get(key)
+    if not is_fetchable_url(file_url):
+        raise ValueError(f"Refusing to fetch non-HTTP URL: {file_url}")
+    response = requests.get(file_url, timeout=timeout)
+    response.raise_for_status()
+    return response.content
+
+
+# Global storage instance
+storage = get_storage_backend()
+logger.info(f"Using {storage.name} storage backend")
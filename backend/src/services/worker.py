@@ -4,12 +4,20 @@ worker.py
 Background worker for processing uploaded media through ML pipeline
 """
 
+import hashlib
 import logging
-import requests
-from typing import Dict
+import time
+from datetime import datetime
+from typing import Dict, Optional
 from sqlalchemy.orm import Session
 
 from .ml import ml_service
+from .prefilter import prefilter, PREFILTER_MODE
+from .renditions import store_renditions
+from .storage import fetch_bytes
+from .embeddings import embedding_store
+from ..utils.metrics import stage_seconds, record_processed, upload_to_prediction_seconds
+from ..utils.tracing import stage
 from ..database.db import update_media_predictions, get_media_by_id
 
 logging.basicConfig(level=logging.INFO)
@@ -26,7 +34,7 @@ class MediaProcessor:
     
     def download_image(self, file_url: str) -> bytes:
         """
-        Download image from URL (S3 or direct URL)
+        Download image from URL (storage backend or direct URL)
         
         Args:
             file_url: URL of the image to download
@@ -36,25 +44,35 @@ class MediaProcessor:
         """
         try:
             logger.info(f"Downloading image from: {file_url}")
-            response = requests.get(file_url, timeout=30)
-            response.raise_for_status()
-            logger.info(f"Downloaded {len(response.content)} bytes")
-            return response.content
+            content = fetch_bytes(file_url, timeout=30)
+            logger.info(f"Downloaded {len(content)} bytes")
+            return content
         except Exception as e:
             logger.error(f"Failed to download image from {file_url}: {e}")
             raise
     
-    def process_media(self, media_id: str, db: Session) -> Dict:
+    def process_media(self, media_id: str, db: Session, image_bytes: Optional[bytes] = None,
+                      with_renditions: bool = True, reprocess: bool = False) -> Dict:
         """
         Process a single media item through ML pipeline and update DB
         
         Args:
             media_id: ID of media to process
             db: Database session
+            image_bytes: Image bytes already in hand (e.g. from a streaming upload);
+                when given, the download from S3 is skipped
+            with_renditions: write thumbnail/preview renditions (reprocessing skips
+                this when they already exist)
+            reprocess: the row already holds a prediction; on failure it is left
+                untouched (and stays stale) instead of being marked "error"
             
         Returns:
             Processing result dictionary
         """
+        started = time.perf_counter()
+        # Pin the models for this item: a hot reload swaps self.ml_service, but work
+        # already started finishes (and is stamped) with the version it began on
+        ml = self.ml_service
         try:
             # 1. Get media record from database
             media = get_media_by_id(db, media_id)
@@ -63,26 +81,80 @@ class MediaProcessor:
             
             logger.info(f"Processing media {media_id}: {media.file_url}")
             
-            # 2. Download image from S3/URL
-            image_bytes = self.download_image(media.file_url)
+            # 2. Download image from S3/URL unless the bytes were handed over
+            if image_bytes is None:
+                with stage("download", file_url=media.file_url):
+                    image_bytes = self.download_image(media.file_url)
+            content_hash = media.content_hash or hashlib.sha256(image_bytes).hexdigest()
             
-            # 3. Run ML pipeline (classification + detection)
-            ml_result = self.ml_service.process_media(image_bytes)
+            # 3. Cheap background-model prefilter (per camera / folder)
+            prefilter_score = None
+            prefilter_decision = None
+            if prefilter is not None:
+                with stage("prefilter"):
+                    is_candidate, prefilter_score = prefilter.score(media.folder_path, image_bytes)
+                prefilter_decision = "blank_candidate" if is_candidate else "pass"
+                logger.info(f"Prefilter score for {media_id}: {prefilter_score:.4f} ({prefilter_decision})")
+
+            # 4. Decode once; the same image feeds inference and renditions
+            with stage("decode"):
+                image = ml.decode_image(image_bytes)
+
+            # 5. Run ML pipeline (classification + detection)
+            if prefilter_decision == "blank_candidate" and PREFILTER_MODE == "skip":
+                ml_result = {
+                    'classification': "blank",
+                    'confidence': 1.0 - prefilter_score,
+                    'species': None,
+                    'predictions': None,
+                    'stage': "prefilter"
+                }
+                ml.cascade_stats.record("prefilter")
+            else:
+                ml_result = ml.process_media(image)
             
             logger.info(f"ML processing complete for {media_id}: {ml_result['classification']}")
             
-            # 4. Update database with predictions
+            # 6. Thumbnail/preview renditions from the already decoded image
+            rendition_urls = {}
+            if with_renditions:
+                with stage("renditions"):
+                    rendition_urls = store_renditions(image, media.user_id, media_id)
+            del image
+
+            # 7. Update database with predictions
             # Note: ml_result already has species as comma-separated string
-            updated_media = update_media_predictions(
-                db,
-                media_id=media_id,
-                classification=ml_result["classification"],
-                confidence=ml_result["confidence"],
-                species=ml_result["species"],  # Already a comma-separated string or None
-                predictions=ml_result["predictions"]
-            )
+            with stage("db_write"):
+                updated_media = update_media_predictions(
+                    db,
+                    media_id=media_id,
+                    classification=ml_result["classification"],
+                    confidence=ml_result["confidence"],
+                    species=ml_result["species"],  # Already a comma-separated string or None
+                    predictions=ml_result["predictions"],
+                    prefilter_score=prefilter_score,
+                    prefilter_decision=prefilter_decision,
+                    thumbnail_url=rendition_urls.get("thumb"),
+                    preview_url=rendition_urls.get("preview"),
+                    content_hash=content_hash,
+                    model_version=ml.model_version,
+                    prediction_stage=ml_result.get("stage")
+                )
             
             logger.info(f"Database updated for {media_id}")
+
+            # 8. Similar-image index (best effort; search just misses this image on failure)
+            if embedding_store is not None and ml_result.get("embedding") is not None:
+                try:
+                    with stage("embed_index"):
+                        embedding_store.add(media.user_id, media_id, ml_result["embedding"], ml.weights_digest)
+                except Exception as e:
+                    logger.warning(f"Could not index embedding for {media_id}: {e}")
+
+            stage_seconds.observe(time.perf_counter() - started, stage="total")
+            record_processed(ml_result["classification"])
+            if media.uploaded_at:
+                upload_to_prediction_seconds.observe((datetime.now() - media.uploaded_at).total_seconds())
             
             return {
                 "success": True,
@@ -90,12 +162,21 @@ class MediaProcessor:
                 "classification": ml_result["classification"],
                 "confidence": ml_result["confidence"],
                 "species": ml_result["species"],
+                "stage": ml_result.get("stage"),
                 "detection_count": len(ml_result["predictions"]) if ml_result["predictions"] else 0
             }
             
         except Exception as e:
             logger.error(f"Error processing media {media_id}: {e}", exc_info=True)
-            
+            record_processed("error")
+            # A failed flush or commit leaves the session unusable until rolled back
+            db.rollback()
+
+            if reprocess:
+                # Keep the existing prediction; a later reprocess job retries the row
+                logger.warning(f"Reprocessing {media_id} failed; keeping its previous prediction")
+                return {"success": False, "media_id": media_id, "error": str(e)}
+
             # Update media with error status
             try:
                 update_media_predictions(
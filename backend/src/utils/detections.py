@@ -0,0 +1,147 @@
+"""
+Compact columnar detector output.
+
+Inside the pipeline detections stay as three NumPy arrays: boxes float32[N, 4]
+(x1, y1, x2, y2), conf float32[N] and cls int16[N], plus the id -> name map of
+the classes present. They are converted from the model's tensors in one
+vectorized step and stored as a small binary blob (Media.detections). The
+familiar list-of-dicts view is only built at the API boundary (to_dicts).
+
+Blob layout (little endian):
+    b"DET1" | uint32 N | float32[N*4] boxes | float32[N] conf | int16[N] cls
+    | uint16 K | K x (int16 class_id, uint8 len, utf-8 name)
+"""
+
+import json
+import struct
+from typing import Dict, List, Optional, Union
+
+import numpy as np
+
+MAGIC = b"DET1"
+_HEADER = struct.Struct("<4sI")
+_NAME = struct.Struct("<hB")
+
+
+class Detections:
+    __slots__ = ("boxes", "conf", "cls", "names")
+
+    def __init__(self, boxes: np.ndarray, conf: np.ndarray, cls: np.ndarray, names: Dict[int, str]):
+        self.boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        self.conf = np.asarray(conf, dtype=np.float32).reshape(-1)
+        self.cls = np.asarray(cls, dtype=np.int16).reshape(-1)
+        present = set(self.cls.tolist())
+        self.names = {int(k): v for k, v in names.items() if int(k) in present}
+
+    @classmethod
+    def empty(cls) -> "Detections":
+        return cls(np.empty((0, 4), np.float32), np.empty(0, np.float32), np.empty(0, np.int16), {})
+
+    @classmethod
+    def from_results(cls, results) -> "Detections":
+        """One tensor -> NumPy transfer per field from Ultralytics results (no per-box Python loop)."""
+        boxes, conf, class_ids, names = [], [], [], {}
+        for r in results:
+            if r.boxes is None or len(r.boxes) == 0:
+                continue
+            data = r.boxes.data.cpu().numpy()  # [N, 6] = x1, y1, x2, y2, conf, cls
+            boxes.append(data[:, :4])
+            conf.append(data[:, 4])
+            class_ids.append(data[:, 5])
+            names.update(r.names)
+        if not boxes:
+            return cls.empty()
+        return cls(np.concatenate(boxes), np.concatenate(conf), np.concatenate(class_ids), names)
+
+    @classmethod
+    def from_dicts(cls, detections: List[Dict]) -> "Detections":
+        """Build from the legacy list-of-dicts form (stored JSON, manual updates, fixtures)."""
+        if not detections:
+            return cls.empty()
+        return cls(
+            [d["bbox"] for d in detections],
+            [d["confidence"] for d in detections],
+            [d["class_id"] for d in detections],
+            {d["class_id"]: d["class_name"] for d in detections},
+        )
+
+    def __len__(self) -> int:
+        return int(self.conf.shape[0])
+
+    def max_confidence(self) -> float:
+        return float(self.conf.max()) if len(self) else 0.0
+
+    def species(self) -> List[str]:
+        return sorted({self.names.get(int(c), str(int(c))) for c in np.unique(self.cls)})
+
+    def class_names(self) -> List[str]:
+        lookup = self.names
+        return [lookup.get(c, str(c)) for c in self.cls.tolist()]
+
+    def to_dicts(self) -> List[Dict]:
+        """API view: [{'bbox', 'confidence', 'class_id', 'class_name'}, ...]"""
+        return [
+            {"bbox": box, "confidence": conf, "class_id": class_id, "class_name": name}
+            for box, conf, class_id, name in zip(
+                self.boxes.tolist(), self.conf.tolist(), self.cls.tolist(), self.class_names()
+            )
+        ]
+
+    def to_bytes(self) -> bytes:
+        parts = [
+            _HEADER.pack(MAGIC, len(self)),
+            self.boxes.astype("<f4", copy=False).tobytes(),
+            self.conf.astype("<f4", copy=False).tobytes(),
+            self.cls.astype("<i2", copy=False).tobytes(),
+            struct.pack("<H", len(self.names)),
+        ]
+        for class_id, name in self.names.items():
+            encoded = name.encode()[:255]
+            parts.append(_NAME.pack(class_id, len(encoded)))
+            parts.append(encoded)
+        return b"".join(parts)
+
+    @classmethod
+    def from_bytes(cls, blob: bytes) -> "Detections":
+        magic, n = _HEADER.unpack_from(blob, 0)
+        if magic != MAGIC:
+            raise ValueError("Not a detections blob")
+        offset = _HEADER.size
+        boxes = np.frombuffer(blob, "<f4", n * 4, offset).reshape(n, 4)
+        offset += n * 16
+        conf = np.frombuffer(blob, "<f4", n, offset)
+        offset += n * 4
+        class_ids = np.frombuffer(blob, "<i2", n, offset)
+        offset += n * 2
+        (count,) = struct.unpack_from("<H", blob, offset)
+        offset += 2
+        names = {}
+        for _ in range(count):
+            class_id, length = _NAME.unpack_from(blob, offset)
+            offset += _NAME.size
+            names[class_id] = blob[offset:offset + length].decode()
+            offset += length
+        return cls(boxes, conf, class_ids, names)
+
+
+def predictions_view(detections: Optional[bytes], predictions: Optional[str]) -> Optional[Union[List, Dict]]:
+    """
+    API view of a media row's predictions: the binary detections blob when present,
+    otherwise the legacy JSON column (older rows, manual updates, error details).
+    """
+    if detections:
+        return Detections.from_bytes(detections).to_dicts()
+    if isinstance(predictions, str):
+        try:
+            return json.loads(predictions)
+        except ValueError:
+            return None
+    return predictions
+
+
+def detection_count(detections: Optional[bytes], predictions: Optional[str]) -> int:
+    """Number of detections without materializing them (reads the blob header only)."""
+    if detections:
+        return _HEADER.unpack_from(detections, 0)[1]
+    view = predictions_view(None, predictions)
+    return len(view) if isinstance(view, list) else 0
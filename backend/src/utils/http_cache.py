@@ -0,0 +1,121 @@
+"""
+Conditional GET and response caching for per-user read endpoints.
+
+Every user has a data version (see db.get_data_version) that increments
+whenever their media rows are created or their predictions/metadata change.
+A read endpoint's response is fully determined by (user, endpoint, query,
+version), so that tuple gives a strong ETag without hashing the body:
+
+- `If-None-Match` matching the current ETag -> 304, no query, no serialization
+- otherwise the serialized body is served from a bounded in-process LRU
+  keyed the same way, and only rebuilt when the version moved
+
+Entries for old versions are never served again; they simply age out of the LRU.
+"""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Optional, Tuple
+
+from fastapi import Request, Response
+
+from .metrics import registry, Counter
+from .serialization import dumps
+
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "512"))
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+# Revalidate on every use; the ETag check makes that a cheap round trip
+CACHE_CONTROL = "private, no-cache"
+
+cache_requests = registry.register(Counter(
+    "trapsense_response_cache_requests_total", "Conditional GET outcomes for cached read endpoints", ["result"]))
+
+
+class ResponseCache:
+    """LRU of serialized response bodies bounded by entry count and total bytes"""
+
+    def __init__(self, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES, max_bytes: int = RESPONSE_CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Tuple, Tuple[str, bytes]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple, etag: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != etag:
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key: Tuple, etag: str, body: bytes):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old[1])
+            self._entries[key] = (etag, body)
+            self._bytes += len(body)
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._bytes,
+                    "max_entries": self.max_entries, "max_bytes": self.max_bytes}
+
+
+response_cache = ResponseCache()
+
+
+def make_etag(user_id: str, key: str, version: int) -> str:
+    digest = hashlib.sha1(f"{user_id}\x00{key}".encode()).hexdigest()[:16]
+    return f'"{digest}-{version}"'
+
+
+def _etag_matches(header: Optional[str], etag: str) -> bool:
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # Weak comparison is fine for GET revalidation (RFC 9110 13.1.2)
+    candidates = [c.strip().removeprefix("W/") for c in header.split(",")]
+    return etag in candidates
+
+
+def cached_json_response(request: Request, user_id: str, version: int, build: Callable[[], object]) -> Response:
+    """
+    Serve a per-user JSON read endpoint with ETag / If-None-Match support.
+
+    Args:
+        request: incoming request (path + query string form the cache key)
+        user_id: owner of the data; part of both the key and the ETag
+        version: the user's current data version
+        build: returns the JSON-able payload; only called on a cache miss
+
+    Returns:
+        304 when the client already has this version, otherwise a JSON Response
+    """
+    key = request.url.path + ("?" + request.url.query if request.url.query else "")
+    etag = make_etag(user_id, key, version)
+    headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        cache_requests.inc(result="not_modified")
+        return Response(status_code=304, headers=headers)
+
+    cache_key = (user_id, key)
+    body = response_cache.get(cache_key, etag)
+    if body is None:
+        cache_requests.inc(result="miss")
+        body = dumps(build())
+        response_cache.put(cache_key, etag, body)
+    else:
+        cache_requests.inc(result="hit")
+    return Response(content=body, media_type="application/json", headers=headers)
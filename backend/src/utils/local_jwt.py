@@ -0,0 +1,87 @@
+"""
+Local HS256 JWT issuer/verifier standing in for Clerk on offline boxes.
+
+When LOCAL_JWT_SECRET is set, authenticate_and_get_user accepts bearer tokens
+signed with it (issuer LOCAL_JWT_ISSUER) instead of calling Clerk. Meant for
+load tests and field installs without internet; never set it on a deployment
+that also serves Clerk users.
+
+Issue a token from backend/:
+    LOCAL_JWT_SECRET=... python -m src.utils.local_jwt user_123
+"""
+
+import base64
+import hashlib
+import hmac
+import json
+import os
+import sys
+import time
+from typing import Dict
+
+LOCAL_JWT_SECRET = os.getenv("LOCAL_JWT_SECRET")
+LOCAL_JWT_ISSUER = os.getenv("LOCAL_JWT_ISSUER", "trapsense-local")
+CLOCK_SKEW = 30  # seconds of leeway on exp / nbf
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def _b64decode(segment: str) -> bytes:
+    return base64.urlsafe_b64decode(segment + "=" * (-len(segment) % 4))
+
+
+def _sign(signing_input: bytes, secret: str) -> bytes:
+    return hmac.new(secret.encode(), signing_input, hashlib.sha256).digest()
+
+
+def issue_token(user_id: str, secret: str = LOCAL_JWT_SECRET, ttl: int = 3600,
+                issuer: str = LOCAL_JWT_ISSUER, **claims) -> str:
+    """Signed HS256 token with sub=user_id, valid for ttl seconds."""
+    if not secret:
+        raise ValueError("LOCAL_JWT_SECRET is not set")
+    now = int(time.time())
+    header = {"alg": "HS256", "typ": "JWT"}
+    payload = {"sub": user_id, "iss": issuer, "iat": now, "nbf": now, "exp": now + ttl, **claims}
+    signing_input = ".".join(
+        _b64encode(json.dumps(part, separators=(",", ":")).encode()) for part in (header, payload)
+    ).encode()
+    return f"{signing_input.decode()}.{_b64encode(_sign(signing_input, secret))}"
+
+
+def verify_token(token: str, secret: str = LOCAL_JWT_SECRET, issuer: str = LOCAL_JWT_ISSUER) -> Dict:
+    """
+    Check signature, issuer and validity window of a token from issue_token.
+
+    Returns:
+        the payload
+
+    Raises:
+        ValueError: malformed, wrongly signed, foreign or expired token
+    """
+    try:
+        header_b64, payload_b64, signature_b64 = token.split(".")
+        header = json.loads(_b64decode(header_b64))
+        payload = json.loads(_b64decode(payload_b64))
+        signature = _b64decode(signature_b64)
+    except (ValueError, TypeError):
+        raise ValueError("Malformed token")
+    if not isinstance(header, dict) or not isinstance(payload, dict):
+        raise ValueError("Malformed token")
+    if header.get("alg") != "HS256":
+        raise ValueError("Unsupported token algorithm")
+    if not hmac.compare_digest(_sign(f"{header_b64}.{payload_b64}".encode(), secret), signature):
+        raise ValueError("Invalid token signature")
+    if payload.get("iss") != issuer:
+        raise ValueError("Unexpected token issuer")
+    now = time.time()
+    if payload.get("exp", 0) < now - CLOCK_SKEW or payload.get("nbf", 0) > now + CLOCK_SKEW:
+        raise ValueError("Token expired or not yet valid")
+    return payload
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        sys.exit("usage: python -m src.utils.local_jwt <user_id>")
+    print(issue_token(sys.argv[1]))
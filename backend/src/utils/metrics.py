@@ -0,0 +1,231 @@
+"""
+Minimal in-process metrics with Prometheus text exposition.
+
+Collection on the hot path is a lock plus a few integer/float updates, so
+stages can be timed per image without measurable overhead. Rendering
+happens only when /metrics is scraped.
+"""
+
+import bisect
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Tuple
+
+# Seconds; covers sub-millisecond decode up to slow multi-minute queue waits
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0)
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{n}="{v}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def total(self) -> float:
+        with self._lock:
+            return sum(self._values.values())
+
+    def render(self):
+        with self._lock:
+            items = list(self._values.items())
+        return self.header() + [f"{self.name}{_format_labels(self.labelnames, k)} {v}" for k, v in items]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, *args, callback: Callable[[], float] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._callback = callback
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def render(self):
+        if self._callback is not None:
+            return self.header() + [f"{self.name} {self._callback()}"]
+        with self._lock:
+            items = list(self._values.items())
+        return self.header() + [f"{self.name}{_format_labels(self.labelnames, k)} {v}" for k, v in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, *args, buckets: Iterable[float] = DEFAULT_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [per-bucket counts..., +Inf count], sum
+        self._counts: Dict[Tuple[str, ...], list] = {}
+        self._sums: Dict[Tuple[str, ...], float] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._counts.get(key)
+            if counts is None:
+                counts = self._counts[key] = [0] * (len(self.buckets) + 1)
+                self._sums[key] = 0.0
+            counts[index] += 1
+            self._sums[key] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self):
+        with self._lock:
+            items = [(k, list(c), self._sums[k]) for k, c in self._counts.items()]
+        lines = self.header()
+        for key, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                bucket_labels = _format_labels(self.labelnames, key, 'le="%s"' % le)
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class RateWindow:
+    """Events per second over a sliding window (for images/sec)"""
+
+    def __init__(self, window: float = 60.0):
+        self.window = window
+        self._events = deque()
+        self._lock = threading.Lock()
+
+    def mark(self):
+        now = time.monotonic()
+        with self._lock:
+            self._events.append(now)
+            self._trim(now)
+
+    def rate(self) -> float:
+        now = time.monotonic()
+        with self._lock:
+            self._trim(now)
+            return len(self._events) / self.window
+
+    def _trim(self, now: float):
+        while self._events and self._events[0] < now - self.window:
+            self._events.popleft()
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+# ------------------ Pipeline metrics ------------------
+
+stage_seconds = registry.register(Histogram(
+    "trapsense_stage_seconds", "Time spent per pipeline stage", ["stage"]))
+images_processed = registry.register(Counter(
+    "trapsense_images_processed_total", "Images that finished processing", ["classification"]))
+processing_errors = registry.register(Counter(
+    "trapsense_processing_errors_total", "Images whose processing failed"))
+queue_depth = registry.register(Gauge(
+    "trapsense_queue_depth", "Media queued for inference and not yet started", ["priority"]))
+queue_wait_seconds = registry.register(Histogram(
+    "trapsense_queue_wait_seconds", "Time from submission to a worker picking the job up", ["priority"]))
+upload_to_prediction_seconds = registry.register(Histogram(
+    "trapsense_upload_to_prediction_seconds", "Time from media creation to prediction write"))
+
+throughput_window = RateWindow(60.0)
+registry.register(Gauge(
+    "trapsense_images_per_second", "Images processed per second over the last minute",
+    callback=throughput_window.rate))
+
+
+def _blank_ratio() -> float:
+    total = images_processed.total()
+    return images_processed.value(classification="blank") / total if total else 0.0
+
+
+def _error_ratio() -> float:
+    total = images_processed.total()
+    return processing_errors.total() / total if total else 0.0
+
+
+registry.register(Gauge("trapsense_blank_ratio", "Fraction of processed images classified blank",
+                        callback=_blank_ratio))
+registry.register(Gauge("trapsense_error_ratio", "Fraction of processed images that failed",
+                        callback=_error_ratio))
+
+
+def stage_timer(stage: str):
+    """Context manager timing one pipeline stage."""
+    return stage_seconds.time(stage=stage)
+
+
+def record_processed(classification: str):
+    images_processed.inc(classification=classification)
+    if classification == "error":
+        processing_errors.inc()
+    throughput_window.mark()
@@ -0,0 +1,151 @@
+"""
+Opt-in sampling profiler for API requests and worker tasks.
+
+A sampler thread snapshots Python stacks with sys._current_frames() every
+PROFILE_INTERVAL seconds and aggregates them in the collapsed-stack format
+("root;caller;callee count" per line) that flamegraph.pl, speedscope and
+inferno read directly. Nothing is sampled unless a request or task is
+selected, so the cost when idle is one random() call.
+
+Requests are profiled when an admin sends `X-Profile: 1` (or `?profile=1`),
+or at random with probability PROFILE_SAMPLE_RATE. Worker tasks decorated
+with @profile_task are profiled with probability PROFILE_TASK_SAMPLE_RATE.
+"""
+
+import functools
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Iterable, Optional
+
+from starlette.middleware.base import BaseHTTPMiddleware
+
+from .utils import is_admin
+
+logger = logging.getLogger(__name__)
+
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", "./profiles")
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.005"))
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_TASK_SAMPLE_RATE = float(os.getenv("PROFILE_TASK_SAMPLE_RATE", "0"))
+
+# Leaf frames of threads that are just parked (idle pool workers, event loop select)
+_IDLE_LEAVES = {
+    ("threading.py", "wait"),
+    ("queue.py", "get"),
+    ("selectors.py", "select"),
+    ("thread.py", "_worker"),
+}
+
+
+class SamplingProfiler:
+    """Collects collapsed stacks from a set of threads (or every thread) until stopped"""
+
+    def __init__(self, thread_ids: Optional[Iterable[int]] = None, interval: float = PROFILE_INTERVAL):
+        self.thread_ids = set(thread_ids) if thread_ids is not None else None
+        self.interval = interval
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiler-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self
+
+    def _run(self):
+        own_id = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id or (self.thread_ids is not None and thread_id not in self.thread_ids):
+                    continue
+                leaf = (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name)
+                if self.thread_ids is None and leaf in _IDLE_LEAVES:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.samples[";".join(reversed(stack))] += 1
+
+    def write(self, label: str) -> Optional[str]:
+        """Write collapsed stacks to PROFILE_DIR and return the file path (None if nothing sampled)."""
+        if not self.samples:
+            return None
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        safe_label = re.sub(r"[^A-Za-z0-9_.-]+", "_", label).strip("_")[:80] or "profile"
+        path = os.path.join(PROFILE_DIR, f"{int(time.time() * 1000)}_{safe_label}.folded")
+        with open(path, "w") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+        return path
+
+
+class ProfilingMiddleware(BaseHTTPMiddleware):
+    """
+    Profiles selected requests. Sync endpoints run in a thread pool, so every
+    busy thread is sampled for the duration of the request; the thread name
+    is the root frame, and concurrent requests show up under their own threads.
+    """
+
+    async def dispatch(self, request, call_next):
+        forced = request.headers.get("x-profile") == "1" or request.query_params.get("profile") == "1"
+        if forced and not is_admin(request):
+            forced = False
+        if not forced and not (PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE):
+            return await call_next(request)
+
+        profiler = SamplingProfiler().start()
+        start = time.perf_counter()
+        try:
+            response = await call_next(request)
+        finally:
+            profiler.stop()
+        elapsed = time.perf_counter() - start
+
+        path = profiler.write(f"{request.method}_{request.url.path}")
+        if path:
+            logger.info(f"Profiled {request.method} {request.url.path} ({elapsed:.3f}s) -> {path}")
+            if forced:
+                response.headers["X-Profile-File"] = os.path.basename(path)
+        return response
+
+
+def profile_task(name: Optional[str] = None, sample_rate: Optional[float] = None):
+    """Decorator profiling a worker task (only the calling thread) on a sample of invocations."""
+
+    def decorator(fn):
+        label = name or fn.__name__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            rate = PROFILE_TASK_SAMPLE_RATE if sample_rate is None else sample_rate
+            if not rate or random.random() >= rate:
+                return fn(*args, **kwargs)
+            profiler = SamplingProfiler(thread_ids=[threading.get_ident()]).start()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                profiler.stop()
+                path = profiler.write(f"task_{label}")
+                if path:
+                    logger.info(f"Profiled task {label} -> {path}")
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,66 @@
+"""
+Fast JSON for large list responses.
+
+Listing endpoints select plain columns (no ORM hydration, no per-row Pydantic
+validation) and hand the row dicts straight to `dumps`. orjson is used when
+installed (the `fast-json` extra), which serializes datetimes natively and is
+roughly an order of magnitude faster than the stdlib; otherwise we fall back
+to json with a compact separator set.
+
+`?format=ndjson` switches a listing to newline-delimited JSON streamed in
+batches, so memory stays flat regardless of result size.
+"""
+
+import json
+from datetime import date, datetime
+from typing import Iterable, Iterator
+
+from fastapi import Request, Response
+from fastapi.responses import StreamingResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+NDJSON_BATCH_ROWS = 1000
+
+
+def _default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if hasattr(value, "model_dump"):
+        return value.model_dump(mode="json")
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(payload) -> bytes:
+    """Serialize a JSON-able payload (dicts, lists, datetimes) to bytes."""
+    if orjson is not None:
+        return orjson.dumps(payload, default=_default)
+    return json.dumps(payload, default=_default, separators=(",", ":")).encode()
+
+
+def json_response(payload, headers: dict = None) -> Response:
+    return Response(content=dumps(payload), media_type="application/json", headers=headers)
+
+
+def wants_ndjson(request: Request) -> bool:
+    return request.query_params.get("format") == "ndjson"
+
+
+def _ndjson_chunks(rows: Iterable[dict]) -> Iterator[bytes]:
+    batch = []
+    for row in rows:
+        batch.append(dumps(row))
+        if len(batch) >= NDJSON_BATCH_ROWS:
+            yield b"\n".join(batch) + b"\n"
+            batch = []
+    if batch:
+        yield b"\n".join(batch) + b"\n"
+
+
+def ndjson_response(rows: Iterable[dict]) -> StreamingResponse:
+    """Stream rows as newline-delimited JSON."""
+    return StreamingResponse(_ndjson_chunks(rows), media_type=NDJSON_MEDIA_TYPE)
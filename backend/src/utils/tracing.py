@@ -0,0 +1,254 @@
+"""
+Lightweight distributed tracing from API request to prediction write.
+
+Spans nest through a contextvar, so anything called inside `with span(...)`
+becomes a child. Work handed to another thread or queued for later carries
+`current_trace_context()` along and re-enters it with `resume(ctx)`.
+Incoming W3C `traceparent` headers are honoured, so traces join an upstream
+caller's trace.
+
+TRACE_EXPORTER selects where finished spans go:
+- "none" (default): tracing is a no-op apart from ID bookkeeping
+- "file": one JSON object per line in TRACE_FILE
+- "otlp": OTLP/HTTP JSON batches POSTed to OTLP_ENDPOINT (any collector,
+  e.g. a local otel-collector or Jaeger with OTLP enabled)
+"""
+
+import atexit
+import contextvars
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+import requests
+from starlette.middleware.base import BaseHTTPMiddleware
+
+from .metrics import stage_seconds
+
+logger = logging.getLogger(__name__)
+
+
+TRACE_EXPORTER = os.getenv("TRACE_EXPORTER", "none").lower()
+TRACE_FILE = os.getenv("TRACE_FILE", "./traces.jsonl")
+OTLP_ENDPOINT = os.getenv("OTLP_ENDPOINT", "http://localhost:4318/v1/traces")
+SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "trapsense-backend")
+EXPORT_BATCH_SIZE = 256
+EXPORT_INTERVAL = 2.0
+
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "start_ns", "end_ns", "attributes", "error")
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], attributes: Dict):
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = attributes
+        self.error = None
+
+    def set_attribute(self, key: str, value):
+        self.attributes[key] = value
+
+    def to_dict(self) -> Dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_ns": self.start_ns,
+            "end_ns": self.end_ns,
+            "duration_ms": (self.end_ns - self.start_ns) / 1e6 if self.end_ns else None,
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+# Either a live Span or a remote parent {"trace_id", "span_id"} from resume()
+_current = contextvars.ContextVar("trapsense_span", default=None)
+
+
+def _parent_ids():
+    parent = _current.get()
+    if parent is None:
+        return os.urandom(16).hex(), None
+    if isinstance(parent, Span):
+        return parent.trace_id, parent.span_id
+    return parent["trace_id"], parent["span_id"]
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Record a span around a block; yields the Span so callers can add attributes."""
+    trace_id, parent_id = _parent_ids()
+    current = Span(name, trace_id, parent_id, attributes)
+    token = _current.set(current)
+    try:
+        yield current
+    except Exception as e:
+        current.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current.reset(token)
+        current.end_ns = time.time_ns()
+        _exporter.submit(current)
+
+
+@contextmanager
+def stage(name: str, **attributes):
+    """A pipeline stage: a span plus the trapsense_stage_seconds histogram."""
+    start = time.perf_counter()
+    try:
+        with span(name, **attributes) as current:
+            yield current
+    finally:
+        stage_seconds.observe(time.perf_counter() - start, stage=name)
+
+
+def current_trace_context() -> Optional[Dict[str, str]]:
+    """Context to hand to queued work so its spans join this trace."""
+    parent = _current.get()
+    if parent is None:
+        return None
+    if isinstance(parent, Span):
+        return {"trace_id": parent.trace_id, "span_id": parent.span_id}
+    return dict(parent)
+
+
+@contextmanager
+def resume(context: Optional[Dict[str, str]]):
+    """Make spans opened inside the block children of a propagated context."""
+    if not context:
+        yield
+        return
+    token = _current.set(context)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+def parse_traceparent(header: Optional[str]) -> Optional[Dict[str, str]]:
+    """Parse a W3C traceparent header ("00-<trace_id>-<span_id>-<flags>")."""
+    if not header:
+        return None
+    parts = header.strip().split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    return {"trace_id": parts[1], "span_id": parts[2]}
+
+
+def format_traceparent(current: Span) -> str:
+    return f"00-{current.trace_id}-{current.span_id}-01"
+
+
+# ------------------ Export ------------------
+
+class _Exporter:
+    """Batches finished spans on a background thread so the hot path only enqueues"""
+
+    def __init__(self, kind: str):
+        self.kind = kind
+        self._queue = queue.Queue(maxsize=100000)
+        self._thread = None
+        if kind in ("file", "otlp"):
+            self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+            self._thread.start()
+            atexit.register(self.flush)
+            logger.info(f"Tracing enabled ({kind})")
+
+    def submit(self, finished: Span):
+        if self._thread is None:
+            return
+        try:
+            self._queue.put_nowait(finished)
+        except queue.Full:
+            pass  # drop rather than block the pipeline
+
+    def _drain(self, block: bool):
+        batch = []
+        try:
+            batch.append(self._queue.get(timeout=EXPORT_INTERVAL) if block else self._queue.get_nowait())
+            while len(batch) < EXPORT_BATCH_SIZE:
+                batch.append(self._queue.get_nowait())
+        except queue.Empty:
+            pass
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._drain(block=True)
+            if batch:
+                self._export(batch)
+
+    def flush(self):
+        while True:
+            batch = self._drain(block=False)
+            if not batch:
+                return
+            self._export(batch)
+
+    def _export(self, batch):
+        try:
+            if self.kind == "file":
+                with open(TRACE_FILE, "a") as f:
+                    for s in batch:
+                        f.write(json.dumps(s.to_dict(), default=str) + "\n")
+            else:
+                requests.post(OTLP_ENDPOINT, json=_to_otlp(batch), timeout=5)
+        except Exception as e:
+            logger.warning(f"Failed to export {len(batch)} spans: {e}")
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _to_otlp(batch) -> Dict:
+    spans = []
+    for s in batch:
+        item = {
+            "traceId": s.trace_id,
+            "spanId": s.span_id,
+            "name": s.name,
+            "kind": 1,
+            "startTimeUnixNano": str(s.start_ns),
+            "endTimeUnixNano": str(s.end_ns),
+            "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in s.attributes.items() if v is not None],
+            "status": {"code": 2, "message": s.error} if s.error else {"code": 1},
+        }
+        if s.parent_id:
+            item["parentSpanId"] = s.parent_id
+        spans.append(item)
+    return {"resourceSpans": [{
+        "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+        "scopeSpans": [{"scope": {"name": "trapsense"}, "spans": spans}],
+    }]}
+
+
+_exporter = _Exporter(TRACE_EXPORTER)
+
+
+class TracingMiddleware(BaseHTTPMiddleware):
+    """Root span per request; honours and returns W3C traceparent"""
+
+    async def dispatch(self, request, call_next):
+        with resume(parse_traceparent(request.headers.get("traceparent"))):
+            with span(f"{request.method} {request.url.path}", **{"http.method": request.method}) as root:
+                response = await call_next(request)
+                root.set_attribute("http.status_code", response.status_code)
+                response.headers["traceparent"] = format_traceparent(root)
+                return response
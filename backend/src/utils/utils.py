@@ -10,16 +10,41 @@ from fastapi import HTTPException
 import os
 from dotenv import load_dotenv
 from collections import namedtuple
+import hmac
+import logging
 import uuid
 
+load_dotenv() # Load environment variables from .env file(it looks for .env file in the root directory by default)
+
+# After load_dotenv: local_jwt reads LOCAL_JWT_SECRET at import
+from .local_jwt import LOCAL_JWT_SECRET, verify_token  # noqa: E402
+
 
 UserObj = namedtuple("UserObj", ["id"])
 
-load_dotenv() # Load environment variables from .env file(it looks for .env file in the root directory by default)
 clerk_sdk=Clerk(bearer_auth=os.getenv("CLERK_SECRET_KEY")) #This is my secret key
 
+if LOCAL_JWT_SECRET:
+    logging.getLogger(__name__).warning("LOCAL_JWT_SECRET is set: trusting locally issued tokens instead of Clerk")
+
+
+def _authenticate_local(request):
+    """Bearer token from the local issuer (see utils/local_jwt.py)"""
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        raise HTTPException(status_code=401, detail="Invalid Token")
+    try:
+        payload = verify_token(token)
+    except ValueError as e:
+        raise HTTPException(status_code=401, detail=f"Unauthorized/Invalid Credentials: {str(e)}")
+    if not payload.get("sub"):
+        raise HTTPException(status_code=401, detail="Invalid token payload")
+    return UserObj(id=payload["sub"])
+
 
 def authenticate_and_get_user(request):
+    if LOCAL_JWT_SECRET:
+        return _authenticate_local(request)
     try:
         request_state = clerk_sdk.authenticate_request(
             request,
@@ -47,3 +72,25 @@ def authenticate_and_get_user(request):
         # Treat unexpected errors during auth as unauthorized rather than server error to avoid leaking
         # internal exception messages to clients.
         raise HTTPException(status_code=401, detail=f"Unauthorized/Invalid Credentials: {str(e)}")
+
+
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+ADMIN_USER_IDS = {u.strip() for u in os.getenv("ADMIN_USER_IDS", "").split(",") if u.strip()}
+
+
+def is_admin(request) -> bool:
+    """True if the request carries the X-Admin-Token or comes from a Clerk user listed in ADMIN_USER_IDS."""
+    token = request.headers.get("x-admin-token")
+    if ADMIN_TOKEN and token and hmac.compare_digest(token, ADMIN_TOKEN):
+        return True
+    if ADMIN_USER_IDS and request.headers.get("authorization"):
+        try:
+            return authenticate_and_get_user(request).id in ADMIN_USER_IDS
+        except HTTPException:
+            return False
+    return False
+
+
+def require_admin(request):
+    if not is_admin(request):
+        raise HTTPException(status_code=403, detail="Admin access required")
@@ -0,0 +1,64 @@
+"""Round trips of the persisted detections blob (Media.detections, format DET1)."""
+
+import json
+
+import numpy as np
+import pytest
+
+from src.utils.detections import MAGIC, Detections, detection_count, predictions_view
+
+LEGACY = [
+    {"bbox": [10.0, 20.0, 110.5, 220.25], "confidence": 0.875, "class_id": 22, "class_name": "zebra"},
+    {"bbox": [0.0, 0.0, 64.0, 48.0], "confidence": 0.5, "class_id": 3, "class_name": "gazelle"},
+    {"bbox": [5.0, 5.0, 15.0, 15.0], "confidence": 0.25, "class_id": 22, "class_name": "zebra"},
+]
+
+
+def test_empty_round_trip():
+    blob = Detections.empty().to_bytes()
+    assert blob.startswith(MAGIC)
+    restored = Detections.from_bytes(blob)
+    assert len(restored) == 0
+    assert restored.to_dicts() == []
+    assert restored.species() == []
+    assert restored.max_confidence() == 0.0
+    assert detection_count(blob, None) == 0
+
+
+def test_empty_legacy_input():
+    assert len(Detections.from_dicts([])) == 0
+    assert len(Detections.from_dicts(None)) == 0
+
+
+def test_legacy_dicts_round_trip():
+    blob = Detections.from_dicts(LEGACY).to_bytes()
+    restored = Detections.from_bytes(blob)
+    assert restored.to_dicts() == LEGACY
+    assert detection_count(blob, None) == len(LEGACY)
+    assert predictions_view(blob, None) == LEGACY
+
+
+def test_class_names_survive():
+    names = {0: "aardvark", 7: "Thomson's gazelle", 300: "gnou à queue noire"}
+    detections = Detections(np.zeros((3, 4)), [0.9, 0.8, 0.7], [0, 7, 300], names)
+    restored = Detections.from_bytes(detections.to_bytes())
+    assert restored.names == names
+    assert restored.class_names() == ["aardvark", "Thomson's gazelle", "gnou à queue noire"]
+    assert restored.species() == sorted(names.values())
+
+
+def test_names_of_absent_classes_are_dropped():
+    detections = Detections([[1, 2, 3, 4]], [0.5], [1], {0: "person", 1: "lion", 2: "car"})
+    assert Detections.from_bytes(detections.to_bytes()).names == {1: "lion"}
+
+
+def test_legacy_json_column_still_served():
+    assert predictions_view(None, json.dumps(LEGACY)) == LEGACY
+    assert detection_count(None, json.dumps(LEGACY)) == len(LEGACY)
+    assert predictions_view(None, json.dumps({"error": "boom"})) == {"error": "boom"}
+    assert detection_count(None, json.dumps({"error": "boom"})) == 0
+
+
+def test_rejects_foreign_blob():
+    with pytest.raises(ValueError):
+        Detections.from_bytes(b"NOPE" + b"\0" * 8)
@@ -6,6 +6,7 @@ function ExportNonBlank({ uploadedFiles, predictions }) {
   const [open, setOpen] = useState(false);
   const [downloading, setDownloading] = useState(false);
   const [error, setError] = useState(null);
+  const [progress, setProgress] = useState(null);
   const { getToken } = useAuth();
 
   // Filter non-blank images
@@ -18,12 +19,13 @@ function ExportNonBlank({ uploadedFiles, predictions }) {
 
   const nonBlankImages = getNonBlankImages();
   
-  // Download ZIP file from backend
+  // Start (or reuse) a background export job, poll it, then download from storage
   const handleDownloadZip = async () => {
   if (nonBlankImages.length === 0) return;
 
   setDownloading(true);
   setError(null);
+  setProgress(null);
 
   try {
     const API_BASE_URL = 'http://localhost:8000/api';
@@ -31,8 +33,8 @@ function ExportNonBlank({ uploadedFiles, predictions }) {
     // Call getToken from the top-level hook
     const token = await getToken();
 
-    const response = await fetch(`${API_BASE_URL}/media/export/zip`, {
-      method: 'GET',
+    const response = await fetch(`${API_BASE_URL}/media/export/jobs`, {
+      method: 'POST',
       headers: {
         'Authorization': `Bearer ${token}`
       }
@@ -43,22 +45,47 @@ function ExportNonBlank({ uploadedFiles, predictions }) {
       throw new Error(errorText || `Export failed: ${response.statusText}`);
     }
 
-    const blob = await response.blob();
-    const url = window.URL.createObjectURL(blob);
+    let job = await response.json();
+    while (job.status === 'pending' || job.status === 'running') {
+      setProgress(job);
+      await new Promise(resolve => setTimeout(resolve, 1500));
+      const pollToken = await getToken();
+      const poll = await fetch(`${API_BASE_URL}/media/export/jobs/${job.job_id}`, {
+        headers: {
+          'Authorization': `Bearer ${pollToken}`
+        }
+      });
+      if (!poll.ok) {
+        throw new Error(`Export status failed: ${poll.statusText}`);
+      }
+      job = await poll.json();
+    }
+
+    if (!['completed', 'partial'].includes(job.status) || !job.download_url) {
+      throw new Error(job.error || 'Export failed');
+    }
+    setProgress(job);
+
+    // Presigned URL: the browser downloads straight from storage
     const a = document.createElement('a');
-    a.href = url;
+    a.href = job.download_url;
     a.download = `non_blank_images_${new Date().toISOString().split('T')[0]}.zip`;
     document.body.appendChild(a);
     a.click();
-    window.URL.revokeObjectURL(url);
     document.body.removeChild(a);
 
+    if (job.status === 'partial') {
+      // Partial archives are never reused; exporting again retries the missing images
+      setError(`${job.failed} image(s) could not be included. Export again to retry them.`);
+      return;
+    }
     setOpen(false);
   } catch (err) {
     console.error("ZIP download failed:", err);
     setError(err.message || "Failed to download ZIP file");
   } finally {
     setDownloading(false);
+    setProgress(null);
   }
 };
 
@@ -232,12 +259,23 @@ function ExportNonBlank({ uploadedFiles, predictions }) {
               {downloading && (
                 <div className="mb-6 animate-fade-in">
                   <div className="flex items-center justify-between mb-2">
-                    <span className="text-sm font-medium text-gray-700">Preparing ZIP archive...</span>
+                    <span className="text-sm font-medium text-gray-700">
+                      {progress?.reused ? "Reusing previous ZIP archive..." : "Preparing ZIP archive..."}
+                    </span>
+                    {progress && progress.total > 0 && (
+                      <span className="text-xs text-gray-500">
+                        {progress.processed + progress.failed} / {progress.total}
+                      </span>
+                    )}
                   </div>
                   <div className="w-full bg-gray-200 rounded-full h-2 overflow-hidden">
-                    <div className="h-full bg-green-800 animate-pulse" style={{width: '100%'}} />
+                    {progress ? (
+                      <div className="h-full bg-green-800 transition-all" style={{width: `${Math.round(progress.progress * 100)}%`}} />
+                    ) : (
+                      <div className="h-full bg-green-800 animate-pulse" style={{width: '100%'}} />
+                    )}
                   </div>
-                  <p className="text-xs text-gray-500 mt-2">This may take a moment for large collections</p>
+                  <p className="text-xs text-gray-500 mt-2">The archive is built in the background; you can keep this window open</p>
                 </div>
               )}
             </div>
@@ -164,7 +164,8 @@ function UploadData() {
           files: uploads.map(u => ({ 
             file_url: u.file_url, 
             file_type: u.file_type,
-            folder_path: u.folder_path
+            folder_path: u.folder_path,
+            last_modified: u.file.lastModified
           }))
         })
       });
@@ -465,7 +466,7 @@ function UploadData() {
                 >
                   <div className="relative">
                     <img
-                      src={file.file_url}
+                      src={file.thumbnail_url || file.file_url}
                       alt="Uploaded"
                       className="w-full h-40 object-cover"
                       onError={(e) => {
@@ -540,7 +541,7 @@ function UploadData() {
           >
             <div className="flex items-center justify-center bg-gray-900 rounded-lg">
               <img
-                src={selectedFileForPreview.file_url}
+                src={selectedFileForPreview.preview_url || selectedFileForPreview.file_url}
                 alt="Preview"
                 className="max-w-full max-h-[80vh] object-contain rounded-lg"
               />